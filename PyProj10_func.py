@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+This is the function script of PyProj10_main. It holds the append engine of the APPEND tab,
+which appends the feature classes of many databases (e.g. the AOI databases made by the
+SPLIT tab) to the feature classes of the same name in one target database.
+
+The source databases are read concurrently by a pool of reader processes. The readers send
+their rows in batches through a queue to the main process, which is the only writer: it keeps
+the rows of each target feature class together and writes them with an insert cursor a large
+batch at a time, instead of calling Append_management once per feature class per database.
+Like Append_management with NO_TEST, the fields are matched by name, source fields the target
+does not have are left out and the features are projected to the coordinate system of the target.
+
+Appending can be incremental. The target database then keeps a ledger table with a content
+fingerprint of every source database and feature class it has appended, and every appended feature
+records the path of its source database in a source field. A later run skips the sources whose
+fingerprint is unchanged and replaces the features of the sources that changed.
+
+Any folder paths have been change to empty quotes for privacy and flexibility.
+
+@author: dknight2
+"""
+import os, sys
+import time
+import datetime
+import hashlib
+import traceback
+import multiprocessing
+from queue import Empty
+import arcpy
+
+sourceField = "APPEND_SOURCE"     # source database of an appended feature
+ledgerTable = "APPEND_LEDGER"     # table of the sources appended to the target database
+ledgerFields = ["SOURCE", "FEATURE_CLASS", "FINGERPRINT", "FEATURES", "EXTENT", "APPENDED"]
+ledgerTypes = ["TEXT", "TEXT", "TEXT", "LONG", "TEXT", "DATE"]
+
+# State of a reader process, set up by initAppendReader: the queue the rows are sent to
+appendState = {}
+
+# Pool initializer of the reader processes
+def initAppendReader(queue):
+    appendState['queue'] = queue
+
+# Returns the schema of each feature class of the target database, by lower case name: its path, the fields
+# that can be written (not the object ID and the fields the geodatabase maintains) and its spatial reference
+def targetSchemas(appendTo):
+    schemas = {}
+    with arcpy.EnvManager(workspace = appendTo):
+        fcList = arcpy.ListFeatureClasses()
+    for fc in fcList:
+        path = os.path.join(appendTo, fc)
+        fields = [field.name for field in arcpy.ListFields(path) if field.type not in ('OID', 'Geometry') and field.editable and field.name.upper() != sourceField]
+        schemas[fc.lower()] = (path, fields, arcpy.Describe(path).spatialReference.exportToString())
+    return schemas
+
+# Adds the source field, with an attribute index, to the target feature classes that do not have it yet
+def addSourceFields(schemas):
+    for path, fields, srText in schemas.values():
+        if sourceField not in [field.name.upper() for field in arcpy.ListFields(path)]:
+            arcpy.AddField_management(path, sourceField, "TEXT", field_length = 1024)
+            arcpy.AddIndex_management(path, sourceField, sourceField + "_IDX")
+
+# Returns the ledger of the target database as {(source database, lower case feature class): (fingerprint,
+# features, extent)}, creating the ledger table (or the fields it lacks) when the database does not have it yet
+def readLedger(appendTo):
+    table = os.path.join(appendTo, ledgerTable)
+    if not arcpy.Exists(table):
+        arcpy.CreateTable_management(appendTo, ledgerTable)
+    existing = [field.name.upper() for field in arcpy.ListFields(table)]
+    for name, fieldType in zip(ledgerFields, ledgerTypes):
+        if name not in existing:
+            arcpy.AddField_management(table, name, fieldType, field_length = 1024)
+    with arcpy.da.SearchCursor(table, ledgerFields[:5]) as cursor:
+        return {(source, fc.lower()): (fingerprint, features, extent) for source, fc, fingerprint, features, extent in cursor}
+
+# Records the appended sources, [(source database, feature class, fingerprint, features, extent)], in the
+# ledger table, replacing their earlier entries
+def writeLedger(appendTo, entries):
+    table = os.path.join(appendTo, ledgerTable)
+    keys = set((entry[0], entry[1].lower()) for entry in entries)
+    with arcpy.da.UpdateCursor(table, ledgerFields[:2]) as cursor:
+        for source, fc in cursor:
+            if (source, fc.lower()) in keys:
+                cursor.deleteRow()
+    now = datetime.datetime.now()
+    with arcpy.da.InsertCursor(table, ledgerFields) as cursor:
+        for entry in entries:
+            cursor.insertRow(list(entry) + [now])
+
+# Returns the key of a source database in the ledger and the source field: its normalized full path, so
+# databases of the same name in different folders are kept apart
+def sourceKey(database):
+    return os.path.normcase(os.path.abspath(database))
+
+# Returns a cheap summary of a source feature class, (feature count, extent text), that is compared with the
+# ledger before its rows are hashed: when it differs, the source has changed and is read only once
+def sourceSummary(source):
+    extent = arcpy.Describe(source).extent
+    return int(arcpy.GetCount_management(source)[0]), "{!r} {!r} {!r} {!r}".format(extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+
+# Returns a new content hash for rows with the given fields; the rows as they would be appended are added
+# with digest.update(repr(row)), so a change in the features, their attributes or the target schema changes it
+def rowsDigest(fields):
+    return hashlib.sha256(repr(fields).encode('utf-8'))
+
+# Returns the content fingerprint of a source feature class (see rowsDigest)
+def fingerprintRows(source, fields, spatialReference):
+    digest = rowsDigest(fields)
+    with arcpy.da.SearchCursor(source, fields, spatial_reference = spatialReference) as cursor:
+        for row in cursor:
+            digest.update(repr(row).encode('utf-8'))
+    return digest.hexdigest()
+
+# Reads every feature class of the database that the target has and hands its rows to send in messages of
+# ('rows', target path, fields, rows) with at most batchSize rows. Feature classes the target does not have
+# are reported with ('missing', database, feature class). The shape is read as WKB, or as JSON when it has
+# Z or M values, in the spatial reference of the target. The last message is ('done', database, {feature
+# class: rows read}), after ('error', database, traceback text) if the database could not be read.
+# With a ledger (see readLedger) a feature class whose fingerprint is in the ledger is reported with
+# ('unchanged', database, feature class) instead; its rows are only hashed first when its count and extent
+# match the ledger, otherwise they are hashed while they are sent. The rows are tagged with the source key
+# (see sourceKey) in the source field, preceded by ('replace', target path, source key) and followed by
+# ('appended', source key, feature class, fingerprint, rows, extent).
+def readDatabase(database, schemas, send, batchSize = 50000, ledger = None):
+    counts = {}
+    key = sourceKey(database)
+    try:
+        with arcpy.EnvManager(workspace = database):
+            fcList = arcpy.ListFeatureClasses()
+        for fc in fcList:
+            schema = schemas.get(fc.lower())
+            if schema is None:
+                send(('missing', database, fc))
+                continue
+            targetPath, targetFields, srText = schema
+            source = os.path.join(database, fc)
+            sourceFields = set(field.name.lower() for field in arcpy.ListFields(source))
+            description = arcpy.Describe(source)
+            fields = [fieldName for fieldName in targetFields if fieldName.lower() in sourceFields]
+            fields.append('SHAPE@JSON' if description.hasZ or description.hasM else 'SHAPE@WKB')
+            spatialReference = arcpy.SpatialReference()
+            spatialReference.loadFromString(srText)
+            outFields, tag, digest = fields, (), None
+            if ledger is not None:
+                entry = ledger.get((key, fc.lower()))
+                features, extent = sourceSummary(source)
+                if entry is not None and entry[1:] == (features, extent) and entry[0] == fingerprintRows(source, fields, spatialReference):
+                    send(('unchanged', database, fc))
+                    continue
+                send(('replace', targetPath, key))
+                outFields, tag, digest = [sourceField] + fields, (key,), rowsDigest(fields)
+
+            rows = []
+            counts[fc] = 0
+            with arcpy.da.SearchCursor(source, fields, spatial_reference = spatialReference) as cursor:
+                for row in cursor:
+                    if digest is not None:
+                        digest.update(repr(row).encode('utf-8'))
+                    rows.append(tag + row)
+                    if len(rows) >= batchSize:
+                        send(('rows', targetPath, outFields, rows))
+                        counts[fc] += len(rows)
+                        rows = []
+            if rows:
+                send(('rows', targetPath, outFields, rows))
+                counts[fc] += len(rows)
+            if digest is not None:
+                send(('appended', key, fc, digest.hexdigest(), counts[fc], extent))
+    except Exception:
+        send(('error', database, traceback.format_exc()))
+    send(('done', database, counts))
+
+# Pool job of a reader process: reads a database (see readDatabase) and sends its rows through the queue
+def readDatabaseJob(job):
+    database, schemas, batchSize, ledger = job
+    readDatabase(database, schemas, appendState['queue'].put, batchSize, ledger)
+    return database
+
+# AppendWriter is the single writer of an append run. It keeps the rows it is sent per target feature class
+# (and set of fields) and writes them with an insert cursor once batchSize rows are waiting, so every target
+# is written by one cursor at a time. Before the rows of a changed source are written, the features that
+# source appended before are deleted. It counts the rows written per target, the rows deleted, the missing
+# targets, unchanged sources and errors the readers reported, and keeps the ledger entries of the sources
+# it appended.
+class AppendWriter():
+
+    def __init__(self, batchSize = 50000):
+        self.batchSize = batchSize
+        self.buffers = {}
+        self.written = {}
+        self.missing = []
+        self.errors = []
+        self.unchanged = []
+        self.appended = []
+        self.deleted = 0
+        self.databases = 0
+
+    # handles a message of a reader; returns True when it is the last message of a database
+    def handle(self, message):
+        kind = message[0]
+        if kind == 'rows':
+            targetPath, fields, rows = message[1:]
+            key = (targetPath, tuple(fields))
+            buffer = self.buffers.setdefault(key, [])
+            buffer.extend(rows)
+            if len(buffer) >= self.batchSize:
+                self.flush(key)
+        elif kind == 'replace':
+            self.delete(*message[1:])
+        elif kind == 'appended':
+            self.appended.append(message[1:])
+        elif kind == 'unchanged':
+            self.unchanged.append(message[1:])
+        elif kind == 'missing':
+            self.missing.append(message[1:])
+        elif kind == 'error':
+            self.errors.append(message[1:])
+        elif kind == 'done':
+            self.databases += 1
+            return True
+        return False
+
+    # writes the rows waiting for a target with one insert cursor
+    def flush(self, key):
+        targetPath, fields = key
+        rows = self.buffers.pop(key, [])
+        if rows:
+            with arcpy.da.InsertCursor(targetPath, list(fields)) as cursor:
+                for row in rows:
+                    cursor.insertRow(row)
+            self.written[targetPath] = self.written.get(targetPath, 0) + len(rows)
+
+    # deletes the features a source database appended to a target before; they are all written, as the
+    # rows of the source are only sent after this message
+    def delete(self, targetPath, source):
+        where = "%s = '%s'" % (arcpy.AddFieldDelimiters(targetPath, sourceField), source.replace("'", "''"))
+        with arcpy.da.UpdateCursor(targetPath, [sourceField], where) as cursor:
+            for row in cursor:
+                cursor.deleteRow()
+                self.deleted += 1
+
+    # writes all rows that are still waiting
+    def close(self):
+        for key in list(self.buffers):
+            self.flush(key)
+
+# Appends the feature classes of the databases to the feature classes of the same name in appendTo. With
+# workers > 1 the databases are read by a pool of that many reader processes while this process writes;
+# otherwise they are read and written one after the other. Rows are written batchSize at a time. With
+# incremental, only the sources that are new or changed since the last run are appended (see readDatabase),
+# and the ledger is updated once all their rows are written; a run that fails leaves the ledger as it was,
+# so the next run appends those sources again, replacing whatever part of them was written. Returns a
+# summary: the databases read, the rows written per target, the rows replaced, the unchanged sources, the
+# missing targets, the errors and the seconds.
+def appendDatabases(databases, appendTo, workers = 1, batchSize = 50000, incremental = False):
+    start = time.perf_counter()
+    schemas = targetSchemas(appendTo)
+    ledger = None
+    if incremental:
+        addSourceFields(schemas)
+        ledger = readLedger(appendTo)
+    writer = AppendWriter(batchSize)
+    if workers <= 1 or len(databases) < 2:
+        for database in databases:
+            readDatabase(database, schemas, writer.handle, batchSize, ledger)
+    else:
+        if sys.platform == 'win32':
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe')) # make sure Python environment is used for running processes, even when this is run as a script tool
+        queue = multiprocessing.Queue(maxsize = 4 * workers)   # bounded, so the readers wait for the writer
+        jobs = [(database, schemas, batchSize, ledger) for database in databases]
+        others = set(process.pid for process in multiprocessing.active_children())
+        with multiprocessing.Pool(processes = workers, initializer = initAppendReader, initargs = (queue,)) as pool:
+            readers = set(process.pid for process in multiprocessing.active_children()) - others
+            failures = []
+            pool.map_async(readDatabaseJob, jobs, error_callback = failures.append)
+            # every database ends with a 'done' message, which is sent after all its rows, so the run is
+            # over when all of them have arrived; a reader that failed outside readDatabase or that was
+            # killed (the pool replaces it and its database is never finished) stops the run instead
+            done = 0
+            while done < len(jobs):
+                try:
+                    message = queue.get(timeout = 1)
+                except Empty:
+                    if failures:
+                        raise failures[0]
+                    if not readers <= set(process.pid for process in multiprocessing.active_children()):
+                        raise RuntimeError("A reader process ended before its databases were read")
+                    continue
+                done += writer.handle(message)
+    writer.close()
+    if incremental and writer.appended:
+        writeLedger(appendTo, writer.appended)
+    return {'databases': writer.databases, 'written': writer.written, 'replaced': writer.deleted,
+            'unchanged': writer.unchanged, 'missing': writer.missing, 'errors': writer.errors,
+            'seconds': time.perf_counter() - start}
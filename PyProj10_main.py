@@ -13,6 +13,8 @@ Any folder paths have been change to empty quotes for privacy and flexibility.
 import arcpy
 import os, sys
 import PyProj10_gui
+from PyProj5_func import splitDatabase
+from PyProj10_func import appendDatabases
 
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
 #=========================================
@@ -57,13 +59,16 @@ def runAppend():
 
         #Name of the appended database
         folderList = os.listdir(appendFrom)
-
-        for folder in folderList[1:]:
-            with arcpy.EnvManager(workspace =  appendFrom + "\\" + folder):
-                fcList3 = arcpy.ListFeatureClasses()
-                for fc in fcList3:
-                    arcpy.Append_management(os.path.join(appendFrom + "\\" + folder, fc), appendTo + "\\" + fc, "NO_TEST", "","","")
-        QMessageBox.information(mainWindow, 'Operation Complete!', 'Appending operation has been completed!. Please close the windows to exit the program.', QMessageBox.Ok )
+        databases = [appendFrom + "\\" + folder for folder in folderList[1:]]
+
+        summary = appendDatabases(databases, appendTo, workers = appendWorkers, batchSize = appendBatchSize, incremental = appendIncremental)
+        if summary['errors']:
+            raise RuntimeError(summary['errors'])
+        # feature classes the target does not have are not appended; they are listed as a warning
+        warning = ''
+        if summary['missing']:
+            warning = ' Warning: %d feature classes were skipped because the target database does not have them: %s.' % (len(summary['missing']), ', '.join(sorted(set(fc for database, fc in summary['missing']))))
+        QMessageBox.information(mainWindow, 'Operation Complete!', 'Appending operation has been completed!. %d features from %d databases were appended (%d replaced, %d unchanged feature classes skipped) in %.0f seconds.%s Please close the windows to exit the program.' % (sum(summary['written'].values()), summary['databases'], summary['replaced'], len(summary['unchanged']), summary['seconds'], warning), QMessageBox.Ok )
              
     except:
         QMessageBox.information(mainWindow, 'An Error has occurred! ', 'Appending operation has failed. Please check inputs and try again!', QMessageBox.Ok )
@@ -77,42 +82,9 @@ def runSplit():
         aoiBoundaries = "aoiBoundaries.shp"                     #AOI Boundary layer
         fcList = arcpy.ListFeatureClasses()                     #Original feature classes
         cellNameField = "Name"                                  # field used to select AOI
-        cellList = []                                           # list of AOI names
-        # Search through each AOI and get the name
-        # Because the data is stored as a tuple, some manipulation has to take place
-        # before it can be added to the list and used later on.
-        with arcpy.da.SearchCursor(aoiBoundaries, 'Name') as cursor:
-            for row in cursor:
-                item = str(row).strip("('").strip("',)")
-                cellList.append(item)
-
-        # Select the feature classes that intersect with each 
-        for cell in cellList:
-            # Create a query for the cell name
-            cellQuery = cellNameField + " = '" + cell + "'"
-            cellName = cell + ".gdb"
-            # Create a unique gdb for each cell name, which is the identifier for the gdb
-            arcpy.CreateFileGDB_management(outputFolder, cellName)
-    
-            # Loop through each fc in the fc list
-            for fc in fcList:
-                outFeatureClass = os.path.join(outputFolder + "\\" + cellName, fc)
-                arcpy.CopyFeatures_management(fc, outFeatureClass)
-
-                # Set each new gdb as a temporary environment
-            with arcpy.EnvManager(workspace = outputFolder + "\\" + cellName):
-                # Create a new list with the feature classes from each gdb
-                fcList2 = arcpy.ListFeatureClasses()
-                # Loop through the list
-                for fcs in fcList2:
-                    # Create a temporary aoi layer that will be used in the selection.
-                    tempAoiLayer = arcpy.MakeFeatureLayer_management(aoiBoundaries, "TempAoi", cellQuery)
-                    # Create a features layer that inverts the selection; i.e. everything outside the aoi
-                    features = arcpy.SelectLayerByLocation_management(fcs, "INTERSECT", tempAoiLayer, '', '',"INVERT")
-                    # Delete these selected features
-                    arcpy.DeleteFeatures_management(features)
-                    # Delete the temporary aoi layer
-                    arcpy.Delete_management(tempAoiLayer)
+
+        # Split each feature class into the geodatabase of every AOI it intersects, named after the AOI
+        splitDatabase(fcList, aoiBoundaries, outputFolder, cellNameField, workers = splitWorkers, cut = splitCut)
         QMessageBox.information(mainWindow, 'Operation Complete!', 'Splitting operation has been completed!. Please close the windows to exit the program.', QMessageBox.Ok )
 
     except:
@@ -121,28 +93,43 @@ def runSplit():
         
 
 #=========================================
-# create app and main window + dialog GUI
-#=========================================
-app = QApplication(sys.argv)  
-mainWindow = QMainWindow() 
-ui = PyProj10_gui.Ui_mainWindow() 
-ui.setupUi(mainWindow)
-#=========================================
-# connect signals
-#=========================================
-ui.AppendToTB.clicked.connect(selectAppendTo)
-ui.AppendFromTB.clicked.connect(selectAppendFrom)
-ui.InputDataTB.clicked.connect(selectSplitInput)
-ui.OutputFolderTB.clicked.connect(selectSplitOutput)
-ui.RunPB.clicked.connect(runTool)
-#=========================================
-# initialize global variables
+# split settings
 #=========================================
-tabHandler = {ui.AppendTab: runAppend, ui.SplitTab: runSplit}
+splitWorkers = 1                                        # processes that build the AOI databases (1 = no pool; e.g. cpu_count() - 1 leaves a core for the GUI)
+splitCut = False                                        # cut lines and polygons at the AOI boundaries (adds PARENT_OID)
 
-arcpy.env.overwriteOutput = True
 #=========================================
-# run app
+# append settings
 #=========================================
-mainWindow.show()
-sys.exit(app.exec_())
\ No newline at end of file
+appendWorkers = 1                                       # processes that read the source databases (1 = no pool); this process writes
+appendBatchSize = 50000                                 # rows written to a target feature class per insert cursor
+appendIncremental = False                               # only append new or changed sources; adds an APPEND_SOURCE field to the targets and an APPEND_LEDGER table
+
+# The pool workers of the split import this script, so the GUI is only created when it is run
+if __name__ == '__main__':
+    #=========================================
+    # create app and main window + dialog GUI
+    #=========================================
+    app = QApplication(sys.argv)  
+    mainWindow = QMainWindow() 
+    ui = PyProj10_gui.Ui_mainWindow() 
+    ui.setupUi(mainWindow)
+    #=========================================
+    # connect signals
+    #=========================================
+    ui.AppendToTB.clicked.connect(selectAppendTo)
+    ui.AppendFromTB.clicked.connect(selectAppendFrom)
+    ui.InputDataTB.clicked.connect(selectSplitInput)
+    ui.OutputFolderTB.clicked.connect(selectSplitOutput)
+    ui.RunPB.clicked.connect(runTool)
+    #=========================================
+    # initialize global variables
+    #=========================================
+    tabHandler = {ui.AppendTab: runAppend, ui.SplitTab: runSplit}
+
+    arcpy.env.overwriteOutput = True
+    #=========================================
+    # run app
+    #=========================================
+    mainWindow.show()
+    sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+This is the function script shared by PyProj5_A, PyProj5_B and the split tab of PyProj10_main.
+It splits a database into many databases according to AOI boundaries: a unique geodatabase
+named after each AOI, with only the features that intersect that AOI.
+
+The result is the same as copying every feature class into every AOI geodatabase and deleting
+the features outside the AOI with an inverted SelectLayerByLocation, but each feature class is
+read only once. Every feature is sent to the AOIs it intersects and written to their
+geodatabases in batches with insert cursors. The AOIs a feature intersects are found with an
+AOI index: cell arithmetic when the AOIs are a regular grid, a quadtree otherwise.
+
+In the optional cut mode the lines and polygons that cross an AOI boundary are cut there (with
+the vectorized clip routines of PyProj6_func, or with arcpy for features with Z or M values,
+which the vectorized routines do not carry), so every AOI only gets the piece inside it and
+lengths and areas are not counted twice. Every output feature then has the object ID of the
+feature it came from in the PARENT_OID field.
+
+With more than one worker, the AOI databases are built by a pool of processes. Each job is a
+group of neighbouring AOIs: the worker selects the features in the extent of the group and
+partitions them among its AOIs, so every AOI database has exactly one writer.
+
+Any folder paths have been change to empty quotes for privacy and flexibility.
+
+@author: dknight2
+"""
+import os, sys
+import time
+import struct
+import shutil
+import tempfile
+import contextlib
+import multiprocessing
+import numpy as np
+from PyProj6_func import orientRings, ringEdges, clipLines, clipPolygon, shapeWkb
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None    # the AOI index and the cut routines can be used (and tested) without ArcGIS
+
+# field of the output features in the cut mode with the object ID of the source feature
+parentField = "PARENT_OID"
+
+# State of a split worker process, set up by initSplitWorker: the lock that guards the shared output folder
+splitState = {}
+
+# Pool initializer: the workers do not inherit the arcpy environment of the main process, so the workspace
+# (the feature classes are named relative to it) is set again. lock is taken before a geodatabase is created
+# in the output folder, which all workers share.
+def initSplitWorker(workspace, lock):
+    arcpy.env.workspace = workspace
+    arcpy.env.overwriteOutput = True
+    splitState['lock'] = lock
+
+# Returns the guard for the shared output folder (no lock is needed when the split runs in one process)
+def outputFolderLock():
+    return splitState.get('lock') or contextlib.nullcontext()
+
+# Returns the names of the AOIs of the AOI boundary layer, in the order of the layer
+def listCells(aoiBoundaries, cellNameField = "Name"):
+    with arcpy.da.SearchCursor(aoiBoundaries, [cellNameField]) as cursor:
+        return [str(row[0]) for row in cursor]
+
+# Returns the AOI shapes by name, in the given spatial reference (so they can be compared with the features
+# of a feature class in that spatial reference). When several AOIs have the same name, their union is used:
+# the AOI layer was selected by name before, so its database got the features of all of them.
+def readAois(aoiBoundaries, cellNameField = "Name", spatialReference = None):
+    aois = {}
+    with arcpy.da.SearchCursor(aoiBoundaries, [cellNameField, 'SHAPE@'], spatial_reference = spatialReference) as cursor:
+        for name, shape in cursor:
+            name = str(name)
+            if aois.get(name) is not None and shape is not None:
+                shape = aois[name].union(shape)
+            elif shape is None:
+                shape = aois.get(name)
+            aois[name] = shape
+    return aois
+
+# AoiIndex answers which AOIs contain or intersect a geometry without testing every AOI. When the AOIs are
+# the rectangles of a regular grid (the same width and height, aligned on the grid), the candidates for a
+# geometry are found with cell arithmetic on its envelope; otherwise the AOI envelopes are kept in a
+# quadtree. Only the candidates are tested with the exact geometry, and on a grid a geometry whose envelope
+# lies inside a cell needs no exact test at all.
+class AoiIndex():
+
+    def __init__(self, aois, leafSize = 32, maxDepth = 16):
+        self.names = [name for name in aois if aois[name] is not None]
+        self.shapes = [aois[name] for name in self.names]
+        extents = [shape.extent for shape in self.shapes]
+        self.envelopes = np.array([(e.XMin, e.YMin, e.XMax, e.YMax) for e in extents], dtype = float).reshape(-1, 4)
+        self.grid = regularGrid(self.envelopes, np.array([shape.area for shape in self.shapes], dtype = float))
+        self.tree = QuadTree(self.envelopes, leafSize, maxDepth) if self.grid is None else None
+        self.clippers = {}      # oriented rings and edges of the AOIs used by cut
+
+    # a short description of the index for the messages of the split
+    def describe(self):
+        if self.grid is not None:
+            return "regular grid of {} x {} cells ({} AOIs)".format(self.grid.slots.shape[0], self.grid.slots.shape[1], len(self.names))
+        return "quadtree of {} AOIs ({} nodes)".format(len(self.names), self.tree.nodeCount)
+
+    # indices of the AOIs whose envelope overlaps the extent
+    def candidates(self, extent):
+        box = np.array([extent.XMin, extent.YMin, extent.XMax, extent.YMax], dtype = float)
+        if not np.isfinite(box).all():
+            return np.empty(0, dtype = np.int64)    # empty geometry
+        return self.grid.query(box) if self.grid is not None else self.tree.query(box)
+
+    # names of the AOIs the shape intersects (the INTERSECT relationship of SelectLayerByLocation) or, with
+    # relation = 'CONTAINS', the names of the AOIs that contain it
+    def cellsFor(self, shape, relation = 'INTERSECT'):
+        return [self.names[i] for i, inside in self.matches(shape, relation)]
+
+    # (index, inside) of each AOI the shape intersects (or, with relation = 'CONTAINS', that contains it);
+    # inside is True when the shape lies in the interior of a grid cell, so it does not have to be cut
+    def matches(self, shape, relation = 'INTERSECT'):
+        extent = shape.extent
+        found = []
+        for i in self.candidates(extent):
+            e = self.envelopes[i]
+            if self.grid is not None and e[0] < extent.XMin and e[1] < extent.YMin and extent.XMax < e[2] and extent.YMax < e[3]:
+                found.append((i, True))
+            elif relation == 'CONTAINS':
+                if self.shapes[i].contains(shape):
+                    found.append((i, False))
+            elif not self.shapes[i].disjoint(shape):
+                found.append((i, False))
+        return found
+
+    # Cuts a polyline or polygon, given as its paths or rings (see wkbParts), to the AOI with index i and
+    # returns the paths or rings of the piece inside the AOI (an empty list if no line or area is left, when
+    # the shape only touches the AOI). The rings and edges of each AOI are prepared once.
+    def cutParts(self, i, parts, shapeType):
+        if i not in self.clippers:
+            clipRings = orientRings(wkbParts(self.shapes[i].WKB))
+            self.clippers[i] = (clipRings, ringEdges(clipRings))
+        clipRings, clipEdges = self.clippers[i]
+        if shapeType == 'Polyline':
+            return clipLines(parts, clipEdges)
+        return clipPolygon(parts, clipRings, clipEdges)
+
+    # Cuts a polyline or polygon, given as its paths or rings, to the AOI with index i (see cutParts) and
+    # returns the piece as a geometry in the spatial reference, or None if no line or area is left
+    def cut(self, i, parts, shapeType, spatialReference = None):
+        pieces = self.cutParts(i, parts, shapeType)
+        if not pieces:
+            return None
+        return arcpy.FromWKB(bytearray(shapeWkb(3 if shapeType == 'Polyline' else 5, pieces)), spatialReference)
+
+    # Cuts a polyline or polygon geometry with Z or M values to the AOI with index i with arcpy, which keeps
+    # (and interpolates) them, and returns the piece inside the AOI, or None if no line or area is left
+    def cutGeometry(self, i, shape, shapeType):
+        piece = shape.intersect(self.shapes[i], 2 if shapeType == 'Polyline' else 4)
+        if piece is None or piece.pointCount == 0 or (piece.length if shapeType == 'Polyline' else piece.area) == 0:
+            return None
+        return piece
+
+    # the rectangle around all AOIs of the index, as a polygon in the spatial reference
+    def extentPolygon(self, spatialReference = None):
+        xmin, ymin = self.envelopes[:, :2].min(axis = 0)
+        xmax, ymax = self.envelopes[:, 2:].max(axis = 0)
+        corners = [arcpy.Point(xmin, ymin), arcpy.Point(xmin, ymax), arcpy.Point(xmax, ymax), arcpy.Point(xmax, ymin), arcpy.Point(xmin, ymin)]
+        return arcpy.Polygon(arcpy.Array(corners), spatialReference)
+
+# Returns the paths of a line or the rings of a polygon (single or multi part) from its WKB, as (n, 2)
+# arrays of x, y (ISO and extended WKB; Z and M values are dropped)
+def wkbParts(wkb):
+    wkb = bytes(wkb)
+    parts = []
+    def read(pos):
+        order = '<' if wkb[pos] == 1 else '>'
+        code = struct.unpack_from(order + 'I', wkb, pos + 1)[0]
+        base = code & 0x0FFFFFFF
+        dims = 2 + bool(code & 0x80000000 or base // 1000 in (1, 3)) + bool(code & 0x40000000 or base // 1000 in (2, 3))
+        geomType = base % 1000
+        pos += 5
+        if geomType in (2, 3):
+            count = 1
+            if geomType == 3:
+                count = struct.unpack_from(order + 'I', wkb, pos)[0]
+                pos += 4
+            for _ in range(count):
+                n = struct.unpack_from(order + 'I', wkb, pos)[0]
+                parts.append(np.frombuffer(wkb, order + 'f8', n * dims, pos + 4).reshape(n, dims)[:, :2].astype(float))
+                pos += 4 + 8 * n * dims
+            return pos
+        if geomType in (5, 6, 7):
+            n = struct.unpack_from(order + 'I', wkb, pos)[0]
+            pos += 4
+            for _ in range(n):
+                pos = read(pos)
+            return pos
+        raise ValueError('Unsupported WKB geometry type ' + str(geomType))
+    read(0)
+    return parts
+
+# GridIndex finds the cells of a regular grid that an envelope overlaps: slots holds the index of the AOI in
+# each (column, row) of the grid, or -1 where the grid has no AOI
+class GridIndex():
+
+    def __init__(self, origin, cellSize, slots):
+        self.origin = origin
+        self.cellSize = cellSize
+        self.slots = slots
+
+    # indices of the AOIs whose cell overlaps (or touches) the box (xmin, ymin, xmax, ymax)
+    def query(self, box, eps = 1e-9):
+        (x0, y0), (width, height) = self.origin, self.cellSize
+        columns, rows = self.slots.shape
+        c0 = max(int(np.floor((box[0] - x0) / width - eps)), 0)
+        c1 = min(int(np.floor((box[2] - x0) / width + eps)), columns - 1)
+        r0 = max(int(np.floor((box[1] - y0) / height - eps)), 0)
+        r1 = min(int(np.floor((box[3] - y0) / height + eps)), rows - 1)
+        if c1 < c0 or r1 < r0:
+            return np.empty(0, dtype = np.int64)
+        found = self.slots[c0:c1 + 1, r0:r1 + 1].ravel()
+        return np.sort(found[found >= 0])
+
+# Returns a GridIndex for the AOI envelopes if the AOIs (with the given areas) are the cells of a regular grid:
+# every AOI fills its envelope, all envelopes have the same size, they are aligned on multiples of that size and
+# no two share a cell. Otherwise (or when the grid would be mostly empty) it returns None.
+def regularGrid(envelopes, areas, tolerance = 1e-6):
+    if len(envelopes) < 2:
+        return None
+    widths, heights = envelopes[:, 2] - envelopes[:, 0], envelopes[:, 3] - envelopes[:, 1]
+    width, height = widths[0], heights[0]
+    if width <= 0 or height <= 0:
+        return None
+    if not (np.allclose(widths, width, rtol = tolerance, atol = 0) and np.allclose(heights, height, rtol = tolerance, atol = 0)
+            and np.allclose(areas, widths * heights, rtol = tolerance, atol = 0)):
+        return None
+    x0, y0 = envelopes[:, 0].min(), envelopes[:, 1].min()
+    columns, rows = (envelopes[:, 0] - x0) / width, (envelopes[:, 1] - y0) / height
+    c, r = np.rint(columns), np.rint(rows)
+    if max(np.abs(columns - c).max(), np.abs(rows - r).max()) > tolerance:
+        return None
+    c, r = c.astype(np.int64), r.astype(np.int64)
+    if (c.max() + 1) * (r.max() + 1) > 4 * len(envelopes) + 1024:
+        return None
+    slots = np.full((c.max() + 1, r.max() + 1), -1, dtype = np.int64)
+    slots[c, r] = np.arange(len(envelopes))
+    if (slots >= 0).sum() < len(envelopes):
+        return None     # two AOIs in the same cell
+    return GridIndex((x0, y0), (width, height), slots)
+
+# QuadTree keeps envelopes (xmin, ymin, xmax, ymax) in a tree of quadrants: a node with more than leafSize
+# envelopes is divided into four by the center of its envelopes, and every envelope goes to the quadrant
+# of its center (up to maxDepth levels). The bounds of a node are the union of the envelopes below it, so a
+# query only visits the nodes it overlaps. A node is (bounds, indices of its envelopes, children).
+class QuadTree():
+
+    def __init__(self, envelopes, leafSize = 32, maxDepth = 16):
+        self.envelopes = envelopes
+        self.leafSize = leafSize
+        self.maxDepth = maxDepth
+        self.nodeCount = 0
+        self.root = self._build(np.arange(len(envelopes)), 0) if len(envelopes) else None
+
+    def _build(self, items, depth):
+        self.nodeCount += 1
+        e = self.envelopes[items]
+        bounds = (e[:, 0].min(), e[:, 1].min(), e[:, 2].max(), e[:, 3].max())
+        if len(items) <= self.leafSize or depth >= self.maxDepth:
+            return (bounds, items, None)
+        cx, cy = (e[:, 0] + e[:, 2]) / 2, (e[:, 1] + e[:, 3]) / 2
+        mx, my = (cx.min() + cx.max()) / 2, (cy.min() + cy.max()) / 2
+        east, north = cx > mx, cy > my
+        quadrants = [items[(east == x) & (north == y)] for x in (False, True) for y in (False, True)]
+        if max(len(quadrant) for quadrant in quadrants) == len(items):
+            return (bounds, items, None)    # all centers at the same point
+        return (bounds, items[:0], [self._build(quadrant, depth + 1) for quadrant in quadrants if len(quadrant)])
+
+    # indices of the envelopes that overlap (or touch) the box (xmin, ymin, xmax, ymax), in increasing order
+    def query(self, box):
+        found = []
+        stack = [self.root] if self.root is not None else []
+        xmin, ymin, xmax, ymax = box
+        while stack:
+            bounds, items, children = stack.pop()
+            if bounds[0] > xmax or bounds[2] < xmin or bounds[1] > ymax or bounds[3] < ymin:
+                continue
+            if children:
+                stack.extend(children)
+            else:
+                e = self.envelopes[items]
+                found.append(items[(e[:, 0] <= xmax) & (e[:, 2] >= xmin) & (e[:, 1] <= ymax) & (e[:, 3] >= ymin)])
+        return np.sort(np.concatenate(found)) if found else np.empty(0, dtype = np.int64)
+
+# Creates a geodatabase in folder with an empty copy of each feature class of fcList (see createEmptyCopy),
+# the template every cell database is copied from. Returns its path and the output names of the feature classes.
+def createTemplateDatabase(fcList, folder, cut = False):
+    arcpy.CreateFileGDB_management(folder, "template.gdb")
+    template = os.path.join(folder, "template.gdb")
+    return template, [createEmptyCopy(fc, template, cut) for fc in fcList]
+
+# Creates the geodatabase of each cell in outputFolder as a copy of the template database (the copy of a few
+# empty feature classes takes milliseconds, where creating them in every cell takes a geoprocessing call per
+# feature class) and returns their paths by cell name. An existing cell database is replaced. The time it
+# takes is added to timing (cell name -> seconds) when it is given.
+def createCellDatabases(outputFolder, cellList, template, timing = None):
+    cellDatabases = {}
+    for cell in cellList:
+        start = time.perf_counter()
+        gdb = os.path.join(outputFolder, cell + ".gdb")
+        with outputFolderLock():
+            if arcpy.Exists(gdb):
+                arcpy.Delete_management(gdb)
+            shutil.copytree(template, gdb, ignore = shutil.ignore_patterns("*.lock"))
+        cellDatabases[cell] = gdb
+        if timing is not None:
+            timing[cell] += time.perf_counter() - start
+    return cellDatabases
+
+# Copies the schema of the feature class fc into the geodatabase gdb, as an empty feature class made with
+# CopyFeatures (so it is the same as the copy the features used to be deleted from), with a PARENT_OID field
+# in the cut mode. Returns the output name.
+def createEmptyCopy(fc, gdb, cut = False):
+    outName = os.path.splitext(os.path.basename(fc))[0]
+    oidField = arcpy.AddFieldDelimiters(fc, arcpy.Describe(fc).OIDFieldName)
+    emptyLayer = arcpy.MakeFeatureLayer_management(fc, "EmptyCopy", oidField + " < 0")
+    arcpy.CopyFeatures_management(emptyLayer, os.path.join(gdb, outName))
+    if cut and parentField not in [field.name for field in arcpy.ListFields(fc)]:
+        arcpy.AddField_management(os.path.join(gdb, outName), parentField, "LONG")
+    arcpy.Delete_management(emptyLayer)
+    return outName
+
+# Returns the fields of a feature class that are copied to the cell databases: the shape and every field that
+# can be edited (the object ID and the fields the geodatabase maintains, like Shape_Length, are left out)
+def copyFields(fc):
+    return ['SHAPE@'] + [field.name for field in arcpy.ListFields(fc)
+                         if field.type not in ('OID', 'Geometry') and field.editable and field.name != parentField]
+
+# Reads the feature class fc once and writes each feature to the feature class outName in the database of
+# every cell it intersects (cellDatabases: cell name -> gdb path). The rows are kept per cell and written
+# with an insert cursor batchSize at a time, in the order of fc. With many cells the buffers together could
+# hold far more rows than one batch, so when more than maxBuffered rows are kept the largest buffers are
+# written until at most half of that is left. Features without a shape intersect no AOI.
+# source is what is read, fc itself or a layer of fc with a selection. With cut, lines and polygons are cut
+# to each AOI (a feature inside the interior of a grid cell is kept whole; features with Z or M values are cut
+# with arcpy, see AoiIndex.cutGeometry) and every feature gets the object ID of the source feature in
+# PARENT_OID. Returns the number of features written to each cell; the time spent writing each cell is added
+# to timing when it is given.
+def partitionFeatureClass(fc, index, cellDatabases, outName, batchSize = 10000, source = None, timing = None, cut = False,
+                          maxBuffered = 200000):
+    fields = copyFields(fc)
+    readFields = fields + ['OID@'] if cut else fields
+    description = arcpy.Describe(fc)
+    cutShapes = cut and description.shapeType in ('Polyline', 'Polygon')
+    keepZM = description.hasZ or description.hasM
+    buffers = {cell: [] for cell in cellDatabases}
+    counts = dict.fromkeys(cellDatabases, 0)
+    buffered = 0
+
+    def flush(cell):
+        nonlocal buffered
+        start = time.perf_counter()
+        with arcpy.da.InsertCursor(os.path.join(cellDatabases[cell], outName), fields + [parentField] if cut else fields) as cursor:
+            for row in buffers[cell]:
+                cursor.insertRow(row)
+        counts[cell] += len(buffers[cell])
+        buffered -= len(buffers[cell])
+        buffers[cell] = []
+        if timing is not None:
+            timing[cell] += time.perf_counter() - start
+
+    with arcpy.da.SearchCursor(source or fc, readFields) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            parts = None
+            for i, inside in index.matches(row[0]):
+                cell = index.names[i]
+                if cell not in buffers:
+                    continue
+                if cutShapes and not inside:
+                    if keepZM:
+                        piece = index.cutGeometry(i, row[0], description.shapeType)
+                    else:
+                        if parts is None:
+                            parts = wkbParts(row[0].WKB)
+                        piece = index.cut(i, parts, description.shapeType, description.spatialReference)
+                    if piece is None:
+                        continue
+                    buffers[cell].append((piece,) + row[1:])
+                else:
+                    buffers[cell].append(row)
+                buffered += 1
+                if len(buffers[cell]) >= batchSize:
+                    flush(cell)
+                elif buffered > maxBuffered:
+                    for largest in sorted(buffers, key = lambda name: len(buffers[name]), reverse = True):
+                        if buffered <= maxBuffered // 2:
+                            break
+                        flush(largest)
+    for cell in buffers:
+        if buffers[cell]:
+            flush(cell)
+    return counts
+
+# Builds the databases of the cells cellList (all AOIs or a group of them) in a single pass over each feature
+# class. With selectExtent only the features in the extent of the cells are read, through a layer with a
+# spatial selection (so a worker with a group of AOIs does not read the whole feature class). The AOIs are
+# read (and indexed) once for each spatial reference of the feature classes. report is called with a progress
+# message. With cut, lines and polygons are cut at the AOI boundaries (see partitionFeatureClass). Returns a
+# record of the run: the process, the seconds it took and, for each cell, the features written and the seconds
+# spent creating and writing its database.
+def splitCells(fcList, aoiBoundaries, outputFolder, cellList, cellNameField = "Name", selectExtent = False, report = print, cut = False):
+    start = time.perf_counter()
+    timing = dict.fromkeys(cellList, 0.0)
+    features = dict.fromkeys(cellList, 0)
+    templateFolder = tempfile.mkdtemp()
+    try:
+        template, outNames = createTemplateDatabase(fcList, templateFolder, cut)
+        cellDatabases = createCellDatabases(outputFolder, cellList, template, timing)
+    finally:
+        if arcpy.Exists(os.path.join(templateFolder, "template.gdb")):
+            arcpy.Delete_management(os.path.join(templateFolder, "template.gdb"))
+        shutil.rmtree(templateFolder, ignore_errors = True)
+
+    indexes = {}
+    for fc, outName in zip(fcList, outNames):
+        spatialReference = arcpy.Describe(fc).spatialReference
+        key = spatialReference.exportToString()
+        if key not in indexes:
+            aois = readAois(aoiBoundaries, cellNameField, spatialReference)
+            indexes[key] = AoiIndex({cell: aois.get(cell) for cell in cellDatabases})
+            report("AOI index: " + indexes[key].describe())
+        index = indexes[key]
+        source = None
+        if selectExtent and index.names:
+            source = arcpy.MakeFeatureLayer_management(fc, "SplitSource")
+            arcpy.SelectLayerByLocation_management(source, "INTERSECT", index.extentPolygon(spatialReference))
+        counts = partitionFeatureClass(fc, index, cellDatabases, outName, source = source, timing = timing, cut = cut)
+        if source is not None:
+            arcpy.Delete_management(source)
+        for cell, count in counts.items():
+            features[cell] += count
+        report("Split " + fc + ": " + str(sum(counts.values())) + " features written to " +
+               str(sum(1 for count in counts.values() if count)) + " of " + str(len(cellDatabases)) + " AOI databases")
+    return {'pid': os.getpid(), 'seconds': time.perf_counter() - start,
+            'cells': [{'cell': cell, 'features': features[cell], 'seconds': timing[cell]} for cell in cellDatabases]}
+
+# Pool job: builds the databases of a group of cells (see splitCells); the messages of a worker are not shown
+def splitGroup(job):
+    fcList, aoiBoundaries, outputFolder, cellList, cellNameField, cut = job
+    return splitCells(fcList, aoiBoundaries, outputFolder, cellList, cellNameField, selectExtent = True, report = lambda text: None, cut = cut)
+
+# Splits the cells into groupCount groups of neighbouring AOIs: the AOIs are ordered by the center of their
+# envelope, row by row (bottom to top, then left to right), and cut into runs of about the same length
+def cellGroups(aoiBoundaries, cellList, groupCount, cellNameField = "Name"):
+    centers = {}
+    with arcpy.da.SearchCursor(aoiBoundaries, [cellNameField, 'SHAPE@']) as cursor:
+        for name, shape in cursor:
+            if shape is not None:
+                e = shape.extent
+                centers[str(name)] = ((e.YMin + e.YMax) / 2, (e.XMin + e.XMax) / 2)
+    ordered = sorted(cellList, key = lambda cell: centers.get(cell, (np.inf, np.inf)))
+    return [group.tolist() for group in np.array_split(np.array(ordered, dtype = object), min(groupCount, len(ordered))) if len(group)]
+
+# Reports the time of each cell (the slowest first) and how well the workers were used
+def reportCellTimes(results, wallSeconds, workers, report = print, count = 10):
+    cells = sorted((cell for result in results for cell in result['cells']), key = lambda cell: -cell['seconds'])
+    for cell in cells[:count]:
+        report("  {}: {} features, {:.2f} s".format(cell['cell'], cell['features'], cell['seconds']))
+    busy = sum(result['seconds'] for result in results)
+    report("{} AOI databases in {:.1f} s with {} worker(s); {:.1f} s of work ({:.0%} of the workers' time)".format(
+        len(cells), wallSeconds, workers, busy, busy / (wallSeconds * workers) if wallSeconds > 0 else 0))
+
+# Splits the feature classes fcList into a geodatabase per AOI of aoiBoundaries in outputFolder, named after
+# the AOI, with only the features that intersect the AOI. With workers > 1 the AOI databases are built by a
+# pool of that many processes, in groupsPerWorker groups of neighbouring AOIs per worker (more groups than
+# workers, so a worker that gets a sparse group takes another one). With cut, lines and polygons that cross an
+# AOI boundary are cut there instead of being copied whole into every AOI they touch. report is called with
+# a progress message (e.g. arcpy.AddMessage). Returns the list of AOI names.
+def splitDatabase(fcList, aoiBoundaries, outputFolder, cellNameField = "Name", report = print, workers = 1, groupsPerWorker = 4, cut = False):
+    cellList = listCells(aoiBoundaries, cellNameField)
+    start = time.perf_counter()
+    if workers <= 1 or len(cellList) < 2:
+        report("Creating " + str(len(cellList)) + " AOI databases...")
+        results = [splitCells(fcList, aoiBoundaries, outputFolder, list(dict.fromkeys(cellList)), cellNameField, report = report, cut = cut)]
+    else:
+        groups = cellGroups(aoiBoundaries, list(dict.fromkeys(cellList)), workers * groupsPerWorker, cellNameField)
+        report("Creating " + str(len(cellList)) + " AOI databases in " + str(len(groups)) + " groups with " + str(workers) + " workers...")
+        if sys.platform == 'win32':
+            multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe')) # make sure Python environment is used for running processes, even when this is run as a script tool
+        jobs = [(fcList, aoiBoundaries, outputFolder, group, cellNameField, cut) for group in groups]
+        results = []
+        with multiprocessing.Pool(processes = workers, initializer = initSplitWorker, initargs = (arcpy.env.workspace, multiprocessing.Lock())) as pool:
+            for result in pool.imap_unordered(splitGroup, jobs):
+                results.append(result)
+                report("Finished " + str(len(results)) + " of " + str(len(jobs)) + " groups (" + ", ".join(cell['cell'] for cell in result['cells']) + ")")
+    reportCellTimes(results, time.perf_counter() - start, max(1, workers), report)
+    return cellList
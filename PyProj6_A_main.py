@@ -6,25 +6,37 @@ to display how long it takes for the process to complete.
 This is one of two scripts that accomplishes the same function; this script takes user input 
 and is designed to be run as an ArcGIS Pro script tool. 
 
+The clip is done with arcpy.Clip_analysis, or with the "numpy" backend of PyProj6_func
+where ArcGIS is not installed (shapefiles only; the OIDs are then the FIDs of the clipper).
+The outputs are a shapefile per clipper polygon or, when a merged output is given, one
+GeoPackage with the OID of the clipper polygon of each feature in SOURCE_OID.
+
 Any folder paths have been change to empty quotes for privacy and flexibility.
 
 @author: dknight2
 """
 import os, sys
-import arcpy 
 import multiprocessing 
-from PyProj6_A_support import worker
+from PyProj6_A_support import chunkWorker
+from PyProj6_func import arcpy, ExecuteError, message, error, getParameter, defaultBackend, listOids
+from PyProj6_func import ProgressReporter, initWorker, scheduleByCost, reportUtilization, writeRunReport, reportSlowest
+from PyProj6_func import featureEnvelopes, EnvelopeIndex, candidateCounts
+from PyProj6_func import RunManifest, outputPath, removeOutputs, clipperFingerprints, datasetFingerprint, MergedOutput
 
 import time 
 process_start_time = time.time() 
 
 # overwrites the output from previous runs
-arcpy.env.overwriteOutput = True
+if arcpy is not None:
+    arcpy.env.overwriteOutput = True
 
-# Input parameters
-clipper = arcpy.GetParameterAsText(0) 
-tobeclipped = arcpy.GetParameterAsText(1)
-outputFolder = arcpy.GetParameterAsText(2)
+# Input parameters (read from the command line when arcpy is not installed)
+clipper = getParameter(0) 
+tobeclipped = getParameter(1)
+outputFolder = getParameter(2)
+chunkSize = int(getParameter(3) or 0)           # jobs sent to a worker at a time (optional, 0 = automatic)
+backend = getParameter(4) or defaultBackend()   # 'arcpy' (Clip_analysis) or 'numpy' (shapefiles only, no ArcGIS needed)
+mergedOutput = getParameter(5)                  # GeoPackage all outputs are written to (optional, empty = a shapefile per OID)
 
 def get_install_path():
     ''' Return 64bit python install path from registry (if installed and registered),
@@ -48,65 +60,129 @@ def mp_handler():
     try: 
         # Create a list of object IDs for clipper polygons 
          
-        arcpy.AddMessage("Creating Polygon OID list...") 
-        print("Creating Polygon OID list...") 
-        clipperDescObj = arcpy.Describe(clipper) 
-        field = clipperDescObj.OIDFieldName 
-      
-        idList = [] 
-        with arcpy.da.SearchCursor(clipper, [field]) as cursor: 
-            for row in cursor: 
-                id = row[0] 
-                idList.append(id)
+        runStarted = time.strftime('%Y-%m-%dT%H:%M:%S')
+        message("Creating Polygon OID list...")
+        field, idList = listOids(clipper, backend)
  
-        arcpy.AddMessage("There are " + str(len(idList)) + " object IDs (polygons) to process.") 
-        print("There are " + str(len(idList)) + " object IDs (polygons) to process.") 
+        message("There are " + str(len(idList)) + " object IDs (polygons) to process.")
  
+        # Estimate the cost of each job as the clipper vertex count x the number of features whose envelope
+        # overlaps the clipper envelope, from a quick scan of the envelopes
+
+        message("Estimating job costs from the feature envelopes...")
+        clipperIds, clipperEnvelopes, clipperVertices = featureEnvelopes(clipper, backend, field)
+        counts = candidateCounts(EnvelopeIndex(clipperEnvelopes), featureEnvelopes(tobeclipped, backend)[1])
+        cost = dict(zip(clipperIds.tolist(), (clipperVertices * counts).tolist()))
+        candidatesById = dict(zip(clipperIds.tolist(), counts.tolist()))
+
         # Create a task list with parameter tuples for each call of the worker function. Tuples consist of the clippper, tobeclipped, field, and oid values.
         
         jobs = []
+        costs = []
      
         for id in idList:
             jobs.append((clipper,tobeclipped,field,id, outputFolder)) # adds tuples of the parameters that need to be given to the worker function to the jobs list
+            costs.append(cost.get(id, 0))
  
-        arcpy.AddMessage("Job list has " + str(len(jobs)) + " elements.") 
-        print("Job list has " + str(len(jobs)) + " elements.") 
+        message("Job list has " + str(len(jobs)) + " elements.")
+
+        # Resume: skip the jobs the manifest in the output folder lists as finished with the same inputs and an
+        # unchanged output, and delete whatever an interrupted run left of the outputs of the other jobs
+        # (the merged output is written anew, so it runs every job)
+
+        manifest = RunManifest(outputFolder)
+        skipped = 0
+        if mergedOutput:
+            message("Writing the outputs of all " + str(len(jobs)) + " jobs to " + mergedOutput)
+        else:
+            clipperPrints = clipperFingerprints(clipper, backend, field)
+            targetPrint = datasetFingerprint(tobeclipped)
+            inputs = {}
+            todo, todoCosts = [], []
+            partial = 0
+            for job, jobCost in zip(jobs, costs):
+                key = RunManifest.key(job[3])
+                inputs[key] = {'clipper': clipperPrints.get(job[3]), 'target': targetPrint}
+                outFC = outputPath(outputFolder, job[3])
+                if manifest.isDone(key, inputs[key], outFC):
+                    skipped += 1
+                    continue
+                partial += removeOutputs(outFC)
+                todo.append(job)
+                todoCosts.append(jobCost)
+            jobs, costs = todo, todoCosts
+            message("Resuming: " + str(skipped) + " jobs already done, " + str(partial) + " partial or stale outputs removed, " + str(len(jobs)) + " jobs to run.")
  
         # Create and run multiprocessing pool.
 
-        multiprocessing.set_executable(os.path.join(get_install_path(), 'pythonw.exe')) # make sure Python environment is used for running processes, even when this is run as a script tool
+        if sys.platform == 'win32':
+            multiprocessing.set_executable(os.path.join(get_install_path(), 'pythonw.exe')) # make sure Python environment is used for running processes, even when this is run as a script tool
  
-        arcpy.AddMessage("Sending to pool") 
-        print("Sending to pool") 
+        message("Sending to pool")
  
         cpuNum = multiprocessing.cpu_count()  # determine number of cores to use
         print("there are: " + str(cpuNum) + " cpu cores on this machine") 
   
-        with multiprocessing.Pool(processes=cpuNum) as pool: # Create the pool object 
-            res = pool.starmap(worker, jobs)  # run jobs in job list; res is a list with return values of the worker function
- 
+        # Send the jobs to the pool in chunks, the most expensive first, and handle the results as they come
+        # back (in any order), so the progress and throughput of the run can be reported while it is going
+        chunks = scheduleByCost(jobs, costs, cpuNum, chunkSize)
+        message("Sending " + str(len(chunks)) + " chunks to the pool, most expensive first (largest estimated cost " + str(max(costs, default = 0)) + ")")
+        progress = ProgressReporter(len(jobs))
+        poolStart = time.time()
+        res = []
+        # With a merged output the workers send their features through a queue to the one writer in this process
+        queue = multiprocessing.Queue(maxsize = 4 * cpuNum) if mergedOutput else None
+        merger = MergedOutput(mergedOutput, queue) if mergedOutput else None
+        with multiprocessing.Pool(processes=cpuNum, initializer=initWorker, initargs=(clipper, field, backend, queue)) as pool: # Create the pool object; each process loads the clipper once
+            for results in pool.imap_unordered(chunkWorker, chunks):
+                res.extend(results)     # res is a list with one result dictionary per job
+                progress.update(results)
+                for result in results:
+                    if result['ok'] and not mergedOutput:
+                        key = RunManifest.key(result['oid'])
+                        manifest.record(key, inputs[key], outputPath(outputFolder, result['oid']))
+            pool.close()
+            pool.join()     # the workers have handed all their features to the queue when they have exited
+        if merger is not None:
+            message("Merged output: " + str(merger.close()) + " features written to " + mergedOutput)
+            if merger.failure:
+                error("Writing the merged output failed: " + merger.failure.strip().splitlines()[-1])
+        wallSeconds = time.time() - poolStart
+        reportUtilization(res, wallSeconds)
+
+        # Write the job records to the JSON run report, with the candidate feature count of each job from the
+        # envelope scan (an estimate, not a count of the features read), and list the slowest jobs
+
+        for result in res:
+            result['candidateFeatures'] = candidatesById.get(result['oid'], 0)
+        reportPath = os.path.join(outputFolder, 'clip_report.json')
+        writeRunReport(reportPath, res, wallSeconds, {'started': runStarted, 'backend': backend, 'clipper': clipper, 'targets': [tobeclipped], 
+                                                      'poolSize': cpuNum, 'skipped': skipped, 'mergedOutput': mergedOutput or None})
+        reportSlowest(res)
+        message("Run report written to " + reportPath)
+
         # If an error has occurred report it 
          
-        failed = res.count(False) # count how many times False appears in the list with the return values
-        if failed > 0:
-            arcpy.AddError("{} workers failed!".format(failed)) 
-            print("{} workers failed!".format(failed)) 
+        failed = [result for result in res if not result['ok']]
+        if failed:
+            error("{} workers failed!".format(len(failed)))
+            for result in failed[:20]:
+                message("  OID {} ({}): {}".format(result['oid'], result['fc'], result['error'].strip().splitlines()[-1]))
+            if len(failed) > 20:
+                message("  ... see the run report for the other failures")
          
-        arcpy.AddMessage("Finished multiprocessing!") 
-        print("Finished multiprocessing!") 
+        message("Finished multiprocessing!")
  
-    except arcpy.ExecuteError:
+    except ExecuteError:
         # Geoprocessor threw an error 
         arcpy.AddError(arcpy.GetMessages(2)) 
-        print("Execute Error:", arcpy.ExecuteError) 
+        print("Execute Error:", arcpy.GetMessages(2)) 
     except Exception as e: 
         # Capture all other errors 
-        arcpy.AddError(str(e)) 
-        print("Exception:", e)
+        error("Exception: " + str(e))
  
 if __name__ == '__main__':   
     mp_handler() 
     
 # Output how long the whole process took. 
-arcpy.AddMessage("--- %s seconds ---" % (time.time() - process_start_time)) 
-print ("--- %s seconds ---" % (time.time() - process_start_time))
+message("--- %s seconds ---" % (time.time() - process_start_time))
@@ -7,28 +7,62 @@ Any folder paths have been change to empty quotes for privacy and flexibility.
 @author: dknight2
 """
 import os, sys
-import arcpy
+import traceback
+from PyProj6_func import arcpy, clipperGeometry, targetLayer, currentBackend, clipShapefile, outputPath
+from PyProj6_func import newJobRecord, finishJobRecord, PhaseTimer, mergingOutput, clipToMerged, sendFeatureClass
 
 # overwrites the output from previous runs
-arcpy.env.overwriteOutput = True
+if arcpy is not None:
+    arcpy.env.overwriteOutput = True
  
-def worker(clipper, tobeclipped, field, oid, outputFolder): 
+def worker(clipper, tobeclipped, field, oid, outputFolder, backend = None): 
     """  
        This is the function that gets called and does the work of clipping the input feature class to one of the polygons from the clipper feature class. 
-       Note that this function does not try to write to arcpy.AddMessage() as nothing is ever displayed.  If the clip succeeds then it returns TRUE else FALSE.  
+       Note that this function does not try to write to arcpy.AddMessage() as nothing is ever displayed.  It returns a record (dictionary) of the job with
+       the OID, the feature class, whether it succeeded, the wall/CPU time of each phase, the output feature count, the peak memory and the exception text.
+       The backend is 'arcpy' (Clip_analysis) or 'numpy' (clipShapefile in PyProj6_func); by default it is the one the process was initialized with.
+       When the process was initialized with the queue of a merged output, the features are sent to it instead of being written to a shapefile.
     """
+    record = newJobRecord(oid, tobeclipped)
+    merged = mergingOutput()
     try:
-        # Create a layer with only the polygon with ID oid. Each clipper layer needs a unique name, so we include oid in the layer name.
-        query = '"' + field +'" = ' + str(oid)
-        arcpy.MakeFeatureLayer_management(clipper, "clipper_" + str(oid), query) 
-        
-        # Do the clip. We include the oid in the name of the output feature class. 
-        outFC = outputFolder + "\clip_" + str(oid) + ".shp"
-        arcpy.Clip_analysis(tobeclipped, "clipper_" + str(oid), outFC) 
+        # Do the clip. We include the oid in the name of the output feature class (in the memory workspace for a merged output).
+        outFC = "memory\\clip_" + str(oid) if merged else outputPath(outputFolder, oid)
+        if (backend or currentBackend()) == 'numpy':
+            if merged:
+                record['outputFeatures'] = clipToMerged(clipper, tobeclipped, oid, record)
+            else:
+                record['outputFeatures'] = clipShapefile(clipper, tobeclipped, oid, outFC, record)
+        else:
+            # Use the clipper geometry and the target layer this process loaded once (see initWorker). If the
+            # process was not initialized, create a layer with only the polygon with ID oid. Each clipper layer
+            # needs a unique name, so we include oid in the layer name.
+            with PhaseTimer(record, 'prepare'):
+                clipFeatures = clipperGeometry(clipper, oid)
+                if clipFeatures is None:
+                    query = '"' + field +'" = ' + str(oid)
+                    clipFeatures = "clipper_" + str(oid)
+                    arcpy.MakeFeatureLayer_management(clipper, clipFeatures, query)
+                layer = targetLayer(tobeclipped)
+            with PhaseTimer(record, 'clip'):
+                arcpy.Clip_analysis(layer, clipFeatures, outFC)
+            if merged:
+                with PhaseTimer(record, 'send'):
+                    record['outputFeatures'] = sendFeatureClass(outFC, oid, record['fc'])
+                    arcpy.Delete_management(outFC)
+            else:
+                with PhaseTimer(record, 'count'):
+                    record['outputFeatures'] = int(arcpy.GetCount_management(outFC)[0])
          
         print("finished clipping:", str(oid)) 
-        return True # everything went well so we return True
+        record['ok'] = True # everything went well
     except: 
-        # Some error occurred so return False 
+        # Some error occurred, keep its text in the record
         print("error condition") 
-        return False
+        record['error'] = traceback.format_exc()
+    return finishJobRecord(record)
+
+# Runs a chunk of jobs (tuples of worker arguments) in this process and returns the record of each job.
+# The pool sends whole chunks to the workers so the inter-process overhead is paid once per chunk.
+def chunkWorker(jobs):
+    return [worker(*job) for job in jobs]
\ No newline at end of file
@@ -6,35 +6,51 @@ to display how long it takes for the process to complete.
 This is one of two scripts that accomplishes the same function; this script takes
 hard-coded folder paths and clips multiple featuer classes against the clipper.  
 
+The clip is done with arcpy.Clip_analysis, or with the "numpy" backend of PyProj6_func
+where ArcGIS is not installed (shapefiles only; the OIDs are then the FIDs of the clipper).
+The outputs are a shapefile per clipper polygon and feature class or, when mergedOutput is
+set, one GeoPackage with a table per feature class and the OID of the clipper polygon of
+each feature in SOURCE_OID.
+
 Any folder paths have been change to empty quotes for privacy and flexibility.
 
 @author: dknight2
 """
 import os, sys
-import arcpy 
 import multiprocessing 
-from PyProj6_B_support import worker
+from PyProj6_B_support import chunkWorker
+from PyProj6_func import arcpy, ExecuteError, message, error, defaultBackend, listOids, listFeatureClasses
+from PyProj6_func import ProgressReporter, initWorker, scheduleByCost, reportUtilization, writeRunReport, reportSlowest
+from PyProj6_func import featureEnvelopes, EnvelopeIndex, candidateCounts
+from PyProj6_func import RunManifest, outputPath, removeOutputs, clipperFingerprints, datasetFingerprint, MergedOutput
 
 import time 
 process_start_time = time.time() 
 
 # overwrites the output from previous runs to give new dataset
-arcpy.env.overwriteOutput = True
+if arcpy is not None:
+    arcpy.env.overwriteOutput = True
 
 workspace = r""
-arcpy.env.workspace = workspace
+backend = defaultBackend()                      # 'arcpy' (Clip_analysis) or 'numpy' (shapefiles only, no ArcGIS needed)
+if backend == 'arcpy':
+    arcpy.env.workspace = workspace
 
 # Input parameters
 clipper = r""                                   # Path to feature class that clips
 tobeclipped = []
 outputFolder = r""                              # Path to output folder
-fcList = arcpy.ListFeatureClasses()
+chunkSize = 0                                   # jobs sent to a worker at a time (0 = automatic)
+fanOut = True                                   # one job per clipper polygon for all feature classes (False: one job per polygon and feature class)
+mergedOutput = r""                              # GeoPackage all outputs are written to (empty: a shapefile per OID and feature class)
+fcList = listFeatureClasses(workspace, backend)
 
 updatedClipper = os.path.basename(os.path.splitext(clipper)[0])
 
 for fc in fcList:
-    if fc != updatedClipper:
-        tobeclipped.append(fc)
+    if os.path.splitext(fc)[0] != updatedClipper:
+        # the numpy backend does not use the arcpy workspace, so it gets the full path
+        tobeclipped.append(os.path.join(workspace, fc) if backend == 'numpy' else fc)
 
 def get_install_path():
     ''' Return 64bit python install path from registry (if installed and registered),
@@ -58,67 +74,155 @@ def mp_handler():
     try: 
         # Create a list of object IDs for clipper polygons 
          
-        arcpy.AddMessage("Creating Polygon OID list...") 
-        print("Creating Polygon OID list...") 
-        clipperDescObj = arcpy.Describe(clipper) 
-        field = clipperDescObj.OIDFieldName 
-      
-        idList = [] 
-        with arcpy.da.SearchCursor(clipper, [field]) as cursor: 
-            for row in cursor: 
-                id = row[0] 
-                idList.append(id)
+        runStarted = time.strftime('%Y-%m-%dT%H:%M:%S')
+        message("Creating Polygon OID list...")
+        field, idList = listOids(clipper, backend)
  
-        arcpy.AddMessage("There are " + str(len(idList)) + " object IDs (polygons) to process.") 
-        print("There are " + str(len(idList)) + " object IDs (polygons) to process.") 
+        message("There are " + str(len(idList)) + " object IDs (polygons) to process.")
  
+        # Prefilter: index the envelopes of the clipper polygons and of the features of each feature class, and
+        # only schedule the (OID, feature class) pairs whose envelopes overlap. The other pairs cannot intersect,
+        # so they would only produce an empty output shapefile. The same scan counts the candidate features of
+        # each pair for the cost estimate.
+
+        message("Building envelope indexes...")
+        clipperIds, clipperEnvelopes, clipperVertices = featureEnvelopes(clipper, backend, field)
+        clipperIndex = EnvelopeIndex(clipperEnvelopes)
+        vertices = dict(zip(clipperIds.tolist(), clipperVertices.tolist()))
+        candidates = {}
+        for fc in tobeclipped:
+            candidates[fc] = dict(zip(clipperIds.tolist(), candidateCounts(clipperIndex, featureEnvelopes(fc, backend)[1]).tolist()))
+
         # Create a task list with parameter tuples for each call of the worker function. Tuples consist of the clippper, tobeclipped, field, and oid values.
         
         jobs = []
-        
+        costs = []      # estimated cost of each job: clipper vertex count x candidate feature count
+        pruned = 0
      
         for id in idList:
             for fc in tobeclipped:
+                if not candidates[fc].get(id):
+                    pruned += 1
+                    continue
                 jobs.append((clipper,fc,field,id, outputFolder)) # adds tuples of the parameters that need to be given to the worker function to the jobs list
+                costs.append(vertices[id] * candidates[fc][id])
  
-        arcpy.AddMessage("Job list has " + str(len(jobs)) + " elements.") 
-        print("Job list has " + str(len(jobs)) + " elements.") 
+        message("Prefilter pruned " + str(pruned) + " of " + str(pruned + len(jobs)) + " jobs whose envelopes do not overlap (no output is written for them).")
+        message("Job list has " + str(len(jobs)) + " elements.")
+
+        # Resume: skip the jobs the manifest in the output folder lists as finished with the same inputs and an
+        # unchanged output, and delete whatever an interrupted run left of the outputs of the other jobs
+        # (the merged output is written anew, so it runs every job)
+
+        manifest = RunManifest(outputFolder)
+        fcPaths = {os.path.basename(os.path.splitext(fc)[0]): fc for fc in tobeclipped}
+        skipped = 0
+        if mergedOutput:
+            message("Writing the outputs of all " + str(len(jobs)) + " jobs to " + mergedOutput)
+        else:
+            clipperPrints = clipperFingerprints(clipper, backend, field)
+            targetPrints = {fc: datasetFingerprint(os.path.join(workspace, fc)) for fc in tobeclipped}
+            inputs = {}
+            todo, todoCosts = [], []
+            partial = 0
+            for job, jobCost in zip(jobs, costs):
+                fcName = os.path.basename(os.path.splitext(job[1])[0])
+                key = RunManifest.key(job[3], fcName)
+                inputs[key] = {'clipper': clipperPrints.get(job[3]), 'target': targetPrints[job[1]]}
+                outFC = outputPath(outputFolder, job[3], fcName)
+                if manifest.isDone(key, inputs[key], outFC):
+                    skipped += 1
+                    continue
+                partial += removeOutputs(outFC)
+                todo.append(job)
+                todoCosts.append(jobCost)
+            jobs, costs = todo, todoCosts
+            message("Resuming: " + str(skipped) + " jobs already done, " + str(partial) + " partial or stale outputs removed, " + str(len(jobs)) + " jobs to run.")
+        pairCount = len(jobs)
+
+        # Fan-out: one job per clipper polygon that clips all of its feature classes, so the polygon is prepared
+        # once instead of once per feature class. The cost of a fan-out job is the sum of the costs of its pairs.
+        # With fewer polygons than cores the pairs are kept as separate jobs, so no core is left idle.
+
+        if fanOut and len(set(job[3] for job in jobs)) >= multiprocessing.cpu_count():
+            grouped = {}
+            for job, jobCost in zip(jobs, costs):
+                fcs, groupCost = grouped.get(job[3], ([], 0))
+                grouped[job[3]] = (fcs + [job[1]], groupCost + jobCost)
+            jobs = [(clipper, fcs, field, id, outputFolder) for id, (fcs, groupCost) in grouped.items()]
+            costs = [groupCost for fcs, groupCost in grouped.values()]
+            message("Fan-out: " + str(len(jobs)) + " polygon jobs for " + str(pairCount) + " (OID, feature class) pairs.")
  
         # Create and run multiprocessing pool.
 
-        multiprocessing.set_executable(os.path.join(get_install_path(), 'pythonw.exe')) # make sure Python environment is used for running processes, even when this is run as a script tool
+        if sys.platform == 'win32':
+            multiprocessing.set_executable(os.path.join(get_install_path(), 'pythonw.exe')) # make sure Python environment is used for running processes, even when this is run as a script tool
  
-        arcpy.AddMessage("Sending to pool") 
-        print("Sending to pool") 
+        message("Sending to pool")
  
         cpuNum = multiprocessing.cpu_count()  # determine number of cores to use
         print("there are: " + str(cpuNum) + " cpu cores on this machine") 
   
-        with multiprocessing.Pool(processes=cpuNum) as pool: # Create the pool object 
-            res = pool.starmap(worker, jobs)  # run jobs in job list; res is a list with return values of the worker function
- 
+        # Send the jobs to the pool in chunks, the most expensive first, and handle the results as they come
+        # back (in any order), so the progress and throughput of the run can be reported while it is going
+        chunks = scheduleByCost(jobs, costs, cpuNum, chunkSize)
+        message("Sending " + str(len(chunks)) + " chunks to the pool, most expensive first (largest estimated cost " + str(max(costs, default = 0)) + ")")
+        progress = ProgressReporter(pairCount)
+        poolStart = time.time()
+        res = []
+        # With a merged output the workers send their features through a queue to the one writer in this process
+        queue = multiprocessing.Queue(maxsize = 4 * cpuNum) if mergedOutput else None
+        merger = MergedOutput(mergedOutput, queue) if mergedOutput else None
+        with multiprocessing.Pool(processes=cpuNum, initializer=initWorker, initargs=(clipper, field, backend, queue)) as pool: # Create the pool object; each process loads the clipper once
+            for results in pool.imap_unordered(chunkWorker, chunks):
+                res.extend(results)     # res is a list with one result dictionary per job
+                progress.update(results)
+                for result in results:
+                    if result['ok'] and not mergedOutput:
+                        key = RunManifest.key(result['oid'], result['fc'])
+                        manifest.record(key, inputs[key], outputPath(outputFolder, result['oid'], result['fc']))
+            pool.close()
+            pool.join()     # the workers have handed all their features to the queue when they have exited
+        if merger is not None:
+            message("Merged output: " + str(merger.close()) + " features written to " + mergedOutput)
+            if merger.failure:
+                error("Writing the merged output failed: " + merger.failure.strip().splitlines()[-1])
+        wallSeconds = time.time() - poolStart
+        reportUtilization(res, wallSeconds)
+
+        # Write the job records to the JSON run report, with the candidate feature count of each job from the
+        # envelope scan (an estimate, not a count of the features read), and list the slowest jobs
+
+        for result in res:
+            result['candidateFeatures'] = candidates[fcPaths[result['fc']]].get(result['oid'], 0)
+        reportPath = os.path.join(outputFolder, 'clip_report.json')
+        writeRunReport(reportPath, res, wallSeconds, {'started': runStarted, 'backend': backend, 'clipper': clipper, 'targets': tobeclipped, 'pruned': pruned, 
+                                                      'poolSize': cpuNum, 'skipped': skipped, 'mergedOutput': mergedOutput or None})
+        reportSlowest(res)
+        message("Run report written to " + reportPath)
+
         # If an error has occurred report it 
          
-        failed = res.count(False) # count how many times False appears in the list with the return values
-        if failed > 0:
-            arcpy.AddError("{} workers failed!".format(failed)) 
-            print("{} workers failed!".format(failed)) 
+        failed = [result for result in res if not result['ok']]
+        if failed:
+            error("{} workers failed!".format(len(failed)))
+            for result in failed[:20]:
+                message("  OID {} ({}): {}".format(result['oid'], result['fc'], result['error'].strip().splitlines()[-1]))
+            if len(failed) > 20:
+                message("  ... see the run report for the other failures")
          
-        arcpy.AddMessage("Finished multiprocessing!") 
-        print("Finished multiprocessing!") 
+        message("Finished multiprocessing!")
  
-    except arcpy.ExecuteError:
+    except ExecuteError:
         # Geoprocessor threw an error 
         arcpy.AddError(arcpy.GetMessages(2)) 
-        print("Execute Error:", arcpy.ExecuteError) 
+        print("Execute Error:", arcpy.GetMessages(2)) 
     except Exception as e: 
         # Capture all other errors 
-        arcpy.AddError(str(e)) 
-        print("Exception:", e)
+        error("Exception: " + str(e))
  
 if __name__ == '__main__':   
     mp_handler() 
     
 # Output how long the whole process took at the end of the process. 
-arcpy.AddMessage("--- %s seconds ---" % (time.time() - process_start_time)) 
-print ("--- %s seconds ---" % (time.time() - process_start_time))
+message("--- %s seconds ---" % (time.time() - process_start_time))
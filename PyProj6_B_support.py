@@ -8,30 +8,109 @@ Any folder paths have been change to empty quotes for privacy and flexibility.
 """
 
 import os, sys
-import arcpy
+import time
+import traceback
+from PyProj6_func import arcpy, clipperGeometry, targetLayer, currentBackend, clipShapefile, outputPath
+from PyProj6_func import newJobRecord, finishJobRecord, PhaseTimer, prepareClipper, mergingOutput, clipToMerged, sendFeatureClass
 
 # overwrites the output from previous runs
-arcpy.env.overwriteOutput = True
+if arcpy is not None:
+    arcpy.env.overwriteOutput = True
  
-def worker(clipper, tobeclipped, field, oid, outputFolder): 
+def prepareClip(clipper, field, oid, backend, layerName):
+    """
+       Returns what the clip of a target with the clipper polygon oid needs from the clipper: for arcpy the clipper geometry this process loaded once
+       (see initWorker) or, if the process was not initialized, a layer with only the polygon with ID oid; for numpy its oriented rings and edges.
+    """
+    if backend == 'numpy':
+        return prepareClipper(clipper, oid)
+    clipFeatures = clipperGeometry(clipper, oid)
+    if clipFeatures is None:
+        query = '"' + field +'" = ' + str(oid)
+        clipFeatures = layerName
+        arcpy.MakeFeatureLayer_management(clipper, clipFeatures, query)
+    return clipFeatures
+
+def worker(clipper, tobeclipped, field, oid, outputFolder, backend = None, prepared = None): 
     """  
        This is the function that gets called and does the work of clipping the input feature class to one of the polygons from the clipper feature class. 
-       Note that this function does not try to write to arcpy.AddMessage() as nothing is ever displayed.  If the clip succeeds then it returns TRUE else FALSE.  
+       Note that this function does not try to write to arcpy.AddMessage() as nothing is ever displayed.  It returns a record (dictionary) of the job with
+       the OID, the feature class, whether it succeeded, the wall/CPU time of each phase, the output feature count, the peak memory and the exception text.
+       The backend is 'arcpy' (Clip_analysis) or 'numpy' (clipShapefile in PyProj6_func); by default it is the one the process was initialized with.
+       prepared is the result of prepareClip when the clipper was already prepared (fan-out jobs). When the process was initialized with the queue
+       of a merged output, the features are sent to it (in the table of the feature class) instead of being written to a shapefile.
     """
+    record = newJobRecord(oid, tobeclipped)
+    backend = backend or currentBackend()
+    merged = mergingOutput()
     try:
         fc = os.path.basename(os.path.splitext(tobeclipped)[0])
-        # Create a layer with only the polygon with ID oid. Each clipper layer needs a unique name, so we include oid in the layer name.
-        query = '"' + field +'" = ' + str(oid)
-        arcpy.MakeFeatureLayer_management(clipper, "clipper_" + str(oid) + "_" + fc, query) 
-        
-        # Do the clip. We include the oid in the name of the output feature class. 
-        outFC = outputFolder + "\clip_" + str(oid) + "_" + fc + ".shp"
-        arcpy.Clip_analysis(tobeclipped, "clipper_" + str(oid) + "_" + fc, outFC) 
+        # Do the clip. We include the oid in the name of the output feature class (in the memory workspace for a merged output).
+        outFC = "memory\\clip_" + str(oid) + "_" + fc if merged else outputPath(outputFolder, oid, fc)
+        if backend == 'numpy':
+            if merged:
+                record['outputFeatures'] = clipToMerged(clipper, tobeclipped, oid, record, prepared)
+            else:
+                record['outputFeatures'] = clipShapefile(clipper, tobeclipped, oid, outFC, record, prepared)
+        else:
+            with PhaseTimer(record, 'prepare'):
+                # Each clipper layer needs a unique name, so we include oid in the layer name.
+                clipFeatures = prepared if prepared is not None else prepareClip(clipper, field, oid, backend, "clipper_" + str(oid) + "_" + fc)
+                layer = targetLayer(tobeclipped)
+            with PhaseTimer(record, 'clip'):
+                arcpy.Clip_analysis(layer, clipFeatures, outFC)
+            if merged:
+                with PhaseTimer(record, 'send'):
+                    record['outputFeatures'] = sendFeatureClass(outFC, oid, fc)
+                    arcpy.Delete_management(outFC)
+            else:
+                with PhaseTimer(record, 'count'):
+                    record['outputFeatures'] = int(arcpy.GetCount_management(outFC)[0])
          
         print("finished clipping:", str(oid)) 
-        return True # everything went well so we return True
+        record['ok'] = True # everything went well
     except: 
-        # Some error occurred so return False 
+        # Some error occurred, keep its text in the record
         print("error condition") 
-        return False
-    
+        record['error'] = traceback.format_exc()
+    return finishJobRecord(record)
+
+def fanOutWorker(clipper, tobeclipped, field, oid, outputFolder, backend = None):
+    """
+       This is the worker of a fan-out job: it prepares the clipper polygon oid once and clips every feature class in the list tobeclipped against it,
+       with the same output names as worker. It returns the record of each feature class; the time spent preparing the clipper is added to the first
+       one as the 'prepareClipper' phase. If the clipper cannot be prepared, every feature class fails with that error.
+    """
+    backend = backend or currentBackend()
+    start = (time.perf_counter(), time.process_time())
+    try:
+        prepared = prepareClip(clipper, field, oid, backend, "clipper_" + str(oid))
+        failure = None
+    except:
+        prepared = None
+        failure = traceback.format_exc()
+    prepareTime = {'wall': time.perf_counter() - start[0], 'cpu': time.process_time() - start[1]}
+
+    records = []
+    for fc in tobeclipped:
+        if failure is not None:
+            record = newJobRecord(oid, fc)
+            record['error'] = failure
+            records.append(finishJobRecord(record))
+        else:
+            records.append(worker(clipper, fc, field, oid, outputFolder, backend, prepared))
+    if records:
+        records[0]['phases']['prepareClipper'] = prepareTime
+    return records
+
+# Runs a chunk of jobs (tuples of worker arguments; a job with a list of feature classes is a fan-out job)
+# in this process and returns the record of each (OID, feature class) pair. The pool sends whole chunks
+# to the workers so the inter-process overhead is paid once per chunk.
+def chunkWorker(jobs):
+    records = []
+    for job in jobs:
+        if isinstance(job[1], list):
+            records.extend(fanOutWorker(*job))
+        else:
+            records.append(worker(*job))
+    return records
\ No newline at end of file
@@ -0,0 +1,1194 @@
+"""
+This is the function script shared by PyProj6_A_main and PyProj6_B_main (and their support
+scripts). It holds the parts of the multiprocessing clip tools that do not depend on which
+of the two tools is running: scheduling the jobs in chunks for the pool (most expensive first), reporting
+the progress of a run while the results come back and the state each worker process
+loads once. The outputs are either a shapefile per job or, in the merged output mode, one
+GeoPackage written by a single writer in the main process.
+
+It also holds the "numpy" clip backend, a pure-Python/NumPy alternative to
+arcpy.Clip_analysis that reads and writes shapefiles itself, so the tools can run (and be
+benchmarked) on machines without ArcGIS. Points, multipoints, lines and polygons are
+clipped against a clipper polygon (with holes and several parts) with vectorized
+segment/ring operations. Z and M values are not carried over to the output.
+
+Any folder paths have been change to empty quotes for privacy and flexibility.
+
+@author: dknight2
+"""
+import os, sys
+import json
+import time
+import codecs
+import struct
+import hashlib
+import threading
+import traceback
+import numpy as np
+from PyProjGpkg_func import GeoPackageWriter
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None    # only the numpy backend can be used without ArcGIS
+
+try:
+    import resource
+except ImportError:
+    resource = None     # not available on Windows
+
+# the arcpy error the handlers catch; a placeholder that is never raised when arcpy is not installed
+class _NoArcpyError(Exception):
+    pass
+
+ExecuteError = arcpy.ExecuteError if arcpy is not None else _NoArcpyError
+
+# Writes a message to the geoprocessing messages (when running with arcpy) and to stdout
+def message(text):
+    if arcpy is not None:
+        arcpy.AddMessage(text)
+    print(text)
+
+# Writes an error to the geoprocessing messages (when running with arcpy) and to stdout
+def error(text):
+    if arcpy is not None:
+        arcpy.AddError(text)
+    print(text)
+
+# Returns script tool parameter index as text; without arcpy the parameters are read from the command line
+def getParameter(index):
+    if arcpy is not None:
+        return arcpy.GetParameterAsText(index)
+    return sys.argv[index + 1] if len(sys.argv) > index + 1 else ''
+
+# Returns the backend used when none is chosen: arcpy when it is installed, numpy otherwise
+def defaultBackend():
+    return 'arcpy' if arcpy is not None else 'numpy'
+
+# Returns the OID field of the clipper and the list of its object IDs. The numpy backend reads
+# shapefiles, whose object IDs are the record numbers starting at 0 (the FID field).
+def listOids(clipper, backend):
+    if backend == 'numpy':
+        return 'FID', list(range(len(readShapefile(clipper).shapes)))
+    field = arcpy.Describe(clipper).OIDFieldName
+    with arcpy.da.SearchCursor(clipper, [field]) as cursor:
+        return field, [row[0] for row in cursor]
+
+# Returns the feature classes in workspace, the shapefiles in the folder for the numpy backend
+def listFeatureClasses(workspace, backend):
+    if backend == 'numpy':
+        return sorted(name for name in os.listdir(workspace or '.') if name.lower().endswith('.shp'))
+    return arcpy.ListFeatureClasses()
+
+# ProgressReporter keeps track of the finished jobs of a run and reports how many are done, the
+# throughput so far and the estimated time left. It reports at most once every `interval` seconds
+# (and always when the last job is done) so the messages do not slow the run down.
+class ProgressReporter():
+
+    def __init__(self, total, interval = 5.0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.interval = interval
+        self.startTime = time.time()
+        self.lastReport = 0.0
+
+    # records a list of finished job results (dictionaries with an 'ok' entry)
+    def update(self, results):
+        self.done += len(results)
+        self.failed += sum(1 for result in results if not result['ok'])
+        now = time.time()
+        if now - self.lastReport >= self.interval or self.done >= self.total:
+            self.lastReport = now
+            self.report()
+
+    def report(self):
+        elapsed = time.time() - self.startTime
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - self.done) / rate if rate > 0 else float('nan')
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        message("{}/{} jobs done ({:.1f}%), {} failed, {:.2f} jobs/s, about {:.0f} s left".format(
+            self.done, self.total, percent, self.failed, rate, remaining))
+
+# Returns the number of jobs to put in a chunk. A positive chunkSize is used as it is; otherwise the jobs
+# are split into about eight chunks per process (at most 100 jobs each), which keeps the overhead low while
+# still leaving enough chunks at the end of the run to keep every process busy.
+def chunkSizeFor(jobCount, cpuNum, chunkSize = 0):
+    if chunkSize and chunkSize > 0:
+        return int(chunkSize)
+    return max(1, min(100, jobCount // (max(1, cpuNum) * 8)))
+
+# =======================================
+# per-process worker state
+# =======================================
+
+# State of a pool worker process, set up once by initWorker and kept between jobs: the backend, the
+# clipper path, the clipper geometries by OID, the feature layers (or shapefiles) of the targets and the
+# queue of the merged output
+workerState = {}
+
+# Pool initializer: reads every clipper geometry with one cursor, so the workers do not have to build a
+# feature layer with a query for each OID. The targets are opened the first time they are used. When a
+# queue is given, the workers send their output features to it (see MergedOutput) instead of writing files.
+def initWorker(clipper, field, backend = None, queue = None):
+    workerState.clear()
+    workerState['backend'] = backend or defaultBackend()
+    workerState['queue'] = queue
+    workerState['clipper'] = clipper
+    workerState['layers'] = {}
+    if workerState['backend'] == 'numpy':
+        workerState['geometries'] = dict(enumerate(readShapefile(clipper).shapes))
+    else:
+        with arcpy.da.SearchCursor(clipper, [field, 'SHAPE@']) as cursor:
+            workerState['geometries'] = {oid: shape for oid, shape in cursor}
+
+# Returns the backend of this worker process
+def currentBackend():
+    return workerState.get('backend') or defaultBackend()
+
+# Returns the geometry of the clipper polygon oid loaded by initWorker, or None if this process was not
+# initialized for that clipper (the worker then falls back to making a layer for the polygon)
+def clipperGeometry(clipper, oid):
+    if workerState.get('clipper') != clipper:
+        return None
+    return workerState['geometries'].get(oid)
+
+# Returns whether this worker process sends its output to the merged output of the run
+def mergingOutput():
+    return workerState.get('queue') is not None
+
+# Returns the feature layer for the target feature class, making it the first time it is asked for
+def targetLayer(tobeclipped):
+    layers = workerState.setdefault('layers', {})
+    if tobeclipped not in layers:
+        name = "target_" + str(len(layers))
+        arcpy.MakeFeatureLayer_management(tobeclipped, name)
+        layers[tobeclipped] = name
+    return layers[tobeclipped]
+
+# Returns the target shapefile (numpy backend), reading it the first time it is asked for
+def targetShapefile(tobeclipped):
+    layers = workerState.setdefault('layers', {})
+    if tobeclipped not in layers:
+        layers[tobeclipped] = readShapefile(tobeclipped)
+    return layers[tobeclipped]
+
+# =======================================
+# envelope prefilter
+# =======================================
+
+# Returns the object IDs, the envelopes, as an (n, 4) array of (xmin, ymin, xmax, ymax), and the vertex
+# counts of the features of a feature class. Null shapes get an envelope that overlaps nothing.
+def featureEnvelopes(path, backend, field = None):
+    if backend == 'numpy':
+        envelopes, vertices = shapefileEnvelopes(path)
+        return np.arange(len(envelopes)), envelopes, vertices
+    ids, envelopes, vertices = [], [], []
+    with arcpy.da.SearchCursor(path, [field or arcpy.Describe(path).OIDFieldName, 'SHAPE@']) as cursor:
+        for oid, shape in cursor:
+            ids.append(oid)
+            if shape is None:
+                envelopes.append((np.inf, np.inf, -np.inf, -np.inf))
+                vertices.append(0)
+            else:
+                extent = shape.extent
+                envelopes.append((extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+                vertices.append(shape.pointCount)
+    return np.array(ids), np.array(envelopes, dtype = float).reshape(-1, 4), np.array(vertices, dtype = np.int64)
+
+# EnvelopeIndex is a grid index of envelopes. Each envelope is listed in every grid cell it overlaps
+# (envelopes that overlap many cells are kept in a separate list that every query checks), and a query
+# returns the indices of the envelopes that overlap the query envelope.
+class EnvelopeIndex():
+
+    def __init__(self, envelopes, cellsPerAxis = None):
+        self.envelopes = np.asarray(envelopes, dtype = float).reshape(-1, 4)
+        valid = np.flatnonzero(self.envelopes[:, 0] <= self.envelopes[:, 2])
+        self.size = 0
+        if not len(valid):
+            return
+        envelopes = self.envelopes[valid]
+        self.extent = (envelopes[:, 0].min(), envelopes[:, 1].min(), envelopes[:, 2].max(), envelopes[:, 3].max())
+        self.size = int(cellsPerAxis or min(1024, max(1, np.sqrt(len(valid)))))
+        self.width = (self.extent[2] - self.extent[0]) / self.size or 1.0
+        self.height = (self.extent[3] - self.extent[1]) / self.size or 1.0
+
+        x0, y0, x1, y1 = self._cells(envelopes)
+        columns = x1 - x0 + 1
+        spans = columns * (y1 - y0 + 1)
+        large = spans > 64
+        self.large = valid[large]
+        small = ~large
+        counts = spans[small]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = np.repeat(x0[small], counts) + offsets % np.repeat(columns[small], counts)
+        cy = np.repeat(y0[small], counts) + offsets // np.repeat(columns[small], counts)
+        keys = cy * self.size + cx
+        order = np.argsort(keys, kind = 'stable')
+        self.keys = keys[order]
+        self.ids = np.repeat(valid[small], counts)[order]
+
+    # Returns the grid cell ranges (x0, y0, x1, y1) of an (n, 4) array of envelopes
+    def _cells(self, envelopes):
+        last = self.size - 1
+        return (np.clip(((envelopes[:, 0] - self.extent[0]) / self.width).astype(int), 0, last),
+                np.clip(((envelopes[:, 1] - self.extent[1]) / self.height).astype(int), 0, last),
+                np.clip(((envelopes[:, 2] - self.extent[0]) / self.width).astype(int), 0, last),
+                np.clip(((envelopes[:, 3] - self.extent[1]) / self.height).astype(int), 0, last))
+
+    # Returns the indices of the envelopes that overlap envelope
+    def query(self, envelope):
+        xmin, ymin, xmax, ymax = envelope
+        if (self.size == 0 or not xmin <= xmax or xmax < self.extent[0] or xmin > self.extent[2]
+                or ymax < self.extent[1] or ymin > self.extent[3]):
+            return np.empty(0, dtype = int)
+        last = self.size - 1
+        x0 = min(max(int((xmin - self.extent[0]) / self.width), 0), last)
+        x1 = min(max(int((xmax - self.extent[0]) / self.width), 0), last)
+        y0 = min(max(int((ymin - self.extent[1]) / self.height), 0), last)
+        y1 = min(max(int((ymax - self.extent[1]) / self.height), 0), last)
+        rows = np.arange(y0, y1 + 1) * self.size
+        starts = np.searchsorted(self.keys, rows + x0)
+        ends = np.searchsorted(self.keys, rows + x1, side = 'right')
+        candidates = np.concatenate([self.ids[s:e] for s, e in zip(starts, ends)] + [self.large])
+        found = self.envelopes[candidates]
+        # an envelope is listed in each cell it overlaps, so the result can have repeats
+        return np.unique(candidates[(found[:, 0] <= xmax) & (found[:, 2] >= xmin) & (found[:, 1] <= ymax) & (found[:, 3] >= ymin)])
+
+    # Returns the number of envelopes that overlap envelope
+    def count(self, envelope):
+        return len(self.query(envelope))
+
+# Returns for each clipper envelope (in the order of clipperIndex) the number of target features whose
+# envelope overlaps it. Whichever of the two indexes needs fewer queries is queried.
+def candidateCounts(clipperIndex, targetEnvelopes):
+    if len(targetEnvelopes) < len(clipperIndex.envelopes):
+        counts = np.zeros(len(clipperIndex.envelopes), dtype = np.int64)
+        for envelope in targetEnvelopes:
+            counts[clipperIndex.query(envelope)] += 1
+        return counts
+    targetIndex = EnvelopeIndex(targetEnvelopes)
+    return np.array([targetIndex.count(envelope) for envelope in clipperIndex.envelopes], dtype = np.int64)
+
+# =======================================
+# cost-based scheduling
+# =======================================
+
+# Returns the jobs in chunks for the pool, the most expensive jobs first (longest processing time first), so
+# a giant clipper polygon does not start last and leave the other processes idle at the end of the run. A
+# chunk is closed when it holds chunkSizeFor jobs or its cost reaches an eighth of a process's share of the
+# total cost, so the expensive jobs are sent one by one and the cheap ones are grouped.
+def scheduleByCost(jobs, costs, cpuNum, chunkSize = 0):
+    costs = np.asarray(costs, dtype = float)
+    maxJobs = chunkSizeFor(len(jobs), cpuNum, chunkSize)
+    target = costs.sum() / (max(1, cpuNum) * 8)
+    chunks, chunk, chunkCost = [], [], 0.0
+    for i in np.argsort(-costs, kind = 'stable'):
+        if chunk and (len(chunk) >= maxJobs or chunkCost + costs[i] > target):
+            chunks.append(chunk)
+            chunk, chunkCost = [], 0.0
+        chunk.append(jobs[i])
+        chunkCost += costs[i]
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+# Reports how busy each pool process was: its jobs, the seconds it spent on them and that time as a
+# share of the wall time of the pool
+def reportUtilization(results, wallSeconds):
+    busy = {}
+    for result in results:
+        jobs, seconds = busy.get(result['pid'], (0, 0.0))
+        busy[result['pid']] = (jobs + 1, seconds + result['seconds'])
+    for pid, (jobs, seconds) in sorted(busy.items()):
+        message("process {}: {} jobs, {:.1f} s busy, {:.0f}% utilization".format(pid, jobs, seconds, 100.0 * seconds / wallSeconds if wallSeconds else 0.0))
+    if busy:
+        total = sum(seconds for jobs, seconds in busy.values())
+        message("mean utilization {:.0f}% over {} processes ({:.1f} s wall time)".format(
+            100.0 * total / (wallSeconds * len(busy)) if wallSeconds else 0.0, len(busy), wallSeconds))
+
+# =======================================
+# job telemetry
+# =======================================
+
+# Returns the peak memory of this process in bytes so far (None where it cannot be read)
+def peakMemory():
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024     # kilobytes everywhere but on macOS
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        return None
+
+# Returns a new telemetry record for the job (oid, tobeclipped). The worker fills in the phases, the
+# output feature count and the exception text, and finishJobRecord adds the totals.
+def newJobRecord(oid, tobeclipped):
+    return {'oid': oid, 'fc': os.path.basename(os.path.splitext(tobeclipped)[0]), 'ok': False, 'pid': os.getpid(),
+            'phases': {}, 'candidateFeatures': None, 'outputFeatures': None, 'error': None,
+            '_start': (time.perf_counter(), time.process_time())}
+
+# Adds the wall and CPU seconds of the whole job and the peak memory of the process to a job record
+def finishJobRecord(record):
+    wall, cpu = record.pop('_start')
+    record['seconds'] = time.perf_counter() - wall
+    record['cpuSeconds'] = time.process_time() - cpu
+    record['peakMemoryBytes'] = peakMemory()
+    return record
+
+# PhaseTimer adds the wall and CPU time of a `with` block to a phase of a job record (nothing is recorded
+# when the record is None)
+class PhaseTimer():
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = (time.perf_counter(), time.process_time())
+        return self
+
+    def __exit__(self, *exc):
+        if self.record is not None:
+            phase = self.record['phases'].setdefault(self.name, {'wall': 0.0, 'cpu': 0.0})
+            phase['wall'] += time.perf_counter() - self.start[0]
+            phase['cpu'] += time.process_time() - self.start[1]
+        return False
+
+# Writes the JSON run report of a run to path and returns it: the run totals and settings in `run`, the
+# time spent in each phase over all jobs, the busy time of each process, the failed jobs with their
+# exception text and every job record
+def writeRunReport(path, records, wallSeconds, run):
+    phases = {}
+    for record in records:
+        for name, phase in record['phases'].items():
+            total = phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            total['wall'] += phase['wall']
+            total['cpu'] += phase['cpu']
+    processes = {}
+    for record in records:
+        process = processes.setdefault(str(record['pid']), {'jobs': 0, 'seconds': 0.0, 'peakMemoryBytes': None})
+        process['jobs'] += 1
+        process['seconds'] += record['seconds']
+        if record['peakMemoryBytes'] is not None:
+            process['peakMemoryBytes'] = max(process['peakMemoryBytes'] or 0, record['peakMemoryBytes'])
+    for process in processes.values():
+        process['utilization'] = process['seconds'] / wallSeconds if wallSeconds else None
+    report = dict(run)
+    report.update({
+        'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'wallSeconds': wallSeconds,
+        'jobs': len(records),
+        'failed': sum(1 for record in records if not record['ok']),
+        'candidateFeatures': sum(record['candidateFeatures'] or 0 for record in records),
+        'outputFeatures': sum(record['outputFeatures'] or 0 for record in records),
+        'phases': phases,
+        'processes': processes,
+        'failures': [{'oid': record['oid'], 'fc': record['fc'], 'error': record['error']} for record in records if not record['ok']],
+        'records': records,
+    })
+    with open(path, 'w', encoding = 'utf8') as file:
+        json.dump(report, file, indent = 1, default = str)
+    return report
+
+# Reports the slowest jobs of a run with the time of their phases and their feature counts
+def reportSlowest(records, count = 10):
+    slowest = sorted(records, key = lambda record: record['seconds'], reverse = True)[:count]
+    if slowest:
+        message("Slowest jobs:")
+    for record in slowest:
+        phases = ", ".join("{} {:.2f} s".format(name, phase['wall']) for name, phase in record['phases'].items())
+        message("  OID {} ({}): {:.2f} s ({}), {} candidate / {} output features{}".format(
+            record['oid'], record['fc'], record['seconds'], phases, record['candidateFeatures'], record['outputFeatures'],
+            "" if record['ok'] else ", FAILED"))
+
+# =======================================
+# checkpoint/resume manifest
+# =======================================
+
+# Returns the path of the output shapefile of the job (oid, fc); fc is None for PyProj6_A (one target)
+def outputPath(outputFolder, oid, fc = None):
+    return os.path.join(outputFolder, "clip_" + str(oid) + ("_" + fc if fc else "") + ".shp")
+
+# Returns the files that make up the dataset path (e.g. the .shp, .shx, .dbf, .prj ... of a shapefile). The
+# lock files ArcGIS puts next to them and other datasets whose name starts the same (roads.old.shp) are left out.
+def datasetFiles(path):
+    folder, name = os.path.split(os.path.splitext(path)[0])
+    if not os.path.isdir(folder or '.'):
+        return []
+    files = []
+    for f in os.listdir(folder or '.'):
+        rest = f[len(name) + 1:]
+        if f.startswith(name + '.') and ('.' not in rest or rest == 'shp.xml'):
+            files.append(os.path.join(folder, f))
+    return sorted(files)
+
+# Returns a checksum of the names and contents of files
+def filesChecksum(files):
+    digest = hashlib.sha1()
+    for path in files:
+        digest.update(os.path.basename(path).encode('utf8') + b'\0')
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+# Returns a fingerprint of an input dataset. A shapefile is fingerprinted by the names, sizes and modification
+# times of its own files (see datasetFiles); a feature class in a geodatabase, or a name in the arcpy workspace,
+# by its feature count, extent and a hash of its rows. Other files in the folder do not change it.
+def datasetFingerprint(path):
+    if not os.path.isfile(path) and arcpy is not None:
+        path = arcpy.Describe(path).catalogPath
+        if not os.path.isfile(path):
+            return featureClassFingerprint(path)
+    digest = hashlib.sha1()
+    for name in datasetFiles(os.path.abspath(path)):
+        stat = os.stat(name)
+        digest.update("{}|{}|{}\n".format(os.path.basename(name), stat.st_size, stat.st_mtime_ns).encode('utf8'))
+    return digest.hexdigest()
+
+# Returns a fingerprint of a feature class read with arcpy: its feature count, extent and the shape and
+# attributes of every row
+def featureClassFingerprint(path):
+    extent = arcpy.Describe(path).extent
+    digest = hashlib.sha1("{}|{}|{}|{}|{}\n".format(arcpy.GetCount_management(path)[0], extent.XMin, extent.YMin, extent.XMax, extent.YMax).encode('utf8'))
+    fields = ['OID@', 'SHAPE@WKB'] + [field.name for field in arcpy.ListFields(path) if field.type not in ('OID', 'Geometry', 'Blob', 'Raster')]
+    with arcpy.da.SearchCursor(path, fields) as cursor:
+        for row in cursor:
+            digest.update(repr(row).encode('utf8'))
+    return digest.hexdigest()
+
+# Returns a fingerprint of the geometry of each clipper polygon by OID, so editing one polygon only makes
+# its own jobs stale
+def clipperFingerprints(clipper, backend, field):
+    if backend == 'numpy':
+        return {oid: hashlib.sha1(b''.join(np.ascontiguousarray(part, dtype = '<f8').tobytes() for part in parts or [])).hexdigest()
+                for oid, parts in enumerate(readShapefile(clipper).shapes)}
+    with arcpy.da.SearchCursor(clipper, [field, 'SHAPE@WKB']) as cursor:
+        return {oid: hashlib.sha1(bytes(wkb or b'')).hexdigest() for oid, wkb in cursor}
+
+# RunManifest records the finished jobs of the clip runs in an output folder in a JSON lines file: for each
+# job its key, the fingerprints of its inputs and the checksum of its output files. Every line is flushed to
+# disk when it is written, so after a crash or a cancel the manifest lists exactly the jobs that finished
+# (a half-written last line is ignored). A restarted run only schedules the jobs that are missing, whose
+# inputs changed or whose output files no longer match their checksum.
+class RunManifest():
+
+    def __init__(self, outputFolder, name = 'clip_manifest.jsonl'):
+        self.path = os.path.join(outputFolder, name)
+        self.entries = {}
+        lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding = 'utf8') as file:
+                for line in file:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['key']] = entry
+        # rewrite the manifest without half-written or superseded lines, so new lines are not appended to a
+        # broken one and the file does not grow with every resumed run
+        if lines > len(self.entries):
+            with open(self.path + '.tmp', 'w', encoding = 'utf8') as file:
+                for entry in self.entries.values():
+                    file.write(json.dumps(entry) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(self.path + '.tmp', self.path)
+
+    # Returns the manifest key of the job (oid, fc)
+    @staticmethod
+    def key(oid, fc = None):
+        return str(oid) + '|' + (fc or '')
+
+    # Returns whether the job finished in an earlier run with the same inputs and its output is unchanged
+    def isDone(self, key, inputs, outFC):
+        entry = self.entries.get(key)
+        if entry is None or entry['inputs'] != inputs:
+            return False
+        files = datasetFiles(outFC)
+        return bool(files) and filesChecksum(files) == entry['checksum']
+
+    # Records a finished job
+    def record(self, key, inputs, outFC):
+        entry = {'key': key, 'inputs': inputs, 'checksum': filesChecksum(datasetFiles(outFC)),
+                 'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        self.entries[key] = entry
+        with open(self.path, 'a', encoding = 'utf8') as file:
+            file.write(json.dumps(entry) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+# Deletes the output files of a job that is going to be (re)done and returns whether there were any, i.e.
+# whether a partial or stale output was left by an earlier run
+def removeOutputs(outFC):
+    files = datasetFiles(outFC)
+    for path in files:
+        os.remove(path)
+    return bool(files)
+
+# =======================================
+# merged GeoPackage output
+# =======================================
+
+# MergedOutput is the single writer of the merged output mode. The workers send the features they clipped
+# through its queue (see sendFeatures) instead of creating a shapefile per job, and a thread of the main
+# process writes them to one GeoPackage: a table per target feature class, with the OID of the clipper
+# polygon in the SOURCE_OID field and an R-tree spatial index that is filled when the output is closed.
+# An existing file is removed when the output is created, so a run that writes no features does not leave
+# the file of an earlier run behind. If writing fails, the rest of the queue is still read (so no worker
+# blocks on a full queue) and the error text is kept in failure.
+class MergedOutput():
+
+    def __init__(self, path, queue):
+        self.path = path
+        self.queue = queue
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        self.writers = {}
+        self.srsIds = {}
+        self.features = 0
+        self.failure = None
+        self._thread = threading.Thread(target = self._run, daemon = True)
+        self._thread.start()
+
+    # the writer thread; the GeoPackage connections are used (and closed) in this thread only
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.failure is None:
+                try:
+                    self.write(*item)
+                except Exception:
+                    self.failure = traceback.format_exc()
+        try:
+            for writer in self.writers.values():
+                writer.close()
+        except Exception:
+            self.failure = self.failure or traceback.format_exc()
+
+    # adds rows of (source OID, attribute values..., WKB) to the table, creating it the first time
+    def write(self, tableName, geometryType, fields, srs, rows):
+        writer = self.writers.get(tableName)
+        if writer is None:
+            srsId, organization = self._srsId(srs)
+            writer = GeoPackageWriter(self.path, geometryType, [('SOURCE_OID', 'INTEGER')] + fields, srsId, srs[1], tableName,
+                                      srsOrganization = organization, replace = not self.writers)
+            self.writers[tableName] = writer
+        writer.writeRecords(rows)
+        self.features += len(rows)
+
+    # srs is (EPSG code, WKT); a coordinate system without a code gets an id of its own for each WKT
+    def _srsId(self, srs):
+        code, wkt = srs
+        if code:
+            return code, 'EPSG'
+        if not wkt:
+            return -1, 'NONE'
+        return self.srsIds.setdefault(wkt, 100000 + len(self.srsIds)), 'NONE'
+
+    # waits until everything that was sent is written, builds the spatial indexes and closes the GeoPackage.
+    # The pool has to be joined first, so the workers have handed all their features to the queue.
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+        return self.features
+
+# Sends features of a worker to the merged output of the run. fields are (name, SQLite type) pairs, srs is
+# (EPSG code, WKT) and the rows are (source OID, attribute values..., WKB) tuples.
+def sendFeatures(tableName, geometryType, fields, srs, rows):
+    workerState['queue'].put((tableName, geometryType, fields, srs, rows))
+
+# SQLite type of each arcpy field type that is copied to the merged output
+arcpyFieldTypes = {'String': 'TEXT', 'Integer': 'INTEGER', 'SmallInteger': 'INTEGER', 'BigInteger': 'INTEGER',
+                   'Double': 'REAL', 'Single': 'REAL', 'Date': 'DATETIME', 'GUID': 'TEXT'}
+
+# Sends the features of a feature class (arcpy backend, e.g. a clip output in the memory workspace) to the
+# merged output as the features of the clipper polygon oid and returns their number. The geometries are
+# read as WKB, so the table has the generic GEOMETRY type.
+def sendFeatureClass(features, oid, tableName):
+    fields = [field for field in arcpy.ListFields(features) if field.type in arcpyFieldTypes]
+    with arcpy.da.SearchCursor(features, [field.name for field in fields] + ['SHAPE@WKB']) as cursor:
+        rows = [(oid,) + tuple(value.isoformat() if hasattr(value, 'isoformat') else value for value in row[:-1]) + (bytes(row[-1]),)
+                for row in cursor if row[-1] is not None]
+    if rows:
+        spatialReference = arcpy.Describe(features).spatialReference
+        srs = (None, None) if spatialReference.name == 'Unknown' else (spatialReference.factoryCode or None, spatialReference.exportToString())
+        sendFeatures(tableName, 'GEOMETRY', [(field.name, arcpyFieldTypes[field.type]) for field in fields], srs, rows)
+    return len(rows)
+
+# GeoPackage geometry type of the output of each shapefile shape type (numpy backend); lines and polygons
+# are written as their multi version, since a clipped feature can fall apart in several pieces
+gpkgGeometryTypes = {1: 'POINT', 8: 'MULTIPOINT', 3: 'MULTILINESTRING', 5: 'MULTIPOLYGON'}
+
+# Returns the WKB of a shape of a shapefile with the shape type (numpy backend)
+def shapeWkb(shapeType, parts):
+    def coordinates(points):
+        return struct.pack('<I', len(points)) + np.ascontiguousarray(points, dtype = '<f8').tobytes()
+    if shapeType == 1:
+        return struct.pack('<BI2d', 1, 1, *parts[0][0])
+    if shapeType == 8:
+        return struct.pack('<BII', 1, 4, len(parts[0])) + b''.join(struct.pack('<BI2d', 1, 1, x, y) for x, y in parts[0].tolist())
+    if shapeType == 3:
+        return struct.pack('<BII', 1, 5, len(parts)) + b''.join(struct.pack('<BI', 1, 2) + coordinates(part) for part in parts)
+    polygons = polygonRings(parts)
+    return struct.pack('<BII', 1, 6, len(polygons)) + b''.join(
+        struct.pack('<BII', 1, 3, len(rings)) + b''.join(coordinates(ring) for ring in rings) for rings in polygons)
+
+# Groups the rings of a polygon shape into polygons, each a list of its outer ring and its holes. A ring
+# is nested in the smallest larger ring that holds most of its vertices; rings at an even depth are outer
+# rings and rings at an odd depth are holes of the ring they are nested in.
+def polygonRings(rings):
+    if len(rings) == 1:
+        return [rings]
+    areas = [abs(np.dot(ring[:-1, 0], ring[1:, 1]) - np.dot(ring[1:, 0], ring[:-1, 1])) / 2 for ring in rings]
+    order = np.argsort(areas)[::-1].tolist()
+    depth, polygons = {}, {}
+    for n, i in enumerate(order):
+        parent = None
+        for j in reversed(order[:n]):
+            if pointsInPolygon(rings[i], ringEdges([rings[j]])).mean() > 0.5:
+                parent = j
+                break
+        depth[i] = 0 if parent is None else depth[parent] + 1
+        if depth[i] % 2 == 0:
+            polygons[i] = [rings[i]]
+        else:
+            polygons[parent].append(rings[i])
+    return list(polygons.values())
+
+# SQLite type of a dBASE field (name, type, length, decimals) in the merged output
+def dbfSqlType(field):
+    name, fieldType, length, decimals = field
+    if fieldType == 'N' and decimals == 0 and length < 19:
+        return 'INTEGER'
+    return {'N': 'REAL', 'F': 'REAL', 'L': 'BOOLEAN', 'D': 'DATE'}.get(fieldType, 'TEXT')
+
+# Returns the Python codec for the text of a .cpg file (Latin-1 when there is none or it is not known)
+def dbfEncoding(cpg):
+    name = (cpg or '').strip()
+    if name.isdigit():
+        name = 'cp' + name
+    try:
+        return codecs.lookup(name).name if name else 'latin-1'
+    except LookupError:
+        return 'latin-1'
+
+# Decodes a raw dBASE record into the values of its fields, with the types of dbfSqlType (empty values are None)
+def dbfValues(fields, record, encoding):
+    values = []
+    position = 1    # after the deletion flag
+    for field in fields:
+        text = record[position:position + field[2]].decode(encoding, 'replace').strip()
+        position += field[2]
+        sqlType = dbfSqlType(field)
+        if sqlType in ('INTEGER', 'REAL'):
+            value = None if not text or text.startswith('*') else (int(text) if sqlType == 'INTEGER' else float(text))
+        elif sqlType == 'BOOLEAN':
+            value = 1 if text in ('Y', 'y', 'T', 't') else 0 if text in ('N', 'n', 'F', 'f') else None
+        elif sqlType == 'DATE':
+            value = text[:4] + '-' + text[4:6] + '-' + text[6:8] if len(text) == 8 and text.isdigit() else None
+        else:
+            value = text or None
+        values.append(value)
+    return values
+
+# =======================================
+# shapefile reading and writing (numpy backend)
+# =======================================
+
+# 2D shape type of each shapefile shape type (Z and M types are read as their 2D type)
+baseShapeTypes = {0: 0, 1: 1, 3: 3, 5: 5, 8: 8, 11: 1, 13: 3, 15: 5, 18: 8, 21: 1, 23: 3, 25: 5, 28: 8}
+
+# Shapefile holds the features of a shapefile: the 2D shape type, the shapes (for each feature a list of
+# (n, 2) coordinate arrays, one per part, or None for a null shape), the envelope of each feature as
+# (xmin, ymin, xmax, ymax), the dBASE fields as (name, type, length, decimals), the raw dBASE record
+# of each feature, and the text of the .prj and .cpg files (None when there are none)
+class Shapefile():
+
+    def __init__(self, shapeType, shapes, fields, records, prj = None, cpg = None):
+        self.shapeType = shapeType
+        self.shapes = shapes
+        self.fields = fields
+        self.records = records
+        self.prj = prj
+        self.cpg = cpg
+        self.envelopes = np.array([shapeEnvelope(parts) for parts in shapes], dtype = float).reshape(-1, 4)
+
+# Returns the envelope (xmin, ymin, xmax, ymax) of a shape; a null shape gets an envelope that overlaps nothing
+def shapeEnvelope(parts):
+    if not parts:
+        return (np.inf, np.inf, -np.inf, -np.inf)
+    points = parts[0] if len(parts) == 1 else np.concatenate(parts)
+    low, high = points.min(axis = 0), points.max(axis = 0)
+    return (low[0], low[1], high[0], high[1])
+
+# Returns the text of a sidecar file of a shapefile (e.g. '.prj'), or None if there is none
+def _sidecar(path, extension):
+    name = os.path.splitext(path)[0] + extension
+    if not os.path.exists(name):
+        return None
+    with open(name, 'r') as file:
+        return file.read()
+
+# Returns the parts of a shape from the content of a .shp record
+def _parseShape(content):
+    shapeType = baseShapeTypes.get(struct.unpack_from('<i', content, 0)[0])
+    if shapeType is None:
+        raise ValueError("unsupported shape type " + str(struct.unpack_from('<i', content, 0)[0]))
+    if shapeType == 0:
+        return None
+    if shapeType == 1:
+        return [np.frombuffer(content, '<f8', 2, 4).reshape(1, 2)]
+    if shapeType == 8:
+        numPoints = struct.unpack_from('<i', content, 36)[0]
+        return [np.frombuffer(content, '<f8', 2 * numPoints, 40).reshape(-1, 2)]
+    numParts, numPoints = struct.unpack_from('<2i', content, 36)
+    starts = np.frombuffer(content, '<i4', numParts, 44).tolist() + [numPoints]
+    points = np.frombuffer(content, '<f8', 2 * numPoints, 44 + 4 * numParts).reshape(-1, 2)
+    return [points[starts[i]:starts[i + 1]] for i in range(numParts)]
+
+# Reads the .shp, .dbf, .prj and .cpg files of the shapefile path
+def readShapefile(path):
+    if not path.lower().endswith('.shp'):
+        raise ValueError("the numpy backend only reads shapefiles: " + path)
+    with open(path, 'rb') as file:
+        data = file.read()
+    if struct.unpack_from('>i', data, 0)[0] != 9994:
+        raise ValueError("not a shapefile: " + path)
+    shapeType = baseShapeTypes.get(struct.unpack_from('<i', data, 32)[0])
+    if shapeType is None:
+        raise ValueError("unsupported shape type in " + path)
+
+    shapes = []
+    offset = 100
+    while offset + 8 <= len(data):
+        length = 2 * struct.unpack_from('>i', data, offset + 4)[0]
+        shapes.append(_parseShape(data[offset + 8:offset + 8 + length]))
+        offset += 8 + length
+
+    fields, records = readDbf(os.path.splitext(path)[0] + '.dbf')
+    return Shapefile(shapeType, shapes, fields, records, _sidecar(path, '.prj'), _sidecar(path, '.cpg'))
+
+# Returns the envelopes of the shapes of the shapefile path as an (n, 4) array and their vertex counts,
+# reading only the record headers, bounding boxes and point counts of the .shp file, not the coordinates
+def shapefileEnvelopes(path):
+    envelopes, vertices = [], []
+    with open(path, 'rb') as file:
+        file.seek(100)
+        while True:
+            header = file.read(12)
+            if len(header) < 12:
+                break
+            length = 2 * struct.unpack_from('>i', header, 4)[0]
+            shapeType = baseShapeTypes.get(struct.unpack_from('<i', header, 8)[0], 0)
+            if shapeType == 0:
+                envelopes.append((np.inf, np.inf, -np.inf, -np.inf))
+                vertices.append(0)
+                file.seek(length - 4, 1)
+            elif shapeType == 1:
+                x, y = struct.unpack('<2d', file.read(16))
+                envelopes.append((x, y, x, y))
+                vertices.append(1)
+                file.seek(length - 20, 1)
+            else:
+                content = file.read(40)
+                envelopes.append(struct.unpack_from('<4d', content, 0))
+                vertices.append(struct.unpack_from('<i', content, 32 if shapeType == 8 else 36)[0])
+                file.seek(length - 44, 1)
+    return np.array(envelopes, dtype = float).reshape(-1, 4), np.array(vertices, dtype = np.int64)
+
+# Reads a dBASE file and returns its fields and its raw records (the records are not decoded, so they
+# are written to the output unchanged)
+def readDbf(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    numRecords, headerLength, recordLength = struct.unpack_from('<IHH', data, 4)
+    fields = []
+    position = 32
+    while position < headerLength and data[position] != 0x0D:
+        name = data[position:position + 11].split(b'\0')[0].decode('ascii', 'replace')
+        fields.append((name, chr(data[position + 11]), data[position + 16], data[position + 17]))
+        position += 32
+    records = [data[headerLength + i * recordLength:headerLength + (i + 1) * recordLength] for i in range(numRecords)]
+    return fields, records
+
+# Returns the content of a .shp record for the parts of a shape
+def _shapeContent(shapeType, parts):
+    if not parts:
+        return struct.pack('<i', 0)
+    points = parts[0] if len(parts) == 1 else np.concatenate(parts)
+    points = np.ascontiguousarray(points, dtype = '<f8')
+    if shapeType == 1:
+        return struct.pack('<i2d', 1, points[0, 0], points[0, 1])
+    box = shapeEnvelope([points])
+    if shapeType == 8:
+        return struct.pack('<i4di', 8, *box, len(points)) + points.tobytes()
+    starts = np.cumsum([0] + [len(part) for part in parts[:-1]]).astype('<i4')
+    return struct.pack('<i4d2i', shapeType, *box, len(parts), len(points)) + starts.tobytes() + points.tobytes()
+
+# Writes a shapefile (.shp, .shx, .dbf and, when given, .prj and .cpg) with the shapes and raw dBASE records
+def writeShapefile(path, shapeType, shapes, fields, records, prj = None, cpg = None):
+    base = os.path.splitext(path)[0]
+    contents = [_shapeContent(shapeType, parts) for parts in shapes]
+    envelopes = np.array([shapeEnvelope(parts) for parts in shapes if parts], dtype = float).reshape(-1, 4)
+    if len(envelopes):
+        box = (envelopes[:, 0].min(), envelopes[:, 1].min(), envelopes[:, 2].max(), envelopes[:, 3].max())
+    else:
+        box = (0.0, 0.0, 0.0, 0.0)
+
+    def header(words):
+        return struct.pack('>7i', 9994, 0, 0, 0, 0, 0, words) + struct.pack('<2i4d4d', 1000, shapeType, *box, 0, 0, 0, 0)
+
+    with open(base + '.shp', 'wb') as shp, open(base + '.shx', 'wb') as shx:
+        shp.write(header(50 + sum(4 + len(content) // 2 for content in contents)))
+        shx.write(header(50 + 4 * len(contents)))
+        offset = 50
+        for number, content in enumerate(contents, 1):
+            shp.write(struct.pack('>2i', number, len(content) // 2))
+            shp.write(content)
+            shx.write(struct.pack('>2i', offset, len(content) // 2))
+            offset += 4 + len(content) // 2
+
+    today = time.localtime()
+    recordLength = 1 + sum(field[2] for field in fields)
+    with open(base + '.dbf', 'wb') as dbf:
+        dbf.write(struct.pack('<4BIHH20x', 3, today.tm_year - 1900, today.tm_mon, today.tm_mday,
+                              len(records), 32 + 32 * len(fields) + 1, recordLength))
+        for name, fieldType, length, decimals in fields:
+            dbf.write(struct.pack('<11sc4xBB14x', name.encode('ascii')[:10], fieldType.encode('ascii'), length, decimals))
+        dbf.write(b'\r')
+        dbf.write(b''.join(records))
+        dbf.write(b'\x1a')
+
+    for extension, text in (('.prj', prj), ('.cpg', cpg)):
+        if text is not None:
+            with open(base + extension, 'w') as file:
+                file.write(text)
+
+# =======================================
+# geometry operations (numpy backend)
+# =======================================
+
+# Returns the edges of a list of rings (or paths) as an (m, 4) array of x1, y1, x2, y2
+def ringEdges(rings):
+    if not rings:
+        return np.empty((0, 4))
+    return np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+
+# Returns for each point whether it is inside the polygon with the given edges (even-odd rule, so holes
+# and several parts are handled by testing all rings at once). The edges are sorted into horizontal bands
+# and each point is only tested against the edges of its band, in blocks that limit the size of the
+# point x edge arrays. Small inputs (like the points of a feature and a rectangle) are tested against all
+# edges at once, which is the same test without the cost of sorting the bands.
+def pointsInPolygon(points, edges, blockSize = 1 << 20, smallSize = 1 << 14):
+    inside = np.zeros(len(points), dtype = bool)
+    if not len(edges) or not len(points):
+        return inside
+    if len(points) * len(edges) <= smallSize:
+        x1, y1, x2, y2 = (edges[:, i][None, :] for i in range(4))
+        x, y = points[:, 0:1], points[:, 1:2]
+        dy = np.where(y1 == y2, 1.0, y2 - y1)
+        return np.count_nonzero(((y1 > y) != (y2 > y)) & (x < x1 + (y - y1) * (x2 - x1) / dy), axis = 1) % 2 == 1
+    low, high = np.minimum(edges[:, 1], edges[:, 3]), np.maximum(edges[:, 1], edges[:, 3])
+    bottom, top = low.min(), high.max()
+    bandCount = int(min(max(1, len(edges)), 4096))
+    height = (top - bottom) / bandCount or 1.0
+
+    # the edges of each band (an edge is in every band its y range spans)
+    first = np.clip(((low - bottom) / height).astype(int), 0, bandCount - 1)
+    spans = np.clip(((high - bottom) / height).astype(int), 0, bandCount - 1) - first + 1
+    bands = np.repeat(first, spans) + np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans, spans)
+    order = np.argsort(bands, kind = 'stable')
+    bandEdges = np.repeat(np.arange(len(edges)), spans)[order]
+    bandStarts = np.searchsorted(bands[order], np.arange(bandCount + 1))
+
+    # points outside the y range of the edges cannot be inside
+    candidates = np.flatnonzero((points[:, 1] >= bottom) & (points[:, 1] <= top))
+    pointBands = np.clip(((points[candidates, 1] - bottom) / height).astype(int), 0, bandCount - 1)
+    order = np.argsort(pointBands, kind = 'stable')
+    candidates, pointBands = candidates[order], pointBands[order]
+    pointStarts = np.searchsorted(pointBands, np.arange(bandCount + 1))
+
+    for band in range(bandCount):
+        bandPoints = candidates[pointStarts[band]:pointStarts[band + 1]]
+        if not len(bandPoints):
+            continue
+        E = edges[bandEdges[bandStarts[band]:bandStarts[band + 1]]]
+        x1, y1, x2, y2 = (E[:, i][None, :] for i in range(4))
+        dy = np.where(y1 == y2, 1.0, y2 - y1)
+        step = max(1, blockSize // max(1, len(E)))
+        for start in range(0, len(bandPoints), step):
+            block = bandPoints[start:start + step]
+            x = points[block, 0:1]
+            y = points[block, 1:2]
+            crosses = ((y1 > y) != (y2 > y)) & (x < x1 + (y - y1) * (x2 - x1) / dy)
+            inside[block] = np.count_nonzero(crosses, axis = 1) % 2 == 1
+    return inside
+
+# Returns the intersections of the edges a with the edges b as arrays of: edge index in a, edge index in
+# b, parameter along the a edge, parameter along the b edge, and the intersection point. The point of an
+# intersection is computed once and shared by both sides, and it snaps to an edge end when it is one, so
+# the pieces cut from a and from b meet at exactly the same coordinates. Overlapping collinear edges
+# intersect at the ends of the overlap.
+def segmentIntersections(a, b, blockSize = 1 << 20, eps = 1e-12):
+    found = []
+    if len(a) and len(b):
+        bxmin, bxmax = np.minimum(b[:, 0], b[:, 2]), np.maximum(b[:, 0], b[:, 2])
+        bymin, bymax = np.minimum(b[:, 1], b[:, 3]), np.maximum(b[:, 1], b[:, 3])
+        for start in range(0, len(a), 256):
+            A = a[start:start + 256]
+            # edges of b that overlap the envelope of this block of a (consecutive edges are close together,
+            # so this leaves few edges of b for each block)
+            near = np.flatnonzero((bxmin <= max(A[:, 0].max(), A[:, 2].max())) & (bxmax >= min(A[:, 0].min(), A[:, 2].min())) &
+                                  (bymin <= max(A[:, 1].max(), A[:, 3].max())) & (bymax >= min(A[:, 1].min(), A[:, 3].min())))
+            step = max(1, blockSize // max(1, len(near)))
+            for first in range(0, len(A) if len(near) else 0, step):
+                found.append(_blockIntersections(A[first:first + step], b[near], start + first, near, eps))
+    if not found:
+        return (np.empty(0, int), np.empty(0, int), np.empty(0), np.empty(0), np.empty((0, 2)))
+    return tuple(np.concatenate(column) for column in zip(*found))
+
+def _blockIntersections(A, B, offset, indices, eps):
+    ax, ay = A[:, 0][:, None], A[:, 1][:, None]
+    adx, ady = (A[:, 2] - A[:, 0])[:, None], (A[:, 3] - A[:, 1])[:, None]
+    bx, by = B[:, 0][None, :], B[:, 1][None, :]
+    bdx, bdy = (B[:, 2] - B[:, 0])[None, :], (B[:, 3] - B[:, 1])[None, :]
+    qx, qy = bx - ax, by - ay
+    denominator = adx * bdy - ady * bdx
+    scale = np.hypot(adx, ady) * np.hypot(bdx, bdy)
+    parallel = np.abs(denominator) <= eps * scale
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ta = (qx * bdy - qy * bdx) / denominator
+        tb = (qx * ady - qy * adx) / denominator
+    tolerance = 1e-9
+    ia, ib = np.nonzero(~parallel & (ta >= -tolerance) & (ta <= 1 + tolerance) & (tb >= -tolerance) & (tb <= 1 + tolerance))
+    ta, tb = np.clip(ta[ia, ib], 0, 1), np.clip(tb[ia, ib], 0, 1)
+    A, B = A[ia], B[ib]
+    points = A[:, 0:2] + ta[:, None] * (A[:, 2:4] - A[:, 0:2])
+    # snap to the ends of the edges (to the a end when both are close), so an intersection at a vertex gets
+    # the same point from both edges that meet there
+    snapped = np.zeros(len(ta), dtype = bool)
+    for t, edges in ((ta, A), (tb, B)):
+        for end, column in ((0.0, 0), (1.0, 2)):
+            atEnd = ~snapped & (np.abs(t - end) <= tolerance)
+            points[atEnd] = edges[atEnd, column:column + 2]
+            t[atEnd] = end
+            snapped |= atEnd
+    result = [ia + offset, indices[ib], ta, tb, points]
+
+    # overlapping collinear edges: the ends of each edge that lie inside the other edge
+    pa, pb = np.nonzero(parallel & (np.abs(qx * ady - qy * adx) <= eps * scale))
+    if len(pa):
+        Ap, Bp = _blockEdges(ax, ay, adx, ady, pa), _blockEdges(bx.T, by.T, bdx.T, bdy.T, pb)
+        for first, second, swap in ((Ap, Bp, False), (Bp, Ap, True)):
+            length2 = first[:, 2] ** 2 + first[:, 3] ** 2
+            for end in (0.0, 1.0):
+                point = second[:, 0:2] + end * second[:, 2:4]
+                with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                    t = ((point[:, 0] - first[:, 0]) * first[:, 2] + (point[:, 1] - first[:, 1]) * first[:, 3]) / length2
+                inner = (t > 0) & (t < 1)
+                ends = np.full(np.count_nonzero(inner), end)
+                if swap:
+                    result = [np.concatenate(r) for r in zip(result, [pa[inner] + offset, indices[pb[inner]], ends, t[inner], point[inner]])]
+                else:
+                    result = [np.concatenate(r) for r in zip(result, [pa[inner] + offset, indices[pb[inner]], t[inner], ends, point[inner]])]
+    return result
+
+# Returns the start point and direction of the edges idx of a block as an (n, 4) array
+def _blockEdges(x, y, dx, dy, idx):
+    return np.column_stack([x[idx, 0], y[idx, 0], dx[idx, 0], dy[idx, 0]])
+
+# Returns the path (k + 1 points) with the intersection points added along its edges, in order, without
+# repeated points
+def _splitPath(path, edgeIndex, t, points):
+    count = len(path) - 1
+    edge = np.concatenate([np.arange(count), edgeIndex])
+    order = np.lexsort((np.concatenate([np.zeros(count), t]), edge))
+    sequence = np.concatenate([np.concatenate([path[:-1], points])[order], path[-1:]])
+    keep = np.concatenate([[True], np.any(sequence[1:] != sequence[:-1], axis = 1)])
+    return sequence[keep]
+
+# Returns the points at a small distance to the right (side = 1) or left (side = -1) of the middle of each
+# segment of a path. Polygon rings keep their interior on their right, as shapefile rings do. The distance
+# is at most a tenth of the segment length, so the points of very short pieces do not reach past the
+# edges that cut them.
+def _sidePoints(path, side, offset):
+    start, end = path[:-1], path[1:]
+    direction = end - start
+    length = np.hypot(direction[:, 0], direction[:, 1])
+    length[length == 0] = 1.0
+    normal = np.column_stack([direction[:, 1], -direction[:, 0]]) / length[:, None]
+    return (start + end) / 2 + side * np.minimum(offset, 0.1 * length)[:, None] * normal
+
+# Returns the runs of consecutive kept segments of a path as a list of paths
+def _keptRuns(path, keep):
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], keep.astype(np.int8), [0]])))
+    return [path[start:end + 1] for start, end in zip(edges[0::2], edges[1::2])]
+
+# Returns the tolerance used to offset test points from the segments, relative to the size of the data
+def _tolerance(*edgeSets):
+    extent = max(np.abs(edges).max() if len(edges) else 0.0 for edges in edgeSets)
+    return max(extent, 1.0) * 1e-9
+
+# Returns the rings with the interior of the polygon on their right, reversing the rings that do not
+# follow the shapefile convention (clockwise outer rings and counterclockwise holes)
+def orientRings(rings):
+    rings = [ring for ring in rings if len(ring) >= 4]
+    edges = ringEdges(rings)
+    offset = _tolerance(edges)
+    oriented = []
+    for ring in rings:
+        direction = ring[1:] - ring[:-1]
+        longest = np.argmax(np.hypot(direction[:, 0], direction[:, 1]))
+        test = _sidePoints(ring[longest:longest + 2], 1, offset)
+        oriented.append(ring if pointsInPolygon(test, edges)[0] else ring[::-1])
+    return oriented
+
+# Joins pieces of rings (paths whose ends meet exactly) into closed rings
+def _joinRings(pieces):
+    byStart = {}
+    for i, piece in enumerate(pieces):
+        byStart.setdefault(tuple(piece[0]), []).append(i)
+    used = [False] * len(pieces)
+    rings = []
+    for i, piece in enumerate(pieces):
+        if used[i]:
+            continue
+        used[i] = True
+        parts = [piece]
+        start, end = tuple(piece[0]), tuple(piece[-1])
+        while end != start:
+            following = [j for j in byStart.get(end, ()) if not used[j]]
+            if not following:
+                break
+            used[following[0]] = True
+            parts.append(pieces[following[0]][1:])
+            end = tuple(pieces[following[0]][-1])
+        ring = np.concatenate(parts)
+        if end == start and len(ring) >= 4:
+            rings.append(ring)
+    return rings
+
+# Returns the points of a (multi)point shape that are inside the clipper
+def clipPoints(points, clipEdges):
+    return points[pointsInPolygon(points, clipEdges)]
+
+# Returns the pieces of the lines (a list of paths) that are inside the clipper, including the pieces
+# that run along its boundary
+def clipLines(paths, clipEdges):
+    intersections = segmentIntersections(ringEdges(paths), clipEdges)
+    offset = _tolerance(clipEdges)
+    pieces = []
+    first = 0
+    for path in paths:
+        count = len(path) - 1
+        select = (intersections[0] >= first) & (intersections[0] < first + count)
+        first += count
+        if count < 1:
+            continue
+        path = _splitPath(path, intersections[0][select] - (first - count), intersections[2][select], intersections[4][select])
+        if len(path) < 2:
+            continue
+        keep = pointsInPolygon(_sidePoints(path, 1, offset), clipEdges) | pointsInPolygon(_sidePoints(path, -1, offset), clipEdges)
+        pieces.extend(_keptRuns(path, keep))
+    return pieces
+
+# Returns the rings of the intersection of a polygon (its rings) with the clipper polygon (its oriented
+# rings). The boundary of the result is made of the pieces of the polygon boundary inside the clipper and
+# the pieces of the clipper boundary inside the polygon; the pieces are cut at the intersections of the
+# two boundaries and joined again end to end. Boundaries the two polygons share are taken from the
+# polygon when both interiors are on the same side and dropped otherwise.
+def clipPolygon(rings, clipRings, clipEdges = None):
+    rings = orientRings(rings)
+    if clipEdges is None:
+        clipEdges = ringEdges(clipRings)
+    edges = ringEdges(rings)
+    ia, ib, ta, tb, points = segmentIntersections(edges, clipEdges)
+    offset = _tolerance(edges, clipEdges)
+
+    pieces = []
+    for ownRings, index, t, otherEdges, fromClipper in ((rings, ia, ta, clipEdges, False), (clipRings, ib, tb, edges, True)):
+        first = 0
+        for ring in ownRings:
+            count = len(ring) - 1
+            select = (index >= first) & (index < first + count)
+            path = _splitPath(ring, index[select] - first, t[select], points[select])
+            first += count
+            if len(path) < 2:
+                continue
+            keep = pointsInPolygon(_sidePoints(path, 1, offset), otherEdges)
+            if fromClipper:
+                # the clipper boundary is only kept where it is not also the polygon boundary
+                keep &= pointsInPolygon(_sidePoints(path, -1, offset), otherEdges)
+            pieces.extend(_keptRuns(path, keep))
+    return _joinRings(pieces)
+
+# Returns the oriented rings and the edges of the clipper polygon with object ID oid (numpy backend)
+def prepareClipper(clipper, oid):
+    clipRings = clipperGeometry(clipper, oid)
+    if clipRings is None:
+        clipRings = readShapefile(clipper).shapes[oid]
+    clipRings = orientRings(clipRings or [])
+    return clipRings, ringEdges(clipRings)
+
+# Clips the target shapefile tobeclipped to the clipper polygon with object ID oid (numpy backend) and
+# returns the target and the shapes and raw dBASE records of the output features. The time of the prepare
+# and clip phases is added to record when one is given. A clipper already prepared with prepareClipper can
+# be passed in, so it is prepared once when it clips several targets.
+def clipFeatures(clipper, tobeclipped, oid, record = None, prepared = None):
+    with PhaseTimer(record, 'prepare'):
+        clipRings, clipEdges = prepared or prepareClipper(clipper, oid)
+        target = targetShapefile(tobeclipped)
+
+    shapes, records = [], []
+    with PhaseTimer(record, 'clip'):
+        if len(clipEdges):
+            xmin, ymin = clipEdges[:, [0, 2]].min(), clipEdges[:, [1, 3]].min()
+            xmax, ymax = clipEdges[:, [0, 2]].max(), clipEdges[:, [1, 3]].max()
+            envelopes = target.envelopes
+            candidates = np.flatnonzero((envelopes[:, 0] <= xmax) & (envelopes[:, 2] >= xmin) &
+                                        (envelopes[:, 1] <= ymax) & (envelopes[:, 3] >= ymin))
+            for i in candidates:
+                parts = target.shapes[i]
+                if target.shapeType in (1, 8):
+                    points = clipPoints(parts[0], clipEdges)
+                    result = [points] if len(points) else []
+                elif target.shapeType == 3:
+                    result = clipLines(parts, clipEdges)
+                else:
+                    result = clipPolygon(parts, clipRings, clipEdges)
+                if result:
+                    shapes.append(result)
+                    records.append(target.records[i])
+    return target, shapes, records
+
+# Clips the target shapefile tobeclipped to the clipper polygon with object ID oid and writes the result
+# to the shapefile outFC (numpy backend). Returns the number of output features; the time of the prepare,
+# clip and write phases is added to record when one is given.
+def clipShapefile(clipper, tobeclipped, oid, outFC, record = None, prepared = None):
+    target, shapes, records = clipFeatures(clipper, tobeclipped, oid, record, prepared)
+    with PhaseTimer(record, 'write'):
+        writeShapefile(outFC, target.shapeType, shapes, target.fields, records, target.prj, target.cpg)
+    return len(shapes)
+
+# Clips the target shapefile tobeclipped to the clipper polygon with object ID oid and sends the result to
+# the merged output of the run, in the table named after the target (numpy backend). Returns the number of
+# output features; the time of the prepare, clip and send phases is added to record when one is given.
+def clipToMerged(clipper, tobeclipped, oid, record = None, prepared = None):
+    target, shapes, records = clipFeatures(clipper, tobeclipped, oid, record, prepared)
+    with PhaseTimer(record, 'send'):
+        if shapes:
+            encoding = dbfEncoding(target.cpg)
+            fields = [(field[0], dbfSqlType(field)) for field in target.fields]
+            rows = [(oid,) + tuple(dbfValues(target.fields, raw, encoding)) + (shapeWkb(target.shapeType, parts),)
+                    for parts, raw in zip(shapes, records)]
+            sendFeatures(os.path.basename(os.path.splitext(tobeclipped)[0]), gpkgGeometryTypes[target.shapeType], fields,
+                         (None, target.prj), rows)
+    return len(shapes)
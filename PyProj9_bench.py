@@ -0,0 +1,197 @@
+"""
+This is the benchmark script for PyProj9. It generates a synthetic Overpass-style JSON
+file with a seeded random generator and runs it through the stages of the PyProj9_func
+pipeline one after the other, timing each stage on its own:
+
+    parse     - streaming the JSON file into the node store and the list of ways
+    classify  - sending each way to its waterbody class with the rule table
+    measure   - building the geometries and measuring lengths/areas in batches
+    write     - writing the linear and areal GeoPackages
+
+The results (seconds, items, items per second and peak RSS after each stage) are written
+as JSON so runs of different versions can be compared. The script does not need QGIS or
+a display, so it can run on a headless build machine, e.g.:
+
+    python PyProj9_bench.py --nodes 2000000 --ways 200000 --report bench.json
+
+@author: dknight2
+"""
+import os, sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import PyProj9_func as waterbodies
+
+try:
+    import resource
+except ImportError:
+    resource = None     # not available on Windows
+
+# share of each kind of way in the generated data; 'other' ways are not waterbodies
+defaultMix = {'stream': 35, 'river': 10, 'canal': 5, 'lake': 10, 'pond': 10, 'reservoir': 5, 'other': 25}
+linearKinds = ('stream', 'river', 'canal')
+
+# =======================================
+# synthetic data generator
+# =======================================
+
+# Writes an Overpass-style JSON file with (at least) nodeCount nodes and wayCount ways to path. Linear
+# ways are random walks and areal ways are closed rings around a random center, so the lengths and
+# areas are realistic. Nodes that are not used by a way are added at the end to reach nodeCount. The
+# same seed always produces the same file.
+def generateOSM(path, nodeCount, wayCount, mix = defaultMix, seed = 0, nodesPerWay = (4, 40)):
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    ways = []       # (way id, kind, first node id, number of nodes) for each way
+    nextNode = 1
+
+    with open(path, 'w', encoding = "utf8") as file:
+        file.write('{"version": 0.6, "generator": "PyProj9_bench", "elements": [\n')
+        first = True
+        for w in range(wayCount):
+            kind = rng.choices(kinds, weights)[0]
+            n = rng.randint(*nodesPerWay)
+            lon, lat = rng.uniform(-120, 120), rng.uniform(-60, 60)
+            if kind in linearKinds or kind == 'other':
+                points = []
+                for _ in range(n):
+                    lon += rng.uniform(-0.002, 0.002)
+                    lat += rng.uniform(-0.002, 0.002)
+                    points.append((lon, lat))
+            else:
+                radius = rng.uniform(0.0005, 0.01)
+                points = [(lon + radius * np.cos(2 * np.pi * i / n), lat + radius * np.sin(2 * np.pi * i / n)) for i in range(n)]
+            for i, (x, y) in enumerate(points):
+                file.write(('' if first else ',\n') + json.dumps({'type': 'node', 'id': nextNode + i, 'lat': y, 'lon': x}))
+                first = False
+            ways.append((1000000000 + w, kind, nextNode, n))
+            nextNode += n
+
+        # unused nodes to reach the requested node count
+        while nextNode <= nodeCount:
+            file.write(('' if first else ',\n') + json.dumps({'type': 'node', 'id': nextNode, 'lat': rng.uniform(-60, 60), 'lon': rng.uniform(-120, 120)}))
+            first = False
+            nextNode += 1
+
+        for wid, kind, start, n in ways:
+            nodes = list(range(start, start + n))
+            if kind in linearKinds:
+                tags = {'waterway': kind}
+            elif kind == 'other':
+                tags = {'highway': 'track'}
+            else:
+                tags = {'natural': 'water', 'water': kind}
+                nodes.append(start)     # close the ring
+            if rng.random() < 0.5:
+                tags['name'] = kind.capitalize() + ' ' + str(wid)
+            file.write(('' if first else ',\n') + json.dumps({'type': 'way', 'id': wid, 'nodes': nodes, 'tags': tags}))
+            first = False
+        file.write('\n]}\n')
+    return nextNode - 1
+
+# =======================================
+# benchmark stages
+# =======================================
+
+# Returns the peak resident set size of this process in bytes (None where it is not available)
+def peakRss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024     # kilobytes everywhere but on macOS
+
+# Runs func() and returns its result and a dictionary with the timing of the stage
+def timeStage(name, func, items):
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    count = items(result)
+    return result, {'stage': name, 'seconds': seconds, 'items': count,
+                    'itemsPerSecond': count / seconds if seconds > 0 else None, 'peakRssBytes': peakRss()}
+
+# Runs the four pipeline stages on jsonFile and returns the list of stage results
+def runStages(jsonFile, workFolder):
+    stages = []
+    nodes = waterbodies.NodeStore()
+
+    # the parse stage counts all elements (nodes and ways) it has read
+    ways, stage = timeStage('parse', lambda: list(waterbodies.streamOSMWays(jsonFile, nodes)), lambda w: len(w) + len(nodes))
+    stage['nodes'] = len(nodes)
+    stages.append(stage)
+
+    matches, stage = timeStage('classify', lambda: [(c, way) for way in ways for c in waterbodies.classifyWay(way)], lambda m: len(ways))
+    stage['matches'] = len(matches)
+    stages.append(stage)
+    del ways
+
+    records, stage = timeStage('measure', lambda: waterbodies.waterbodyRecords(matches, nodes), lambda r: len(matches))
+    stages.append(stage)
+    del matches
+    linearRecords, arealRecords = records
+
+    def write():
+        waterbodies.LinearWaterbody.toGeoPackage(linearRecords, os.path.join(workFolder, 'bench_linear.gpkg'))
+        waterbodies.ArealWaterbody.toGeoPackage(arealRecords, os.path.join(workFolder, 'bench_areal.gpkg'))
+    _, stage = timeStage('write', write, lambda r: len(linearRecords) + len(arealRecords))
+    stages.append(stage)
+    return stages
+
+# Returns the commit of the working copy this script is in, if it is a git checkout
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = os.path.dirname(os.path.abspath(__file__)),
+                                       stderr = subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+# Parses a mix like "stream=35,lake=10,other=20" into a dictionary
+def parseMix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, share = part.split('=')
+        mix[kind.strip()] = float(share)
+    return mix
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the PyProj9 waterbody pipeline on synthetic OSM data.')
+    parser.add_argument('--nodes', type = int, default = 200000, help = 'minimum number of nodes to generate')
+    parser.add_argument('--ways', type = int, default = 20000, help = 'number of ways to generate')
+    parser.add_argument('--mix', type = parseMix, default = defaultMix, help = 'share of each kind of way, e.g. "stream=35,lake=10,other=20"')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed of the random generator')
+    parser.add_argument('--workdir', default = None, help = 'folder for the generated and written files (default: a temporary folder)')
+    parser.add_argument('--report', default = None, help = 'JSON file the results are written to (default: standard output)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tempFolder:
+        workFolder = args.workdir or tempFolder
+        jsonFile = os.path.join(workFolder, 'bench_input.json')
+        nodeCount = generateOSM(jsonFile, args.nodes, args.ways, args.mix, args.seed)
+        report = {
+            'benchmark': 'PyProj9',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': gitCommit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'parameters': {'nodes': nodeCount, 'ways': args.ways, 'mix': args.mix, 'seed': args.seed,
+                           'inputBytes': os.path.getsize(jsonFile)},
+            'stages': runStages(jsonFile, workFolder),
+        }
+        report['totalSeconds'] = sum(stage['seconds'] for stage in report['stages'])
+
+    text = json.dumps(report, indent = 2)
+    if args.report:
+        with open(args.report, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+    return report
+
+if __name__ == '__main__':
+    main()
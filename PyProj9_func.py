@@ -7,21 +7,61 @@ Any folder paths have been change to empty quotes for privacy and flexibility.
 
 @author: dknight2
 """
-import qgis
-import qgis.core
+import os
+import json
+import struct
+import sqlite3
+import xml.etree.ElementTree as ElementTree
+import itertools
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+from array import array
+import numpy as np
+from PyProjGpkg_func import GeoPackageWriter, wkbCoords, gpkgBlob, registerSpatialFunctions
 
-# abstract class Waterbody is the root class of our hierarchy 
+try:
+    import qgis
+    import qgis.core
+except ImportError:
+    # the measurement functions below also work without QGIS
+    qgis = None
+
+# abstract class Waterbody is the root class of our hierarchy. The classes use __slots__ instead of a
+# per-instance __dict__, and a waterbody created from coordinates only keeps a reference to its (n, 2)
+# coordinate array (usually a slice of a larger array shared by a whole batch); the QgsGeometry is
+# built from it when it is needed, e.g. by toQgsFeature(). This keeps millions of waterbodies small.
 class Waterbody():
+    __slots__ = ('name', 'coords', '_geometry')
     
-    # constructor (can be derived by subclasses)
+    # constructor (can be derived by subclasses); geometry is either a QgsGeometry object or an
+    # (n, 2) array with the lon/lat coordinates of the waterbody
     def __init__(self, name, geometry):
         self.name = name            # instance variable for storing the name of the watebrbody
-        self.geometry = geometry    # instance variable for storing the a QgsGeometry object with the geometry for this waterbody
+        if isinstance(geometry, np.ndarray):
+            self.coords = geometry  # instance variable for storing the coordinates the geometry is built from
+            self._geometry = None
+        else:
+            self.coords = None
+            self._geometry = geometry
+
+    # the QgsGeometry object with the geometry for this waterbody; built on every access when the
+    # waterbody only holds coordinates, so it does not stay in memory
+    @property
+    def geometry(self):
+        if self._geometry is None and self.coords is not None:
+            return self.geometryFromCoords(self.coords)
+        return self._geometry
 
     # abstract static class function for creating a waterbody object if the given way satisfies
     # the required conditions; needs to be overridden by instantiable subclasses 
     def fromOSMWay(way, allNodes):     
         pass
+
+    # class function that creates an object of class cls from a way that has already been matched to cls
+    @classmethod
+    def buildFromWay(cls, way, allNodes):
+        return buildWaterbodies([(cls, way)], allNodes)[0]
     
     # abstract method for creating QgsFeature object for this waterbody;
     # needs to be overridden by instantiable subclasses 
@@ -31,90 +71,92 @@ class Waterbody():
 
 # abstract class LinearWaterBody is derived from class Waterbody
 class LinearWaterbody(Waterbody):
+    __slots__ = ('length',)
     
-    # constructor (can be invoked by derived classes and takes care of the length computation)
-    def __init__(self, name, geometry):
+    # constructor (can be invoked by derived classes and takes care of the length computation);
+    # a length that has already been computed with measureLengths(...) can be passed in
+    def __init__(self, name, geometry, length = None):
         super(LinearWaterbody, self).__init__(name, geometry)
         
-        # calculate length of this linear waterbody
-        qda = qgis.core.QgsDistanceArea() 
-        qda.setEllipsoid('WGS84')
-        length = qda.measureLength(geometry)
+        if length is None and self.coords is not None:
+            length = float(measureLengths([self.coords])[0])
+        elif length is None:
+            # calculate length of this linear waterbody
+            qda = distanceArea()
+            length = qda.convertLengthMeasurement(qda.measureLength(geometry), qgis.core.QgsUnitTypes.DistanceMeters)
 
         # instance variable for storing the length of this linear waterbody
-        self.length = qda.convertLengthMeasurement(length, qgis.core.QgsUnitTypes.DistanceMeters)
-        
-        
+        self.length = length
+
+    # static functions that create the WKB / QgsGeometry for an (n, 2) array of node coordinates
+    def wkbFromCoords(coords):
+        return linestringWkb(coords)
+
+    def geometryFromCoords(coords):
+        return geometryFromWkb(linestringWkb(coords))
 
+    # static function that creates an OsmGeoPackageWriter for a new linear features GeoPackage
+    def openGeoPackage(output):
+        return OsmGeoPackageWriter(output, 'LINESTRING', [('OSM_ID', 'INTEGER'), ('NAME', 'TEXT'), ('TYPE', 'TEXT'), ('LENGTH', 'REAL')])
+
+    # writes the given features (QgsFeatures, waterbody objects or records) to a new GeoPackage
     def toGeoPackage(item, output):
-        layer = qgis.core.QgsVectorLayer('LineString?crs=EPSG:4326&field=NAME:string(255)&field=TYPE:string(255)&field=LENGTH:string(255)', 'Linear Features', 'memory')
-        prov = layer.dataProvider()
-        
-        prov.addFeatures(item)
-        qgis.core.QgsVectorFileWriter.writeAsVectorFormat(layer, output, "utf-8", layer.crs(), "GPKG")
-        
+        with LinearWaterbody.openGeoPackage(output) as writer:
+            writer.writeRecords(toRecord(feature) for feature in item)
     
     # ... you may want to add additional auxiliary methods or class functions to this class definition
 
 
 # abstract class ArealWaterbody is derived from class Waterbody
 class ArealWaterbody(Waterbody):
+    __slots__ = ('area',)
 
-    # constructor (can be invoked by derived classes and takes care of the area computation)
-    def __init__(self, name, geometry):
+    # constructor (can be invoked by derived classes and takes care of the area computation);
+    # an area that has already been computed with measureAreas(...) can be passed in
+    def __init__(self, name, geometry, area = None):
         super(ArealWaterbody, self).__init__(name, geometry)
 
-        # calculate area of this areal waterbody
-        qda = qgis.core.QgsDistanceArea() 
-        qda.setEllipsoid('WGS84')
-        area = qda.measureArea(geometry)
+        if area is None and self.coords is not None:
+            area = float(measureAreas([self.coords])[0])
+        elif area is None:
+            # calculate area of this areal waterbody
+            qda = distanceArea()
+            area = qda.convertAreaMeasurement(qda.measureArea(geometry), qgis.core.QgsUnitTypes.AreaSquareMeters)
 
         # instance variable for storing the length of this areal waterbody
-        self.area = qda.convertAreaMeasurement(area, qgis.core.QgsUnitTypes.AreaSquareMeters)
+        self.area = area
+
+    # static functions that create the WKB / QgsGeometry for an (n, 2) array of node coordinates
+    def wkbFromCoords(coords):
+        return polygonWkb([coords])
+
+    def geometryFromCoords(coords):
+        return geometryFromWkb(polygonWkb([coords]))
+
+    # static function that creates an OsmGeoPackageWriter for a new areal features GeoPackage
+    def openGeoPackage(output):
+        return OsmGeoPackageWriter(output, 'POLYGON', [('OSM_ID', 'INTEGER'), ('NAME', 'TEXT'), ('TYPE', 'TEXT'), ('AREA', 'REAL')])
 
+    # writes the given features (QgsFeatures, waterbody objects or records) to a new GeoPackage
     def toGeoPackage(item, output):
-        layer = qgis.core.QgsVectorLayer('Polygon?crs=EPSG:4326&field=NAME:string(255)&field=TYPE:string(255)&field=AREA:string(255)', 'Areal Features', 'memory')
-        prov = layer.dataProvider()
-        
-        prov.addFeatures(item)
-        qgis.core.QgsVectorFileWriter.writeAsVectorFormat(layer, output, "utf-8", layer.crs(), "GPKG")
+        with ArealWaterbody.openGeoPackage(output) as writer:
+            writer.writeRecords(toRecord(feature) for feature in item)
     # ... you may want to add additional auxiliary methods or class functions to this class definition
 
 
 # class Stream is derived from class LinearWaterBody and can be instantiated
 class Stream(LinearWaterbody):
+    __slots__ = ()
     
     # constructor (calls LinearWaterbody constructor to initialize name, geometry, and length instance variables)
-    def __init__(self, name, geometry):
-        super(Stream,self).__init__(name, geometry)
+    def __init__(self, name, geometry, length = None):
+        super(Stream,self).__init__(name, geometry, length)
 
-    # override the fromOSMWay(...) static class function
+    # override the fromOSMWay(...) static class function; the tag conditions for Streams are
+    # registered in the rule table further down in this script
     def fromOSMWay(way, allNodes):
-        # ... write code that tests whether the way element in parameter 'way' satisfies the tag conditions for Streams;
-        streams = []
-        points = []
-        name = ''
-        for stream in way:
-            if way['type'] == 'way':
-                if 'waterway' in way['tags']:
-                    if way['tags']['waterway'] == 'stream':
-                        streams.append(way)
-        for way in streams:
-            # getting the name information
-            if 'name' in way['tags']:
-                # getting the name information
-                name = way['tags']['name']
-            else:
-                name = 'unknown'
-            # Use the node's lat/lon info to create a list of QgsPointXY objects
-            for nid in way['nodes']:
-                node = allNodes[nid]
-                p = qgis.core.QgsPointXY(node['lon'],node['lat'])
-                points.append(p)
-                
-            geometry = qgis.core.QgsGeometry.fromPolylineXY(points)
-            stream = Stream(name, geometry)
-            return stream
+        if Stream in classifyWay(way):
+            return Stream.buildFromWay(way, allNodes)
      
     # override the toQgsFeature(...) method
     def toQgsFeature(self):
@@ -128,39 +170,18 @@ class Stream(LinearWaterbody):
         return 'Name: {}, Type: {} (length: {}m)'.format(self.name, 'Stream', self.length)
    
 class River(LinearWaterbody):
+    __slots__ = ()
     
     # constructor (calls LinearWaterbody constructor to initialize name, geometry, and length instance variables)
-    def __init__(self, name, geometry):
-        super(River,self).__init__(name, geometry)
+    def __init__(self, name, geometry, length = None):
+        super(River,self).__init__(name, geometry, length)
 
-    # override the fromOSMWay(...) static class function
+    # override the fromOSMWay(...) static class function; the tag conditions for Rivers are
+    # registered in the rule table further down in this script
     def fromOSMWay(way, allNodes):
-        # ... write code that tests whether the way element in parameter 'way' satisfies the tag conditions for Streams;
-        rivers = []
-        points = []
-        name = ''
-        for river in way:
-            if way['type'] == 'way':
-                if 'waterway' in way['tags']:
-                    if way['tags']['waterway'] == 'river':
-                        rivers.append(way)
-        for way in rivers:
-            # getting the name information
-            if 'name' in way['tags']:
-                # getting the name information
-                name = way['tags']['name']
-            else:
-                name = 'unknown'
-            # Use the node's lat/lon info to create a list of QgsPointXY objects
-            for nid in way['nodes']:
-                node = allNodes[nid]
-                p = qgis.core.QgsPointXY(node['lon'],node['lat'])
-                points.append(p)
-                
-            geometry = qgis.core.QgsGeometry.fromPolylineXY(points)            
-            river = River(name, geometry)        
-            return river
-
+        if River in classifyWay(way):
+            return River.buildFromWay(way, allNodes)
+     
     # override the toQgsFeature(...) method
     def toQgsFeature(self):
 
@@ -174,38 +195,17 @@ class River(LinearWaterbody):
         return 'Name: {}, Type: {} (length: {}m)'.format(self.name, 'River', self.length)
 
 class Canal(LinearWaterbody):
+    __slots__ = ()
     
     # constructor (calls LinearWaterbody constructor to initialize name, geometry, and length instance variables)
-    def __init__(self, name, geometry):
-        super(Canal,self).__init__(name, geometry)
+    def __init__(self, name, geometry, length = None):
+        super(Canal,self).__init__(name, geometry, length)
 
-    # override the fromOSMWay(...) static class function
+    # override the fromOSMWay(...) static class function; the tag conditions for Canals are
+    # registered in the rule table further down in this script
     def fromOSMWay(way, allNodes):
-        # ... write code that tests whether the way element in parameter 'way' satisfies the tag conditions for Streams;
-        canals = []
-        points = []
-        name = ''
-        for canal in way:
-            if way['type'] == 'way':
-                if 'waterway' in way['tags']:
-                    if way['tags']['waterway'] == 'canal':
-                        canals.append(way)
-        for way in canals:
-            # getting the name information
-            if 'name' in way['tags']:
-                # getting the name information
-                name = way['tags']['name']
-            else:
-                name = 'unknown'
-            # Use the node's lat/lon info to create a list of QgsPointXY objects
-            for nid in way['nodes']:
-                node = allNodes[nid]
-                p = qgis.core.QgsPointXY(node['lon'],node['lat'])
-                points.append(p)
-                
-            geometry = qgis.core.QgsGeometry.fromPolylineXY(points)           
-            canal = Canal(name, geometry)            
-            return canal
+        if Canal in classifyWay(way):
+            return Canal.buildFromWay(way, allNodes)
      
     # override the toQgsFeature(...) method
     def toQgsFeature(self):
@@ -219,39 +219,17 @@ class Canal(LinearWaterbody):
         return 'Name: {}, Type: {} (length: {}m)'.format(self.name, 'Canal', self.length)
 
 class Lake(ArealWaterbody):
+    __slots__ = ()
     
     # constructor (calls LinearWaterbody constructor to initialize name, geometry, and length instance variables)
-    def __init__(self, name, geometry):
-        super(Lake,self).__init__(name, geometry)
+    def __init__(self, name, geometry, area = None):
+        super(Lake,self).__init__(name, geometry, area)
 
-    # override the fromOSMWay(...) static class function
+    # override the fromOSMWay(...) static class function; the tag conditions for Lakes are
+    # registered in the rule table further down in this script
     def fromOSMWay(way, allNodes):
-        # ... write code that tests whether the way element in parameter 'way' satisfies the tag conditions for Streams;
-        lakes = []
-        points = []
-        name = ''
-        for lake in way:
-            if way['type'] == 'way':
-                if 'natural' in way['tags']:
-                    if 'water' in way['tags']:
-                        if way['tags']['water'] == 'lake':
-                            lakes.append(way)
-
-        for item in lakes:
-            if 'name' in item['tags']:
-                name = item['tags']['name']
-            else:
-                name = 'unknown'
-        
-        # Use the node's lat/lon info to create a list of QgsPointXY objects
-            for nid in way['nodes']:
-                node = allNodes[nid]
-                p = qgis.core.QgsPointXY(node['lon'],node['lat'])
-                points.append(p)
-                   
-            geometry = qgis.core.QgsGeometry.fromPolygonXY([points])
-            lake = Lake(name, geometry)
-            return lake
+        if Lake in classifyWay(way):
+            return Lake.buildFromWay(way, allNodes)
      
     # override the toQgsFeature(...) method
     def toQgsFeature(self):
@@ -265,39 +243,17 @@ class Lake(ArealWaterbody):
         return 'Name: {}, Type: {} (area: {} square m)'.format(self.name, 'Lake', self.area)
 
 class Pond(ArealWaterbody):
+    __slots__ = ()
     
     # constructor (calls LinearWaterbody constructor to initialize name, geometry, and length instance variables)
-    def __init__(self, name, geometry):
-        super(Pond,self).__init__(name, geometry)
+    def __init__(self, name, geometry, area = None):
+        super(Pond,self).__init__(name, geometry, area)
 
-    # override the fromOSMWay(...) static class function
+    # override the fromOSMWay(...) static class function; the tag conditions for Ponds are
+    # registered in the rule table further down in this script
     def fromOSMWay(way, allNodes):
-        # ... write code that tests whether the way element in parameter 'way' satisfies the tag conditions for Streams;
-        ponds = []
-        points = []
-        name = ''
-        for pond in way:
-            if way['type'] == 'way':
-                if 'natural' in way['tags']:
-                    if 'water' in way['tags']:
-                        if way['tags']['water'] == 'pond':
-                            ponds.append(way)
-
-        for item in ponds:
-            if 'name' in item['tags']:
-                name = item['tags']['name']
-            else:
-                name = 'unknown'
-        
-        # Use the node's lat/lon info to create a list of QgsPointXY objects
-            for nid in way['nodes']:
-                node = allNodes[nid]
-                p = qgis.core.QgsPointXY(node['lon'],node['lat'])
-                points.append(p)
-                   
-            geometry = qgis.core.QgsGeometry.fromPolygonXY([points])
-            pond = Pond(name, geometry)
-            return pond
+        if Pond in classifyWay(way):
+            return Pond.buildFromWay(way, allNodes)
      
     # override the toQgsFeature(...) method
     def toQgsFeature(self):
@@ -311,39 +267,17 @@ class Pond(ArealWaterbody):
         return 'Name: {}, Type: {} (area: {} square m)'.format(self.name, 'Pond', self.area)
 
 class Reservoir(ArealWaterbody):
+    __slots__ = ()
     
     # constructor (calls LinearWaterbody constructor to initialize name, geometry, and length instance variables)
-    def __init__(self, name, geometry):
-        super(Reservoir,self).__init__(name, geometry)
+    def __init__(self, name, geometry, area = None):
+        super(Reservoir,self).__init__(name, geometry, area)
 
-    # override the fromOSMWay(...) static class function
+    # override the fromOSMWay(...) static class function; the tag conditions for Reservoirs are
+    # registered in the rule table further down in this script
     def fromOSMWay(way, allNodes):
-        # ... write code that tests whether the way element in parameter 'way' satisfies the tag conditions for Streams;
-        reservoirs = []
-        points = []
-        name = ''
-        for reservoir in way:
-            if way['type'] == 'way':
-                if 'natural' in way['tags']:
-                    if 'water' in way['tags']:
-                        if way['tags']['water'] == 'reservoir':
-                            reservoirs.append(way)
-
-        for item in reservoirs:
-            if 'name' in item['tags']:
-                name = item['tags']['name']
-            else:
-                name = 'unknown'
-        
-        # Use the node's lat/lon info to create a list of QgsPointXY objects
-            for nid in way['nodes']:
-                node = allNodes[nid]
-                p = qgis.core.QgsPointXY(node['lon'],node['lat'])
-                points.append(p)
-                   
-            geometry = qgis.core.QgsGeometry.fromPolygonXY([points])
-            reservoir = Reservoir(name, geometry)
-            return reservoir
+        if Reservoir in classifyWay(way):
+            return Reservoir.buildFromWay(way, allNodes)
      
     # override the toQgsFeature(...) method
     def toQgsFeature(self):
@@ -354,4 +288,864 @@ class Reservoir(ArealWaterbody):
         return feature
        
     def __str__(self):
-        return 'Name: {}, Type: {} (area: {} square m)'.format(self.name, 'Reservoir', self.area)
\ No newline at end of file
+        return 'Name: {}, Type: {} (area: {} square m)'.format(self.name, 'Reservoir', self.area)
+
+# ===========================================
+# rule table for classifying ways
+# ===========================================
+
+# waterbodyRules maps a tag key to a dictionary of tag value -> (waterbody class, required tag). A rule
+# with a required tag only matches if the way also has that tag (e.g. water=lake only counts when the way
+# is tagged natural=*). Each way is looked up once per key, so the cost of classifying a way does not
+# grow with the number of registered classes.
+waterbodyRules = {}
+
+# Registers cls as the waterbody class for ways tagged key=value
+def registerWaterbody(cls, key, value, requires = None):
+    waterbodyRules.setdefault(key, {})[value] = (cls, requires)
+
+# Returns the list of waterbody classes whose rules match the tags of the given way (usually one, empty if none)
+def classifyWay(way):
+    tags = way.get('tags')
+    if way.get('type') != 'way' or not tags:
+        return []
+    return classifyTags(tags)
+
+# Returns the list of waterbody classes whose rules match the given dictionary of OSM tags
+def classifyTags(tags):
+    matches = []
+    for key, rules in waterbodyRules.items():
+        rule = rules.get(tags.get(key))
+        if rule is not None and (rule[1] is None or rule[1] in tags):
+            matches.append(rule[0])
+    return matches
+
+# Returns the name tag of a way, or 'unknown' if it does not have one
+def wayName(way):
+    return way['tags'].get('name', 'unknown')
+
+registerWaterbody(Stream, 'waterway', 'stream')
+registerWaterbody(River, 'waterway', 'river')
+registerWaterbody(Canal, 'waterway', 'canal')
+registerWaterbody(Lake, 'water', 'lake', requires = 'natural')
+registerWaterbody(Pond, 'water', 'pond', requires = 'natural')
+registerWaterbody(Reservoir, 'water', 'reservoir', requires = 'natural')
+
+# ===========================================
+# batch geodesic measurements on WGS84
+# ===========================================
+
+# The functions in this section measure many coordinate sequences at once with NumPy and do not need
+# QGIS. Lengths are summed Vincenty inverse distances on the WGS84 ellipsoid and agree with
+# QgsDistanceArea.measureLength(...) to within a millimetre per segment. Areas are computed on the
+# authalic (equal-area) sphere of WGS84 and agree with QgsDistanceArea.measureArea(...) to within
+# 0.01% for polygons up to a few hundred kilometres across.
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+# Returns a QgsDistanceArea object set up for WGS84; it is only created once and then shared
+_distanceArea = None
+def distanceArea():
+    global _distanceArea
+    if _distanceArea is None:
+        _distanceArea = qgis.core.QgsDistanceArea()
+        _distanceArea.setEllipsoid('WGS84')
+    return _distanceArea
+
+# Concatenates a list of (n, 2) coordinate arrays into one array; also returns the index of the
+# sequence each row belongs to
+def _concatenate(sequences):
+    sizes = np.array([len(seq) for seq in sequences], dtype = np.int64)
+    if sizes.sum() == 0:
+        return np.empty((0, 2)), np.empty(0, dtype = np.int64), sizes
+    coords = np.concatenate([np.asarray(seq, dtype = np.float64).reshape(-1, 2) for seq in sequences])
+    return coords, np.repeat(np.arange(len(sequences)), sizes), sizes
+
+# Vincenty inverse formula for arrays of point pairs given in degrees; returns distances in meters
+def geodesicDistances(lon1, lat1, lon2, lat2, maxIterations = 100):
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    active = np.ones(L.shape, dtype = bool)     # pairs that have not converged yet
+    for _ in range(maxIterations):
+        sinLam, cosLam = np.sin(lam), np.cos(lam)
+        sinSigma = np.hypot(cosU2 * sinLam, cosU1 * sinU2 - sinU1 * cosU2 * cosLam)
+        cosSigma = sinU1 * sinU2 + cosU1 * cosU2 * cosLam
+        sigma = np.arctan2(sinSigma, cosSigma)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            sinAlpha = np.where(sinSigma == 0, 0.0, cosU1 * cosU2 * sinLam / sinSigma)
+            cos2Alpha = 1 - sinAlpha ** 2
+            cos2SigmaM = np.where(cos2Alpha == 0, 0.0, cosSigma - 2 * sinU1 * sinU2 / cos2Alpha)
+        C = f / 16 * cos2Alpha * (4 + f * (4 - 3 * cos2Alpha))
+        newLam = L + (1 - C) * f * sinAlpha * (sigma + C * sinSigma * (cos2SigmaM + C * cosSigma * (-1 + 2 * cos2SigmaM ** 2)))
+        active = np.abs(newLam - lam) > 1e-12
+        lam = np.where(active, newLam, lam)
+        if not active.any():
+            break
+    # nearly antipodal pairs may not converge; they keep the value of the last iteration
+
+    u2 = cos2Alpha * (a * a - b * b) / (b * b)
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    deltaSigma = B * sinSigma * (cos2SigmaM + B / 4 * (cosSigma * (-1 + 2 * cos2SigmaM ** 2)
+                 - B / 6 * cos2SigmaM * (-3 + 4 * sinSigma ** 2) * (-3 + 4 * cos2SigmaM ** 2)))
+    return b * A * (sigma - deltaSigma)
+
+# Returns an array with the geodesic length in meters of each of the given (n, 2) lon/lat arrays
+def measureLengths(sequences):
+    coords, seqIndex, sizes = _concatenate(sequences)
+    if len(coords) < 2:
+        return np.zeros(len(sequences))
+    # segments between consecutive rows that belong to the same sequence
+    same = seqIndex[1:] == seqIndex[:-1]
+    p1, p2 = coords[:-1][same], coords[1:][same]
+    distances = geodesicDistances(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1])
+    return np.bincount(seqIndex[:-1][same], weights = distances, minlength = len(sequences))
+
+# Returns the signed area in square meters of each of the given rings (positive for counterclockwise
+# rings); rings do not need to repeat their first point at the end
+def _ringAreas(rings):
+    coords, seqIndex, sizes = _concatenate(rings)
+    if len(coords) == 0:
+        return np.zeros(len(rings))
+    e2 = WGS84_F * (2 - WGS84_F)
+    e = np.sqrt(e2)
+    # authalic latitude and radius of the equal-area sphere
+    def q(sinPhi):
+        return (1 - e2) * (sinPhi / (1 - e2 * sinPhi ** 2) - np.log((1 - e * sinPhi) / (1 + e * sinPhi)) / (2 * e))
+    qp = q(1.0)
+    radius = WGS84_A * np.sqrt(qp / 2)
+    beta = np.arcsin(np.clip(q(np.sin(np.radians(coords[:, 1]))) / qp, -1, 1))
+    lam = np.radians(coords[:, 0])
+
+    # index of the next point of each point within its ring (the last point connects back to the first)
+    starts = np.cumsum(sizes) - sizes
+    nxt = np.arange(len(coords)) + 1
+    nonEmpty = sizes > 0
+    nxt[(starts + sizes - 1)[nonEmpty]] = starts[nonEmpty]
+
+    # spherical excess of the trapezoid between each edge and the equator
+    dLam = np.remainder(lam[nxt] - lam + np.pi, 2 * np.pi) - np.pi
+    t1, t2 = np.tan(beta / 2), np.tan(beta[nxt] / 2)
+    excess = 2 * np.arctan2(np.tan(dLam / 2) * (t1 + t2), 1 + t1 * t2)
+    return -np.bincount(seqIndex, weights = excess, minlength = len(rings)) * radius ** 2
+
+# Returns an array with the geodesic area in square meters of each polygon. A polygon is either an
+# (n, 2) lon/lat array with its boundary or a list of such arrays where the first is the outer ring
+# and the others are holes.
+def measureAreas(polygons):
+    rings = []
+    owner = []
+    holes = []
+    for i, polygon in enumerate(polygons):
+        polygonRings = [polygon] if isinstance(polygon, np.ndarray) else polygon
+        for r, ring in enumerate(polygonRings):
+            rings.append(ring)
+            owner.append(i)
+            holes.append(r > 0)
+    areas = np.abs(_ringAreas(rings))
+    areas[np.array(holes, dtype = bool)] *= -1
+    return np.bincount(np.array(owner, dtype = np.int64), weights = areas, minlength = len(polygons))
+
+# Creates waterbody objects for a list of (class, way) pairs. The nodes of all ways are gathered from
+# allNodes and the lengths/areas are measured in two batches, one for the linear and one for the areal
+# classes. The objects are returned in the order of the pairs; their coordinates are slices of one
+# array for the whole batch and their geometries are only built when needed.
+def buildWaterbodies(matches, allNodes):
+    coords, measures = _measureMatches(matches, allNodes)
+    if not matches:
+        return []
+    batch = np.concatenate(coords)
+    ends = np.cumsum([len(c) for c in coords]).tolist()
+    starts = [0] + ends[:-1]
+    return [cls(wayName(way), batch[starts[i]:ends[i]], measures[i]) for i, (cls, way) in enumerate(matches)]
+
+# Same as buildWaterbodies(...), but returns plain (OSM way id, name, type, measurement, WKB, node ids)
+# records instead of objects, split into a list of linear and a list of areal records. Records do not
+# need QGIS and can be passed between processes.
+def waterbodyRecords(matches, allNodes):
+    coords, measures = _measureMatches(matches, allNodes)
+    linearRecords = []
+    arealRecords = []
+    for i, (cls, way) in enumerate(matches):
+        record = (way.get('id'), wayName(way), cls.__name__, measures[i], cls.wkbFromCoords(coords[i]), way['nodes'])
+        if issubclass(cls, LinearWaterbody):
+            linearRecords.append(record)
+        else:
+            arealRecords.append(record)
+    return linearRecords, arealRecords
+
+def _measureMatches(matches, allNodes):
+    coords = [wayCoords(way, allNodes) for cls, way in matches]
+    measures = [None] * len(matches)
+    linear = [i for i, (cls, way) in enumerate(matches) if issubclass(cls, LinearWaterbody)]
+    areal = [i for i, (cls, way) in enumerate(matches) if not issubclass(cls, LinearWaterbody)]
+    for i, length in zip(linear, measureLengths([coords[i] for i in linear])):
+        measures[i] = float(length)
+    for i, area in zip(areal, measureAreas([coords[i] for i in areal])):
+        measures[i] = float(area)
+    return coords, measures
+
+# Turns a QgsFeature or waterbody object into a record as created by waterbodyRecords(...) (without
+# OSM way id and node ids); records are returned unchanged
+def toRecord(item):
+    if isinstance(item, tuple):
+        return item
+    if isinstance(item, Waterbody) and item.coords is not None:
+        # no need to build the geometry, the WKB can be written straight from the coordinates
+        measure = item.length if isinstance(item, LinearWaterbody) else item.area
+        return (None, item.name, type(item).__name__, measure, type(item).wkbFromCoords(item.coords), None)
+    if isinstance(item, Waterbody):
+        item = item.toQgsFeature()
+    name, typeName, measure = item.attributes()
+    return (None, name, typeName, float(measure), bytes(item.geometry().asWkb()), None)
+
+# Creates a QgsFeature from a record
+def recordToQgsFeature(record):
+    osmId, name, typeName, measure, wkb, nodeIds = record
+    feature = qgis.core.QgsFeature()
+    feature.setAttributes([name, typeName, measure])
+    feature.setGeometry(geometryFromWkb(wkb))
+    return feature
+
+# ===========================================
+# compact node coordinate store
+# ===========================================
+
+# Returns (index, found) for the given ids in a sorted array: found tells which ids are in it and index
+# is their position (clipped into the array, so it is only meaningful where found is True)
+def sortedFind(sortedIds, ids):
+    if not len(sortedIds):
+        return np.zeros(len(ids), dtype = np.int64), np.zeros(len(ids), dtype = bool)
+    idx = np.minimum(np.searchsorted(sortedIds, ids), len(sortedIds) - 1)
+    return idx, sortedIds[idx] == ids
+
+# Merges the sorted, unique ids (with one row of coords each) into the sorted, unique baseIds and returns
+# the new (ids, coords) arrays; the coordinates of ids that are already in baseIds are replaced
+def mergeSorted(baseIds, baseCoords, ids, coords):
+    idx, found = sortedFind(baseIds, ids)
+    new = ~found
+    positions = np.searchsorted(baseIds, ids[new])
+    mergedIds = np.insert(baseIds, positions, ids[new])
+    mergedCoords = np.insert(baseCoords, positions, coords[new], axis = 0)
+    if found.any():
+        mergedCoords[np.searchsorted(mergedIds, ids[found])] = coords[found]
+    return mergedIds, mergedCoords
+
+# NodeStore keeps the coordinates of the OSM nodes in NumPy arrays instead of a dictionary of decoded
+# JSON objects: a sorted int64 array of node ids and a float64 array with one (lon, lat) row per id.
+# Nodes are first appended to compact array buffers, so loading tens of millions of nodes only costs
+# 24 bytes per node. At the next lookup they are sorted and merged into a small sorted block of recent
+# nodes, which is searched together with the main arrays and only merged into them once it is large,
+# so streams that mix nodes and lookups do not re-sort the whole store at every lookup.
+class NodeStore():
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype = np.int64)            # sorted node ids
+        self.coords = np.empty((0, 2), dtype = np.float64)  # (lon, lat) row for each id in self.ids
+        self._recentIds = np.empty(0, dtype = np.int64)     # sorted block of nodes newer than self.ids
+        self._recentCoords = np.empty((0, 2), dtype = np.float64)
+        self._newIds = array('q')                           # nodes added since the last lookup
+        self._newCoords = array('d')
+
+    def add(self, nid, lon, lat):
+        self._newIds.append(nid)
+        self._newCoords.append(lon)
+        self._newCoords.append(lat)
+
+    # sorts the nodes added since the last lookup and merges them into the block of recent nodes, which is
+    # merged into the main arrays when it has more than max(4096, 4 * sqrt(n)) nodes; if a node id was
+    # added more than once, the coordinates added last are kept
+    def _merge(self):
+        if self._newIds:
+            ids = np.frombuffer(self._newIds, dtype = np.int64)
+            coords = np.frombuffer(self._newCoords, dtype = np.float64).reshape(-1, 2)
+            order = np.argsort(ids, kind = 'stable')
+            ids = ids[order]
+            last = np.append(ids[1:] != ids[:-1], True)
+            self._recentIds, self._recentCoords = mergeSorted(self._recentIds, self._recentCoords, ids[last], coords[order][last])
+            self._newIds = array('q')
+            self._newCoords = array('d')
+        if len(self._recentIds) > max(4096, 4 * int(np.sqrt(len(self.ids)))):
+            self._mergeRecent()
+
+    # merges the block of recent nodes into the main arrays
+    def _mergeRecent(self):
+        if len(self._recentIds):
+            self.ids, self.coords = mergeSorted(self.ids, self.coords, self._recentIds, self._recentCoords)
+            self._recentIds = np.empty(0, dtype = np.int64)
+            self._recentCoords = np.empty((0, 2), dtype = np.float64)
+
+    # merges all nodes into the main arrays
+    def _flush(self):
+        self._merge()
+        self._mergeRecent()
+
+    def __len__(self):
+        self._flush()
+        return len(self.ids)
+
+    # returns a boolean array telling which of the given node ids are in the store
+    def contains(self, nodeIds):
+        self._merge()
+        nodeIds = np.asarray(nodeIds, dtype = np.int64)
+        return sortedFind(self.ids, nodeIds)[1] | sortedFind(self._recentIds, nodeIds)[1]
+
+    def __contains__(self, nid):
+        return bool(self.contains([nid])[0])
+
+    # returns an (n, 2) array with the (lon, lat) of the given node ids, in the given order
+    def lookup(self, nodeIds):
+        self._merge()
+        nodeIds = np.asarray(nodeIds, dtype = np.int64)
+        idx, found = sortedFind(self.ids, nodeIds)
+        recentIdx, recent = sortedFind(self._recentIds, nodeIds)
+        missing = ~(found | recent)
+        if missing.any():
+            raise KeyError(int(nodeIds[missing][0]))
+        coords = self.coords[idx] if len(self.ids) else np.empty((len(nodeIds), 2), dtype = np.float64)
+        if recent.any():
+            coords[recent] = self._recentCoords[recentIdx[recent]]
+        return coords
+
+    # dictionary-style access for code that still expects allNodes[nid]['lon']
+    def __getitem__(self, nid):
+        lon, lat = self.lookup([nid])[0]
+        return {'lon': lon, 'lat': lat}
+
+    # copies the ids and coordinates into one new shared memory block (ids first, then coordinates)
+    # and returns the SharedMemory object; the caller has to close and unlink it
+    def toSharedMemory(self):
+        self._flush()
+        count = len(self.ids)
+        shm = shared_memory.SharedMemory(create = True, size = max(count * 24, 1))
+        np.ndarray(count, dtype = np.int64, buffer = shm.buf)[:] = self.ids
+        np.ndarray((count, 2), dtype = np.float64, buffer = shm.buf, offset = count * 8)[:] = self.coords
+        return shm
+
+    # class function that creates a read-only NodeStore whose arrays are views on the shared memory
+    # block with the given name (as created by toSharedMemory) instead of copies
+    @classmethod
+    def fromSharedMemory(cls, name, count):
+        try:
+            shm = shared_memory.SharedMemory(name = name, track = False)
+        except TypeError:
+            # Python < 3.13; pool workers share the resource tracker of the process that created the
+            # block, so attaching does not cause the block to be removed when a worker ends
+            shm = shared_memory.SharedMemory(name = name)
+        store = cls()
+        store._shm = shm        # keep the block open for as long as the store exists
+        store.ids = np.ndarray(count, dtype = np.int64, buffer = shm.buf)
+        store.coords = np.ndarray((count, 2), dtype = np.float64, buffer = shm.buf, offset = count * 8)
+        return store
+
+    # detaches a store created with fromSharedMemory(...) from its shared memory block
+    def close(self):
+        shm = getattr(self, '_shm', None)
+        if shm is not None:
+            self.ids = np.empty(0, dtype = np.int64)
+            self.coords = np.empty((0, 2), dtype = np.float64)
+            self._shm = None
+            shm.close()
+
+# Returns an (n, 2) array with the coordinates of the nodes of a way; allNodes can be a NodeStore
+# or a dictionary of node id -> node
+def wayCoords(way, allNodes):
+    if isinstance(allNodes, NodeStore):
+        return allNodes.lookup(way['nodes'])
+    return np.array([(allNodes[nid]['lon'], allNodes[nid]['lat']) for nid in way['nodes']], dtype = np.float64)
+
+# Functions that encode (n, 2) coordinate arrays as little-endian WKB without creating point objects
+def linestringWkb(coords):
+    coords = np.ascontiguousarray(coords, dtype = '<f8')
+    return struct.pack('<BII', 1, 2, len(coords)) + coords.tobytes()
+
+def polygonWkb(rings):
+    parts = [struct.pack('<BII', 1, 3, len(rings))]
+    for ring in rings:
+        ring = np.ascontiguousarray(ring, dtype = '<f8')
+        parts.append(struct.pack('<I', len(ring)))
+        parts.append(ring.tobytes())
+    return b''.join(parts)
+
+# Creates a QgsGeometry from WKB bytes
+def geometryFromWkb(wkb):
+    geometry = qgis.core.QgsGeometry()
+    geometry.fromWkb(wkb)
+    return geometry
+
+# ===========================================
+# streaming ingestion of Overpass JSON exports
+# ===========================================
+
+# Generator that yields the entries of the 'elements' array of an Overpass JSON export one at a time.
+# The file is read in chunks of chunkSize characters and each element is decoded on its own, so the
+# memory used does not depend on the size of the file (only on the size of the largest element).
+def iterOSMElements(jsonFile, chunkSize = 1 << 20):
+    decoder = json.JSONDecoder()
+    with open(jsonFile, encoding = "utf8") as file:
+        buffer = ''
+        pos = -1
+        # read until we find the opening bracket of the elements array
+        while pos < 0:
+            chunk = file.read(chunkSize)
+            if not chunk:
+                return
+            buffer += chunk
+            key = buffer.find('"elements"')
+            if key >= 0:
+                pos = buffer.find('[', key)
+        pos += 1
+        eof = False
+
+        while True:
+            # skip whitespace and the commas separating the elements
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                if pos >= len(buffer):
+                    raise ValueError('buffer exhausted')
+                element, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # the element is cut off at the end of the buffer, so read the next chunk and try again
+                if eof:
+                    raise ValueError('Unexpected end of file while reading elements of ' + jsonFile)
+                chunk = file.read(chunkSize)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            pos = end
+            yield element
+
+# Generator that streams an Overpass JSON export and yields its ways as they arrive. Only the lon/lat
+# values of the nodes are kept (in the NodeStore allNodes), and only the id/tags/nodes entries of the ways
+# are passed on. Overpass writes nodes before ways, but ways that reference nodes we have not seen yet
+# are held back and yielded once the whole file has been read.
+# If a list is passed as relations, the multipolygon relations with waterbody tags are appended to it
+# (see multipolygonRecords(...)); the node ids of all ways are then kept in the WayRefStore wayRefs,
+# because the member ways of a relation are usually untagged.
+def streamOSMWays(jsonFile, allNodes, chunkSize = 1 << 20, relations = None, wayRefs = None):
+    pending = []
+    for el in iterOSMElements(jsonFile, chunkSize):
+        if el['type'] == 'node':
+            allNodes.add(el['id'], el['lon'], el['lat'])
+        elif el['type'] == 'relation':
+            relation = waterRelation(el)
+            if relations is not None and relation:
+                relations.append(relation)
+        elif el['type'] == 'way':
+            if wayRefs is not None:
+                wayRefs.add(el['id'], el['nodes'])
+            if 'tags' not in el:    # untagged ways can never be waterbodies
+                continue
+            way = {'type': 'way', 'id': el['id'], 'tags': el['tags'], 'nodes': el['nodes']}
+            if allNodes.contains(way['nodes']).all():
+                yield way
+            else:
+                pending.append(way)
+    for way in pending:
+        yield way
+
+# ===========================================
+# multipolygon relations
+# ===========================================
+
+# WayRefStore keeps the node ids of many ways compactly: all node ids in one int64 array, with the
+# position of each way's ids in a second array, looked up by way id with a binary search
+class WayRefStore():
+
+    def __init__(self):
+        self._newIds = array('q')
+        self._refs = array('q')
+        self._offsets = array('q', [0])
+        self._sortedIds = None
+
+    def add(self, wid, nodeIds):
+        self._newIds.append(wid)
+        self._refs.extend(nodeIds)
+        self._offsets.append(len(self._refs))
+        self._sortedIds = None
+
+    # returns the list of node ids of the way with id wid, or default if the way is not in the store
+    def get(self, wid, default = None):
+        if self._sortedIds is None:
+            ids = np.frombuffer(self._newIds, dtype = np.int64) if self._newIds else np.empty(0, dtype = np.int64)
+            self._order = np.argsort(ids, kind = 'stable')
+            self._sortedIds = ids[self._order]
+        i = np.searchsorted(self._sortedIds, wid)
+        if i >= len(self._sortedIds) or self._sortedIds[i] != wid:
+            return default
+        i = self._order[i]
+        return self._refs[self._offsets[i]:self._offsets[i + 1]].tolist()
+
+# Returns a compact version of an OSM relation element if it is a multipolygon with waterbody tags,
+# otherwise None
+def waterRelation(el):
+    tags = el.get('tags', {})
+    if tags.get('type') != 'multipolygon' or not any(issubclass(c, ArealWaterbody) for c in classifyTags(tags)):
+        return None
+    return {'type': 'relation', 'id': el['id'], 'tags': tags,
+            'members': [(m['ref'], m.get('role', '')) for m in el.get('members', []) if m['type'] == 'way']}
+
+# Joins the given node id lists (the member ways of one role of a relation) into closed rings.
+# The first and last node of every open way are put into a hash table, and each ring is grown by
+# looking up the way that continues at its current end, so the assembly takes linear time. Returns
+# the list of rings (node id lists whose first and last id are equal) and the number of ways that
+# could not be closed into a ring.
+def assembleRings(memberWays):
+    rings = []
+    ends = {}       # node id -> indexes of the open ways that start or end at that node
+    openWays = []
+    for nodeIds in memberWays:
+        if len(nodeIds) < 2:
+            continue
+        if nodeIds[0] == nodeIds[-1]:
+            rings.append(list(nodeIds))
+        else:
+            ends.setdefault(nodeIds[0], []).append(len(openWays))
+            ends.setdefault(nodeIds[-1], []).append(len(openWays))
+            openWays.append(nodeIds)
+
+    used = [False] * len(openWays)
+    broken = 0
+    for start in range(len(openWays)):
+        if used[start]:
+            continue
+        used[start] = True
+        ring = list(openWays[start])
+        count = 1
+        while ring[-1] != ring[0]:
+            nxt = None
+            for i in ends.get(ring[-1], []):
+                if not used[i]:
+                    nxt = i
+                    break
+            if nxt is None:
+                break
+            used[nxt] = True
+            count += 1
+            nodeIds = openWays[nxt]
+            ring.extend(nodeIds[1:] if nodeIds[0] == ring[-1] else nodeIds[-2::-1])
+        if ring[-1] == ring[0]:
+            rings.append(ring)
+        else:
+            broken += count
+    return rings, broken
+
+# Returns a boolean array telling which of the given (n, 2) points lie inside the ring (even-odd rule)
+def pointsInRing(points, ring):
+    points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = ring[:-1, 0], ring[:-1, 1]
+    x2, y2 = ring[1:, 0], ring[1:, 1]
+    crosses = (y1 > y) != (y2 > y)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        xCross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return (crosses & (x < xCross)).sum(axis = 1) % 2 == 1
+
+# Builds areal records (see waterbodyRecords(...)) from multipolygon relations collected by
+# streamOSMWays(...). The outer and inner rings of each relation are assembled from its member ways,
+# each inner ring is assigned to the outer ring that contains it, and every outer ring becomes one
+# polygon feature with its holes, measured with measureAreas(...). wayRefs maps way ids to node id
+# lists (a WayRefStore or a dictionary). The OSM_ID of these features is the negative relation id, so
+# it cannot clash with way ids; they do not take part in applyOsmChange(...). Returns the records and
+# the ids of the relations that could not be assembled (missing member ways or nodes, or no closed
+# outer ring).
+def multipolygonRecords(relations, wayRefs, allNodes):
+    polygons = []       # (relation, class, list of coordinate arrays with the outer ring first)
+    failed = []
+    for relation in relations:
+        cls = [c for c in classifyTags(relation['tags']) if issubclass(c, ArealWaterbody)][0]
+        members = {'outer': [], 'inner': []}
+        missing = False
+        for ref, role in relation['members']:
+            nodeIds = wayRefs.get(ref)
+            if nodeIds is None:
+                missing = True
+                break
+            members['inner' if role == 'inner' else 'outer'].append(nodeIds)
+        if missing:
+            failed.append(relation['id'])
+            continue
+        outerRings, brokenOuter = assembleRings(members['outer'])
+        innerRings, brokenInner = assembleRings(members['inner'])
+        allRings = outerRings + innerRings
+        if not outerRings or not allNodes.contains([nid for ring in allRings for nid in ring]).all():
+            failed.append(relation['id'])
+            continue
+        outers = [allNodes.lookup(ring) for ring in outerRings]
+        holes = [[] for _ in outers]
+        for ring in innerRings:
+            coords = allNodes.lookup(ring)
+            for i, outer in enumerate(outers):
+                if len(outers) == 1 or pointsInRing(coords[:1], outer)[0]:
+                    holes[i].append(coords)
+                    break
+        for outer, inner in zip(outers, holes):
+            polygons.append((relation, cls, [outer] + inner))
+
+    areas = measureAreas([rings for relation, cls, rings in polygons])
+    records = [(-relation['id'], relation['tags'].get('name', 'unknown'), cls.__name__, float(area), polygonWkb(rings), None)
+               for (relation, cls, rings), area in zip(polygons, areas)]
+    return records, failed
+
+# ===========================================
+# parallel extraction
+# ===========================================
+
+# node store of a worker process, attached to the shared memory block by _initExtractWorker
+_workerNodes = None
+
+def _initExtractWorker(name, count):
+    global _workerNodes
+    _workerNodes = NodeStore.fromSharedMemory(name, count)
+
+# classifies and measures one shard of ways in a worker process
+def _extractShard(ways):
+    matches = [(c, way) for way in ways for c in classifyWay(way)]
+    return waterbodyRecords(matches, _workerNodes)
+
+# Generator that classifies and measures the given ways on a pool of worker processes and yields one
+# (linearRecords, arealRecords) tuple per shard of shardSize ways, in the order of the ways. The node
+# coordinates are copied once into a shared memory block that all workers read from. The block is
+# created when the first way arrives, so the nodes have to come before the ways (as they do in
+# Overpass exports); ways that use nodes added after that point are processed in this process at the end.
+def extractParallel(ways, allNodes, processes = None, shardSize = 20000):
+    ways = iter(ways)
+    first = next(ways, None)
+    if first is None:
+        return
+    processes = processes or multiprocessing.cpu_count()
+    shm = allNodes.toSharedMemory()
+    count = len(allNodes)
+    snapshot = NodeStore.fromSharedMemory(shm.name, count)
+    leftovers = []
+    # at most 2 * processes shards are waiting in the pool so memory stays bounded; they are submitted
+    # from this thread (not from a generator the pool consumes), so an error in a worker reaches the
+    # caller and the pool can be terminated and the shared memory freed
+    window = 2 * processes
+    try:
+        with multiprocessing.Pool(processes, initializer = _initExtractWorker, initargs = (shm.name, count)) as pool:
+            pending = collections.deque()
+            shard = []
+            for way in itertools.chain([first], ways):
+                if snapshot.contains(way['nodes']).all():
+                    shard.append(way)
+                else:
+                    leftovers.append(way)
+                if len(shard) >= shardSize:
+                    pending.append(pool.apply_async(_extractShard, (shard,)))
+                    shard = []
+                    if len(pending) >= window:
+                        yield pending.popleft().get()
+            if shard:
+                pending.append(pool.apply_async(_extractShard, (shard,)))
+            while pending:
+                yield pending.popleft().get()
+        if leftovers:
+            yield waterbodyRecords([(c, way) for way in leftovers for c in classifyWay(way)], allNodes)
+    finally:
+        snapshot.close()
+        shm.close()
+        shm.unlink()
+
+# ===========================================
+# incremental updates from osmChange files
+# ===========================================
+
+# Creates the tables in which a waterbody GeoPackage remembers which OSM nodes its ways consist of:
+# the node ids of each way, the ways each node belongs to, and the coordinates of those nodes
+def createOsmTables(connection):
+    connection.execute('CREATE TABLE gpkgext_osm_way_nodes (way_id INTEGER PRIMARY KEY, node_ids BLOB NOT NULL)')
+    connection.execute('CREATE TABLE gpkgext_osm_node_ways (node_id INTEGER NOT NULL, way_id INTEGER NOT NULL)')
+    connection.execute('CREATE TABLE gpkgext_osm_nodes (id INTEGER PRIMARY KEY, lon REAL NOT NULL, lat REAL NOT NULL)')
+    # the gpkgext_ prefix keeps GDAL and QGIS from listing these tables as layers
+    connection.executemany("INSERT INTO gpkg_extensions VALUES (?, NULL, 'pyproj9_osm_nodes', 'OSM node ids of the features, used by applyOsmChange', 'read-write')",
+                           [('gpkgext_osm_way_nodes',), ('gpkgext_osm_node_ways',), ('gpkgext_osm_nodes',)])
+
+# Stores (way id, node id blob) rows and (node id, [lon, lat]) rows in the gpkgext_osm_* tables
+def writeOsmWays(connection, wayRows, nodeRows):
+    connection.executemany('INSERT OR REPLACE INTO gpkgext_osm_way_nodes VALUES (?, ?)', wayRows)
+    connection.executemany('INSERT INTO gpkgext_osm_node_ways VALUES (?, ?)',
+                           ((nid, wayId) for wayId, blob in wayRows for nid in set(np.frombuffer(blob, dtype = np.int64).tolist())))
+    connection.executemany('INSERT OR REPLACE INTO gpkgext_osm_nodes VALUES (?, ?, ?)', ((nid, lon, lat) for nid, (lon, lat) in nodeRows))
+
+# OsmGeoPackageWriter is a GeoPackageWriter for waterbody GeoPackages. The first field has to be the
+# OSM way id, and the writer also stores the node ids of each way and the node coordinates in the
+# gpkgext_osm_* tables that applyOsmChange(...) uses for updates.
+class OsmGeoPackageWriter(GeoPackageWriter):
+
+    def __init__(self, *args, **kwargs):
+        self._wayRows = []
+        self._nodeRows = []
+        super(OsmGeoPackageWriter, self).__init__(*args, **kwargs)
+
+    def _createTables(self, srsWkt, srsOrganization):
+        super(OsmGeoPackageWriter, self)._createTables(srsWkt, srsOrganization)
+        createOsmTables(self.connection)
+        self.connection.commit()
+
+    # adds one feature; nodeIds are the ids of the OSM nodes of the way, in the order of the coordinates in the WKB
+    def write(self, values, wkb, nodeIds = None):
+        if nodeIds is not None:
+            self._wayRows.append((values[0], array('q', nodeIds).tobytes()))
+            self._nodeRows.extend(zip(nodeIds, wkbCoords(wkb).tolist()))
+        super(OsmGeoPackageWriter, self).write(values, wkb)
+
+    # adds (attribute values..., WKB, node ids) records such as the ones created by waterbodyRecords(...)
+    def writeRecords(self, records):
+        for record in records:
+            self.write(record[:-2], record[-2], record[-1])
+
+    def _insertRows(self):
+        super(OsmGeoPackageWriter, self)._insertRows()
+        if self._wayRows:
+            writeOsmWays(self.connection, self._wayRows, self._nodeRows)
+        self._wayRows = []
+        self._nodeRows = []
+
+    def _createIndexes(self):
+        c = self.connection
+        c.execute('CREATE INDEX "idx_{0}_OSM_ID" ON "{0}" ("{1}")'.format(self.tableName, self.fields[0][0]))
+        c.execute('CREATE INDEX idx_gpkgext_osm_node_ways_node_id ON gpkgext_osm_node_ways (node_id)')
+
+# Reads an osmChange (.osc) file and returns two dictionaries: node id -> (lon, lat) and way id -> way
+# (in the format of streamOSMWays); deleted nodes and ways map to None. When an object is changed more
+# than once in the file, the last change wins.
+def readOsmChange(changeFile):
+    changedNodes = {}
+    changedWays = {}
+    action = None
+    for event, el in ElementTree.iterparse(changeFile, events = ('start', 'end')):
+        if event == 'start':
+            if el.tag in ('create', 'modify', 'delete'):
+                action = el.tag
+            continue
+        if el.tag == 'node':
+            nid = int(el.get('id'))
+            changedNodes[nid] = None if action == 'delete' else (float(el.get('lon')), float(el.get('lat')))
+            el.clear()
+        elif el.tag == 'way':
+            wid = int(el.get('id'))
+            if action == 'delete':
+                changedWays[wid] = None
+            else:
+                changedWays[wid] = {'type': 'way', 'id': wid,
+                                    'tags': {tag.get('k'): tag.get('v') for tag in el.iter('tag')},
+                                    'nodes': [int(nd.get('ref')) for nd in el.iter('nd')]}
+            el.clear()
+        elif el.tag == 'relation':
+            el.clear()
+    return changedNodes, changedWays
+
+# Returns a dictionary of class name -> waterbody class for all registered classes
+def waterbodyClasses():
+    return {cls.__name__: cls for rules in waterbodyRules.values() for cls, requires in rules.values()}
+
+# runs a query with a large list of values in the IN (...) clause in pieces
+def _selectIn(connection, query, values, size = 500):
+    rows = []
+    for part in _chunks(list(values), size):
+        rows.extend(connection.execute(query.format(','.join('?' * len(part))), part).fetchall())
+    return rows
+
+# Applies an osmChange file to the linear and areal GeoPackages created by toGeoPackage(...)/openGeoPackage(...).
+# Only ways that were created, modified or deleted in the diff, or that use a node that changed, are
+# touched: changed ways are classified again, ways with changed nodes keep their name and type and get
+# a new geometry and measurement. The features are matched by their OSM_ID. Returns a dictionary with
+# the number of features deleted and written, and the ids of ways whose nodes could not all be found
+# (nodes that are neither in the diff nor in one of the GeoPackages); these ways are left unchanged.
+def applyOsmChange(changeFile, linearOutput, arealOutput):
+    changedNodes, changedWays = readOsmChange(changeFile)
+    outputs = {LinearWaterbody: linearOutput, ArealWaterbody: arealOutput}
+    connections = {}
+    tables = {}
+    for kind, output in outputs.items():
+        connection = sqlite3.connect(output)
+        registerSpatialFunctions(connection)
+        connections[kind] = connection
+        tables[kind] = connection.execute("SELECT table_name FROM gpkg_contents WHERE data_type = 'features'").fetchone()[0]
+    summary = {'deleted': 0, 'written': 0, 'unresolved': []}
+
+    try:
+        # ways that are already in the GeoPackages and use one of the changed nodes, with their stored
+        # name, type and node ids
+        stored = {}
+        for kind, connection in connections.items():
+            wayIds = {row[0] for row in _selectIn(connection, 'SELECT way_id FROM gpkgext_osm_node_ways WHERE node_id IN ({})', changedNodes)}
+            query = ('SELECT t.OSM_ID, t.NAME, t.TYPE, w.node_ids FROM "{}" t JOIN gpkgext_osm_way_nodes w ON w.way_id = t.OSM_ID '
+                     'WHERE t.OSM_ID IN ({{}})').format(tables[kind])
+            for osmId, name, typeName, blob in _selectIn(connection, query, wayIds):
+                stored.setdefault(osmId, []).append((name, typeName, np.frombuffer(blob, dtype = np.int64).tolist()))
+
+        # decide what each affected way becomes: changed ways are classified again from their new tags,
+        # ways that only had node changes keep their classes
+        classes = waterbodyClasses()
+        matches = []
+        for wid, way in changedWays.items():
+            if way is not None:
+                matches.extend((c, way) for c in classifyWay(way))
+        for wid, entries in stored.items():
+            if wid not in changedWays:
+                for name, typeName, nodeIds in entries:
+                    matches.append((classes[typeName], {'type': 'way', 'id': wid, 'tags': {'name': name}, 'nodes': nodeIds}))
+
+        # collect the coordinates of all nodes the new geometries need: first from the GeoPackages,
+        # then the changed nodes on top
+        needed = {nid for cls, way in matches for nid in way['nodes']}
+        allNodes = NodeStore()
+        for connection in connections.values():
+            for nid, lon, lat in _selectIn(connection, 'SELECT id, lon, lat FROM gpkgext_osm_nodes WHERE id IN ({})', needed):
+                allNodes.add(nid, lon, lat)
+        for nid, coords in changedNodes.items():
+            if coords is not None:
+                allNodes.add(nid, coords[0], coords[1])
+        resolved = []
+        for cls, way in matches:
+            if allNodes.contains(way['nodes']).all():
+                resolved.append((cls, way))
+            else:
+                summary['unresolved'].append(way['id'])
+        unresolved = set(summary['unresolved'])
+        linearRecords, arealRecords = waterbodyRecords(resolved, allNodes)
+
+        # replace the old features of the affected ways with the new ones
+        replaced = (set(changedWays) | set(stored)) - unresolved
+        for kind, records in ((LinearWaterbody, linearRecords), (ArealWaterbody, arealRecords)):
+            connection = connections[kind]
+            table = tables[kind]
+            with connection:
+                for part in _chunks(list(replaced), 500):
+                    marks = ','.join('?' * len(part))
+                    summary['deleted'] += connection.execute('DELETE FROM "{}" WHERE OSM_ID IN ({})'.format(table, marks), part).rowcount
+                    connection.execute('DELETE FROM gpkgext_osm_way_nodes WHERE way_id IN ({})'.format(marks), part)
+                    connection.execute('DELETE FROM gpkgext_osm_node_ways WHERE way_id IN ({})'.format(marks), part)
+                # the R-tree triggers keep the spatial index up to date
+                connection.executemany('INSERT INTO "{}" VALUES (NULL, ?, ?, ?, ?, ?)'.format(table),
+                                       ((gpkgBlob(wkb)[0], osmId, name, typeName, measure) for osmId, name, typeName, measure, wkb, nodeIds in records))
+                writeOsmWays(connection, [(r[0], array('q', r[5]).tobytes()) for r in records],
+                             [(nid, xy) for r in records for nid, xy in zip(r[5], wkbCoords(r[4]).tolist())])
+                # moved nodes that are still used by other ways of this GeoPackage
+                connection.executemany('UPDATE gpkgext_osm_nodes SET lon = ?, lat = ? WHERE id = ?',
+                                       ((c[0], c[1], nid) for nid, c in changedNodes.items() if c is not None))
+                connection.execute("UPDATE gpkg_contents SET last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now'), "
+                                   "min_x = (SELECT min(minx) FROM \"rtree_{0}_geom\"), max_x = (SELECT max(maxx) FROM \"rtree_{0}_geom\"), "
+                                   "min_y = (SELECT min(miny) FROM \"rtree_{0}_geom\"), max_y = (SELECT max(maxy) FROM \"rtree_{0}_geom\") "
+                                   "WHERE table_name = ?".format(table), (table,))
+            summary['written'] += len(records)
+    finally:
+        for connection in connections.values():
+            connection.close()
+    return summary
+
+def _chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
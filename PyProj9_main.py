@@ -58,67 +58,109 @@ def arealOut():
        ui.arealOutLE.setText(arealOutput)
        arealOutput = ui.arealOutLE.text() 
     
+# Sends one way straight to the waterbody class(es) its tags match; the matches are buffered so that
+# their lengths and areas can be measured in batches
+def processWay(way):
+    for c in waterbodies.classifyWay(way):
+        pending.append((c, way))
+    if len(pending) >= batchSize:
+        flushPending()
+
+# Measures the buffered matches and writes the resulting features to the output GeoPackages
+def flushPending():
+    linearRecords, arealRecords = waterbodies.waterbodyRecords(pending, nodes)
+    linearWriter.writeRecords(linearRecords)
+    arealWriter.writeRecords(arealRecords)
+    pending.clear()
+
 # Function connected to the Start button to run the operation
 def runFunction():
+    global linearWriter, arealWriter
     try:    
-        with open(jsonFile, encoding = "utf8") as file:
-            data = json.load(file)
+        if osmChangeFile:
+            # only apply the changes in the diff to the GeoPackages of an earlier run
+            waterbodies.applyOsmChange(osmChangeFile, linearOutput, arealOutput)
+            QMessageBox.information(mainWindow, 'Operation Complete!', 'Updating the GeoPackages has been completed!. Please close the windows to exit the program.', QMessageBox.Ok )
+            return
+
+        # the features are written to the GeoPackages as soon as they are measured
+        linearWriter = waterbodies.LinearWaterbody.openGeoPackage(linearOutput)
+        arealWriter = waterbodies.ArealWaterbody.openGeoPackage(arealOutput)
+
+        if parallelWorkers:
+            # classify and measure shards of ways on a pool of worker processes
+            wayStream = waterbodies.streamOSMWays(jsonFile, nodes, relations = relations, wayRefs = wayRefs)
+            for linearRecords, arealRecords in waterbodies.extractParallel(wayStream, nodes, parallelWorkers):
+                linearWriter.writeRecords(linearRecords)
+                arealWriter.writeRecords(arealRecords)
+        elif streamingInput:
+            # parse the elements one at a time and classify the ways as they arrive
+            for way in waterbodies.streamOSMWays(jsonFile, nodes, relations = relations, wayRefs = wayRefs):
+                processWay(way)
+        else:
+            with open(jsonFile, encoding = "utf8") as file:
+                data = json.load(file)
         
-        elements = data['elements']
+            elements = data['elements']
 
-        for el in elements:
-            if el['type'] == 'node':
-                nodes[el['id']] = el
-            if el['type'] == 'way':
-                ways[el['id']] = el
+            for el in elements:
+                if el['type'] == 'node':
+                    nodes.add(el['id'], el['lon'], el['lat'])
+                if el['type'] == 'way':
+                    ways[el['id']] = el
+                    wayRefs.add(el['id'], el['nodes'])
+                if el['type'] == 'relation' and waterbodies.waterRelation(el):
+                    relations.append(waterbodies.waterRelation(el))
                 
-        for way in ways:
-            way = ways[way]
-            for c in linearClasses:
-                result = c.fromOSMWay(way, nodes)
-                if result:
-                    feat = result.toQgsFeature()
-                    linesList.append(feat)
-            for c in arealClasses:
-                result = c.fromOSMWay(way, nodes)
-                if result:
-                    feat = result.toQgsFeature()
-                    arealList.append(feat)
-
-        waterbodies.LinearWaterbody.toGeoPackage(linesList, linearOutput)
-        waterbodies.ArealWaterbody.toGeoPackage(arealList, arealOutput)
+            for way in ways:
+                processWay(ways[way])
+        flushPending()
+
+        # lakes, ponds and reservoirs that are mapped as multipolygon relations
+        relationRecords, failedRelations = waterbodies.multipolygonRecords(relations, wayRefs, nodes)
+        arealWriter.writeRecords(relationRecords)
+
+        linearWriter.close()
+        arealWriter.close()
         QMessageBox.information(mainWindow, 'Operation Complete!', 'Creating new GeoPackage has been completed!. Please close the windows to exit the program.', QMessageBox.Ok )
     except Exception as e: 
         QMessageBox.information(mainWindow, 'An Error has occurred! ', 'Creating new GeoPackage has failed. Please check inputs and try again!', QMessageBox.Ok )
-#========================================== 
-# create app and main window + dialog GUI 
-# =========================================
-app = QApplication(sys.argv)  
-mainWindow = QMainWindow() 
-ui = PyProj9_gui.Ui_MainWindow() 
-ui.setupUi(mainWindow)
-qgis_prefix = os.getenv("QGIS_PREFIX_PATH")      
-qgis.core.QgsApplication.setPrefixPath(qgis_prefix, True) 
-qgs = qgis.core.QgsApplication([], False)
-qgs.initQgis()
-#========================================== 
-# connect signals 
-#========================================== 
-ui.jsonTB.clicked.connect(selectJson)
-ui.linearOutTB.clicked.connect(linearOut)
-ui.arealOutTB.clicked.connect(arealOut)
-ui.StartPB.clicked.connect(runFunction)
-#================================== 
-# initialize global variables 
-#==================================
-linesList = []
-arealList = []
-linearClasses = [waterbodies.Stream, waterbodies.River, waterbodies.Canal]
-arealClasses = [waterbodies.Lake, waterbodies.Pond, waterbodies.Reservoir]
-nodes = {}
-ways = {}
-#======================================= 
-# run app 
-#======================================= 
-mainWindow.show() 
-sys.exit(app.exec_()) 
\ No newline at end of file
+
+# the GUI is only created when this script is run directly and not when worker processes
+# of the parallel extraction import it
+if __name__ == '__main__':
+    #========================================== 
+    # create app and main window + dialog GUI 
+    # =========================================
+    app = QApplication(sys.argv)  
+    mainWindow = QMainWindow() 
+    ui = PyProj9_gui.Ui_MainWindow() 
+    ui.setupUi(mainWindow)
+    qgis_prefix = os.getenv("QGIS_PREFIX_PATH")      
+    qgis.core.QgsApplication.setPrefixPath(qgis_prefix, True) 
+    qgs = qgis.core.QgsApplication([], False)
+    qgs.initQgis()
+    #========================================== 
+    # connect signals 
+    #========================================== 
+    ui.jsonTB.clicked.connect(selectJson)
+    ui.linearOutTB.clicked.connect(linearOut)
+    ui.arealOutTB.clicked.connect(arealOut)
+    ui.StartPB.clicked.connect(runFunction)
+    #================================== 
+    # initialize global variables 
+    #==================================
+    pending = []                # (class, way) pairs waiting to be measured
+    batchSize = 10000           # number of matched ways that are measured together
+    nodes = waterbodies.NodeStore()     # compact id -> (lon, lat) store for the OSM nodes
+    ways = {}
+    relations = []              # multipolygon relations of lakes, ponds and reservoirs
+    wayRefs = waterbodies.WayRefStore()     # node ids of all ways, for assembling the relations
+    streamingInput = True       # parse the JSON file incrementally instead of loading it with json.load
+    osmChangeFile = ''          # osmChange file to apply to existing outputs instead of rebuilding them from jsonFile
+    parallelWorkers = 0         # number of worker processes for the parallel extraction (0 = run on one core)
+    #======================================= 
+    # run app 
+    #======================================= 
+    mainWindow.show() 
+    sys.exit(app.exec_()) 
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+This is the function script shared by PyProj6_func and PyProj9_func. It holds the GeoPackage
+output both of them use: a writer that creates GeoPackages with the standard library sqlite3
+module (no GDAL, QGIS or ArcGIS needed), the helpers that wrap WKB into GeoPackage geometry
+blobs and read them back, and the R-tree spatial index and its triggers.
+
+@author: dknight2
+"""
+import os
+import struct
+import sqlite3
+from array import array
+import numpy as np
+
+# Returns an (n, 2) array with all coordinates of a 2D WKB geometry (points, lines, polygons and
+# their multi versions), read straight from the WKB bytes
+def wkbCoords(wkb):
+    parts = []
+    def read(pos):
+        order = '<' if wkb[pos] == 1 else '>'
+        geomType = struct.unpack_from(order + 'I', wkb, pos + 1)[0] % 1000
+        pos += 5
+        if geomType == 1:
+            parts.append(np.frombuffer(wkb, dtype = order + 'f8', count = 2, offset = pos))
+            return pos + 16
+        if geomType == 2:
+            n = struct.unpack_from(order + 'I', wkb, pos)[0]
+            parts.append(np.frombuffer(wkb, dtype = order + 'f8', count = 2 * n, offset = pos + 4))
+            return pos + 4 + 16 * n
+        if geomType == 3:
+            rings = struct.unpack_from(order + 'I', wkb, pos)[0]
+            pos += 4
+            for _ in range(rings):
+                n = struct.unpack_from(order + 'I', wkb, pos)[0]
+                parts.append(np.frombuffer(wkb, dtype = order + 'f8', count = 2 * n, offset = pos + 4))
+                pos += 4 + 16 * n
+            return pos
+        if geomType in (4, 5, 6, 7):
+            n = struct.unpack_from(order + 'I', wkb, pos)[0]
+            pos += 4
+            for _ in range(n):
+                pos = read(pos)
+            return pos
+        raise ValueError('Unsupported WKB geometry type ' + str(geomType))
+    read(0)
+    if not parts:
+        return np.empty((0, 2))
+    return np.concatenate(parts).reshape(-1, 2)
+
+# Wraps WKB into a GeoPackage geometry blob with an xy envelope; returns the blob and the
+# envelope (minx, maxx, miny, maxy), which is None for empty geometries
+def gpkgBlob(wkb, srsId = 4326):
+    coords = wkbCoords(wkb)
+    coords = coords[~np.isnan(coords).any(axis = 1)]
+    if len(coords) == 0:
+        return b'GP' + struct.pack('<BBi', 0, 0x11, srsId) + wkb, None
+    envelope = (coords[:, 0].min(), coords[:, 0].max(), coords[:, 1].min(), coords[:, 1].max())
+    return b'GP' + struct.pack('<BBi4d', 0, 0x03, srsId, *envelope) + wkb, envelope
+
+# Reads the envelope (minx, maxx, miny, maxy) of a GeoPackage geometry blob; None if it is empty
+def gpkgEnvelope(blob):
+    if blob is None or blob[3] & 0x10:
+        return None
+    if (blob[3] >> 1) & 0x07:
+        order = '<' if blob[3] & 0x01 else '>'
+        return struct.unpack_from(order + '4d', blob, 8)
+    return gpkgBlob(gpkgWkb(blob))[1]
+
+# Returns the WKB part of a GeoPackage geometry blob
+def gpkgWkb(blob):
+    envelopeSizes = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+    return bytes(blob[8 + envelopeSizes[(blob[3] >> 1) & 0x07]:])
+
+# Registers the ST_ functions used by the GeoPackage R-tree triggers, so that the triggers also work
+# on connections that do not have SpatiaLite or GDAL loaded
+def registerSpatialFunctions(connection):
+    def envelopeValue(i):
+        def value(blob):
+            envelope = gpkgEnvelope(blob)
+            return None if envelope is None else envelope[i]
+        return value
+    for i, name in enumerate(['ST_MinX', 'ST_MaxX', 'ST_MinY', 'ST_MaxY']):
+        connection.create_function(name, 1, envelopeValue(i), deterministic = True)
+    connection.create_function('ST_IsEmpty', 1, lambda blob: 1 if blob is None or gpkgEnvelope(blob) is None else 0, deterministic = True)
+
+# GeoPackageWriter writes features to a new GeoPackage with the standard library sqlite3 module.
+# Features are inserted in large batched transactions, only their envelopes are kept in memory, and
+# the R-tree spatial index is filled in one go when the writer is closed. Attribute fields are given
+# as (name, SQLite type) pairs, so numbers like LENGTH and AREA are stored as REAL.
+# Subclasses that keep extra tables next to the features (like PyProj9_func.OsmGeoPackageWriter)
+# extend _createTables, _insertRows and _createIndexes.
+class GeoPackageWriter():
+
+    WGS84_DEFINITION = ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+                        'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+                        'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+                        'AUTHORITY["EPSG","4326"]]')
+
+    # output: path of the GeoPackage (an existing file is replaced); the table is named after the file
+    # like QgsVectorFileWriter does. srsWkt is only needed for coordinate systems other than EPSG:4326,
+    # which are registered with srsOrganization ('NONE' when srsId is not an EPSG code). With
+    # replace = False the table is added to an existing GeoPackage, so one file can hold several layers.
+    def __init__(self, output, geometryType, fields, srsId = 4326, srsWkt = None, tableName = None, batchSize = 50000,
+                 srsOrganization = 'NONE', replace = True):
+        self.output = output
+        self.geometryType = geometryType
+        self.fields = fields
+        self.srsId = srsId
+        self.tableName = tableName or os.path.splitext(os.path.basename(output))[0]
+        self.batchSize = batchSize
+        self._rows = []
+        self._fids = array('q')
+        self._envelopes = array('d')
+        self._nextFid = 1
+
+        exists = os.path.exists(output)
+        if exists and replace:
+            os.remove(output)
+        self.connection = sqlite3.connect(output)
+        registerSpatialFunctions(self.connection)
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA journal_mode = MEMORY')
+        if not exists or replace:
+            self.connection.execute('PRAGMA application_id = 1196444487')    # 'GPKG'
+            self.connection.execute('PRAGMA user_version = 10200')
+            self._createMetadataTables()
+        self._createTables(srsWkt, srsOrganization)
+
+    # creates the gpkg_* tables every GeoPackage has, with the default coordinate systems
+    def _createMetadataTables(self):
+        c = self.connection
+        c.execute('CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY, '
+                  'organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)')
+        c.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', [
+            ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+            ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+            ('WGS 84 geodetic', 4326, 'EPSG', 4326, self.WGS84_DEFINITION, 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid')])
+        c.execute("CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, "
+                  "description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+                  "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, "
+                  "CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))")
+        c.execute('CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, '
+                  'geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, '
+                  'CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), '
+                  'CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), '
+                  'CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))')
+        c.execute('CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, '
+                  'definition TEXT NOT NULL, scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))')
+
+    # creates the feature table and registers it (and its coordinate system, if that is not there yet)
+    def _createTables(self, srsWkt, srsOrganization):
+        c = self.connection
+        if self.srsId not in (-1, 0, 4326):
+            c.execute('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+                      ('Custom SRS ' + str(self.srsId), self.srsId, srsOrganization, self.srsId, srsWkt or 'undefined', None))
+        columns = ''.join(', "{}" {}'.format(name, sqlType) for name, sqlType in self.fields)
+        c.execute('CREATE TABLE "{}" (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, geom {}{})'.format(self.tableName, self.geometryType, columns))
+        c.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                  (self.tableName, 'features', self.tableName, self.srsId))
+        c.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)', (self.tableName, 'geom', self.geometryType, self.srsId))
+        c.commit()
+        self._insert = 'INSERT INTO "{}" VALUES (?, ?{})'.format(self.tableName, ', ?' * len(self.fields))
+
+    # adds one feature; values are the attribute values in the order of the fields
+    def write(self, values, wkb):
+        blob, envelope = gpkgBlob(wkb, self.srsId)
+        fid = self._nextFid
+        self._nextFid += 1
+        self._rows.append((fid, blob) + tuple(values))
+        if envelope is not None:
+            self._fids.append(fid)
+            self._envelopes.extend(envelope)
+        if len(self._rows) >= self.batchSize:
+            self.flush()
+
+    # adds (attribute values..., WKB) records
+    def writeRecords(self, records):
+        for record in records:
+            self.write(record[:-1], record[-1])
+
+    # inserts the buffered features in one transaction
+    def flush(self):
+        if self._rows:
+            with self.connection:
+                self._insertRows()
+            self._rows = []
+
+    # inserts the buffered rows; called by flush() inside its transaction
+    def _insertRows(self):
+        self.connection.executemany(self._insert, self._rows)
+
+    # creates the indexes the feature table needs besides the R-tree; called by close() inside its transaction
+    def _createIndexes(self):
+        pass
+
+    # writes the remaining features, fills the R-tree index, updates the layer extent and closes the file
+    def close(self):
+        self.flush()
+        c = self.connection
+        envelopes = np.frombuffer(self._envelopes, dtype = np.float64).reshape(-1, 4)
+        rtree = 'rtree_{}_geom'.format(self.tableName)
+        with c:
+            c.execute('CREATE VIRTUAL TABLE "{}" USING rtree(id, minx, maxx, miny, maxy)'.format(rtree))
+            c.executemany('INSERT INTO "{}" VALUES (?, ?, ?, ?, ?)'.format(rtree),
+                          ((fid,) + tuple(env) for fid, env in zip(self._fids, envelopes.tolist())))
+            c.execute("INSERT INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')",
+                      (self.tableName,))
+            createRtreeTriggers(c, self.tableName)
+            self._createIndexes()
+            if len(envelopes):
+                c.execute('UPDATE gpkg_contents SET min_x = ?, max_x = ?, min_y = ?, max_y = ? WHERE table_name = ?',
+                          (envelopes[:, 0].min(), envelopes[:, 1].max(), envelopes[:, 2].min(), envelopes[:, 3].max(), self.tableName))
+        c.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+# Creates the triggers that keep the R-tree index of a GeoPackage table up to date when features are
+# inserted, updated or deleted later on (GeoPackage 1.2 R-tree extension)
+def createRtreeTriggers(connection, tableName):
+    t = tableName
+    r = 'rtree_{}_geom'.format(t)
+    values = 'VALUES (NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom))'
+    triggers = [
+        'CREATE TRIGGER "{r}_insert" AFTER INSERT ON "{t}" WHEN (new.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom)) '
+        'BEGIN INSERT OR REPLACE INTO "{r}" {v}; END',
+        'CREATE TRIGGER "{r}_update1" AFTER UPDATE OF geom ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) '
+        'BEGIN INSERT OR REPLACE INTO "{r}" {v}; END',
+        'CREATE TRIGGER "{r}_update2" AFTER UPDATE OF geom ON "{t}" WHEN OLD.fid = NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) '
+        'BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; END',
+        'CREATE TRIGGER "{r}_update3" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW.geom NOTNULL AND NOT ST_IsEmpty(NEW.geom)) '
+        'BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; INSERT OR REPLACE INTO "{r}" {v}; END',
+        'CREATE TRIGGER "{r}_update4" AFTER UPDATE ON "{t}" WHEN OLD.fid != NEW.fid AND (NEW.geom ISNULL OR ST_IsEmpty(NEW.geom)) '
+        'BEGIN DELETE FROM "{r}" WHERE id IN (OLD.fid, NEW.fid); END',
+        'CREATE TRIGGER "{r}_delete" AFTER DELETE ON "{t}" WHEN old.geom NOT NULL '
+        'BEGIN DELETE FROM "{r}" WHERE id = OLD.fid; END']
+    for trigger in triggers:
+        connection.execute(trigger.format(r = r, t = t, v = values))
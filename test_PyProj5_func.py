@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the AOI index of PyProj5_func: the regular grid and quadtree lookups, the WKB reader and the
+pieces the cut mode makes of lines and polygons that cross the AOI boundaries. The AOIs are small
+rectangle objects with the extent, area and WKB of an arcpy geometry, so no ArcGIS is needed.
+Run with pytest.
+
+@author: dknight2
+"""
+import struct
+import types
+import numpy as np
+import pytest
+from PyProj5_func import AoiIndex, GridIndex, QuadTree, regularGrid, wkbParts
+from PyProj6_func import shapeWkb
+
+# clockwise ring of a rectangle
+def rectangle(xmin, ymin, xmax, ymax):
+    return np.array([(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)], dtype = float)
+
+# the parts of an arcpy polygon geometry that AoiIndex uses
+class Rectangle():
+
+    def __init__(self, xmin, ymin, xmax, ymax):
+        self.extent = types.SimpleNamespace(XMin = xmin, YMin = ymin, XMax = xmax, YMax = ymax)
+        self.area = (xmax - xmin) * (ymax - ymin)
+        self.WKB = shapeWkb(5, [rectangle(xmin, ymin, xmax, ymax)])
+
+# envelopes (xmin, ymin, xmax, ymax) of the given (column, row) cells of a grid
+def gridEnvelopes(origin, cellSize, cells):
+    (x0, y0), (width, height) = origin, cellSize
+    return np.array([(x0 + c * width, y0 + r * height, x0 + (c + 1) * width, y0 + (r + 1) * height) for c, r in cells], dtype = float)
+
+def envelopeAreas(envelopes):
+    return (envelopes[:, 2] - envelopes[:, 0]) * (envelopes[:, 3] - envelopes[:, 1])
+
+# indices of the envelopes that overlap (or touch) the box, tested one by one
+def bruteForce(envelopes, box):
+    return np.flatnonzero((envelopes[:, 0] <= box[2]) & (envelopes[:, 2] >= box[0]) & (envelopes[:, 1] <= box[3]) & (envelopes[:, 3] >= box[1]))
+
+def randomBoxes(rng, count, low, high, size):
+    corners = rng.uniform(low, high, (count, 2))
+    return np.hstack([corners, corners + rng.uniform(0, size, (count, 2))])
+
+# a grid with a negative, offset origin and cells missing in the middle and on the edges
+def test_regularGridWithHoles():
+    rng = np.random.default_rng(7)
+    origin, cellSize = (-35.5, -12.25), (2.5, 4.0)
+    cells = [(c, r) for c in range(8) for r in range(6) if (c + 2 * r) % 5 and (c, r) != (7, 0)]
+    order = rng.permutation(len(cells))
+    envelopes = gridEnvelopes(origin, cellSize, [cells[i] for i in order])
+    grid = regularGrid(envelopes, envelopeAreas(envelopes))
+    assert isinstance(grid, GridIndex)
+    assert np.allclose(grid.origin, origin) and np.allclose(grid.cellSize, cellSize)
+    assert (grid.slots >= 0).sum() == len(cells)
+    for box in randomBoxes(rng, 500, -40, -10, 8):
+        assert grid.query(box).tolist() == bruteForce(envelopes, box).tolist()
+    assert grid.query(np.array([100.0, 100.0, 101.0, 101.0])).size == 0
+
+@pytest.mark.parametrize('change', ['wider', 'misaligned', 'duplicate', 'notFilled'])
+def test_regularGridRejected(change):
+    envelopes = gridEnvelopes((-10.0, 5.0), (2.0, 3.0), [(c, r) for c in range(4) for r in range(3)])
+    areas = envelopeAreas(envelopes)
+    if change == 'wider':
+        envelopes[5, 2] += 1.0
+        areas = envelopeAreas(envelopes)
+    elif change == 'misaligned':
+        envelopes[5] += (0.5, 0.0, 0.5, 0.0)
+    elif change == 'duplicate':
+        envelopes[5] = envelopes[4]
+    else:
+        areas[5] /= 2      # a triangle in its envelope
+    assert regularGrid(envelopes, areas) is None
+
+def test_quadTreeMatchesBruteForce():
+    rng = np.random.default_rng(11)
+    envelopes = randomBoxes(rng, 600, -500, 500, 40)
+    tree = QuadTree(envelopes, leafSize = 4)
+    assert tree.nodeCount > 1
+    for box in randomBoxes(rng, 300, -550, 550, 120):
+        assert tree.query(box).tolist() == bruteForce(envelopes, box).tolist()
+    # envelopes that all have the same center are kept in one leaf
+    same = np.tile([0.0, 0.0, 1.0, 1.0], (50, 1))
+    assert QuadTree(same, leafSize = 4).query(np.array([0.5, 0.5, 2.0, 2.0])).tolist() == list(range(50))
+    assert QuadTree(np.empty((0, 4))).query(np.array([0.0, 0.0, 1.0, 1.0])).size == 0
+
+# WKB of a geometry with coordinates of dims values per point (x, y, then Z and/or M)
+def linearWkb(order, code, paths, dims, rings = False):
+    wkb = struct.pack(order + 'BI', 1 if order == '<' else 0, code)
+    if rings:
+        wkb += struct.pack(order + 'I', len(paths))
+    for path in paths:
+        extra = np.arange(len(path) * (dims - 2), dtype = float).reshape(len(path), dims - 2) + 100
+        wkb += struct.pack(order + 'I', len(path)) + np.hstack([path, extra]).astype(order + 'f8').tobytes()
+    return wkb
+
+def test_wkbPartsZM():
+    ring, hole = rectangle(0, 0, 10, 10), rectangle(2, 2, 4, 4)[::-1]
+    path = np.array([(0.0, 0.0), (3.0, 4.0), (6.0, 0.0)])
+    polygonZ = linearWkb('<', 1003, [ring, hole], 3, rings = True)                                   # ISO Polygon Z
+    lineM = linearWkb('>', 2002, [path], 3)                                                          # ISO LineString M, big endian
+    multiZM = struct.pack('<BII', 1, 3005, 2) + linearWkb('<', 3002, [path], 4) + linearWkb('<', 3002, [path + 1], 4)
+    multiPolygonZ = struct.pack('<BII', 1, 0x80000006, 1) + linearWkb('<', 0x80000003, [ring], 3, rings = True)  # extended WKB
+    for wkb, expected in [(polygonZ, [ring, hole]), (lineM, [path]), (multiZM, [path, path + 1]), (multiPolygonZ, [ring]),
+                          (shapeWkb(5, [ring, hole]), [ring, hole])]:
+        parts = wkbParts(wkb)
+        assert len(parts) == len(expected)
+        for part, points in zip(parts, expected):
+            assert part.shape == points.shape and np.array_equal(part, points)
+    with pytest.raises(ValueError):
+        wkbParts(struct.pack('<BI2d', 1, 1, 0.0, 0.0))
+
+def ringArea(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+# area of a polygon whose outer rings are clockwise and holes counterclockwise
+def polygonArea(parts):
+    return -sum(ringArea(ring) for ring in parts)
+
+def lineLength(parts):
+    return sum(float(np.hypot(*np.diff(path, axis = 0).T).sum()) for path in parts)
+
+# a 3 x 3 grid of 10 x 10 AOIs; name, shape type, parts and the measure of the feature inside the grid
+cutFeatures = [
+    ('acrossRow', 'Polyline', [np.array([(-5.0, 12.0), (35.0, 12.0)])], 30.0),
+    ('diagonal', 'Polyline', [np.array([(1.0, 1.0), (29.0, 29.0)])], 28 * np.sqrt(2)),
+    ('onCellEdge', 'Polyline', [np.array([(10.0, 2.0), (10.0, 8.0)])], 6.0),
+    ('inOneCell', 'Polyline', [np.array([(21.0, 21.0), (24.0, 25.0)])], 5.0),
+    ('overFour', 'Polygon', [rectangle(5, 5, 25, 15)], 200.0),
+    ('withHole', 'Polygon', [rectangle(-5, -5, 28, 28), rectangle(8, 8, 12, 22)[::-1]], 784.0 - 56.0),
+    ('sameAsCell', 'Polygon', [rectangle(10, 10, 20, 20)], 100.0),
+]
+
+@pytest.mark.parametrize('name, shapeType, parts, inside', cutFeatures, ids = [feature[0] for feature in cutFeatures])
+def test_cutPieces(name, shapeType, parts, inside):
+    aois = {'C{}_{}'.format(c, r): Rectangle(c * 10, r * 10, c * 10 + 10, r * 10 + 10) for c in range(3) for r in range(3)}
+    index = AoiIndex(aois)
+    assert index.grid is not None
+    measure = lineLength if shapeType == 'Polyline' else polygonArea
+    total = 0.0
+    for i, envelope in enumerate(index.envelopes):
+        pieces = index.cutParts(i, parts, shapeType)
+        for piece in pieces:
+            assert (piece[:, :2].min(axis = 0) >= envelope[:2] - 1e-9).all() and (piece[:, :2].max(axis = 0) <= envelope[2:] + 1e-9).all()
+        total += measure(pieces)
+    # a line on the edge between two cells belongs to both of them
+    assert total == pytest.approx(inside * (2 if name == 'onCellEdge' else 1), abs = 1e-9)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the numpy clip backend of PyProj6_func. The fixtures are small shapefiles: a square clipper and a
+clipper with a hole, and polygons, lines and points that lie inside, outside, across the boundary of or
+exactly on the clippers. The areas, lengths and feature counts of the clipped output are compared with
+values worked out by hand. Run with pytest.
+
+@author: dknight2
+"""
+import queue
+import sqlite3
+import numpy as np
+import pytest
+from PyProj6_func import (writeShapefile, readShapefile, clipShapefile, pointsInPolygon, ringEdges, orientRings,
+                          dbfValues, MergedOutput)
+
+# the square clipper has object ID 0, the clipper with a hole object ID 1
+square = [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)]
+squareWithHole = [(20, 20), (20, 30), (30, 30), (30, 20), (20, 20)]
+hole = [(24, 24), (26, 24), (26, 26), (24, 26), (24, 24)]
+
+# clockwise ring of a rectangle
+def rectangle(xmin, ymin, xmax, ymax):
+    return [(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]
+
+# counterclockwise ring (a hole) of a rectangle
+def holeRing(xmin, ymin, xmax, ymax):
+    return rectangle(xmin, ymin, xmax, ymax)[::-1]
+
+# name, parts and expected measure in clipper 0 and in clipper 1 (None when the feature is not in the output)
+polygonFeatures = [
+    ('inside', [rectangle(1, 1, 3, 3)], 4.0, None),
+    ('outside', [rectangle(50, 50, 52, 52)], None, None),
+    ('across', [rectangle(8, 2, 12, 4)], 4.0, None),
+    ('identical', [square], 100.0, None),
+    ('withHole', [rectangle(-5, -5, 5, 5), holeRing(1, 1, 2, 2)], 24.0, None),
+    ('overHole', [rectangle(22, 22, 28, 28)], None, 32.0),
+    ('inHole', [rectangle(24.5, 24.5, 25.5, 25.5)], None, None),
+]
+lineFeatures = [
+    ('across', [[(-5, 5), (15, 5)]], 10.0, None),
+    ('inside', [[(1, 1), (4, 1)]], 3.0, None),
+    ('outside', [[(50, 50), (60, 60)]], None, None),
+    ('zigzag', [[(2, -2), (2, 12), (4, 12), (4, -2)]], 20.0, None),
+    ('onBoundary', [[(0, 0), (0, 10)]], 10.0, None),     # the boundary belongs to the polygon
+    ('overHole', [[(20, 25), (30, 25)]], None, 8.0),
+]
+pointFeatures = [
+    ('inside', [[(5, 5)]], 1, None),
+    ('outside', [[(15, 5)]], None, None),
+    ('inHole', [[(25, 25)]], None, None),
+    ('ring', [[(21, 21)]], None, 1),
+]
+
+def record(name):
+    return b' ' + name.encode('ascii').ljust(10)
+
+def writeFeatures(path, shapeType, features):
+    shapes = [[np.array(part, dtype = float) for part in parts] for name, parts, first, second in features]
+    writeShapefile(str(path), shapeType, shapes, [('NAME', 'C', 10, 0)], [record(name) for name, parts, first, second in features])
+    return str(path)
+
+@pytest.fixture
+def clipper(tmp_path):
+    return writeFeatures(tmp_path / 'clipper.shp', 5, [('square', [square], None, None),
+                                                       ('withHole', [squareWithHole, hole], None, None)])
+
+@pytest.fixture
+def targets(tmp_path):
+    return {'polygons': (writeFeatures(tmp_path / 'polygons.shp', 5, polygonFeatures), polygonFeatures),
+            'lines': (writeFeatures(tmp_path / 'lines.shp', 3, lineFeatures), lineFeatures),
+            'points': (writeFeatures(tmp_path / 'points.shp', 1, pointFeatures), pointFeatures)}
+
+def ringArea(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+# area of a polygon whose outer rings are clockwise and holes counterclockwise, as shapefiles want them
+def polygonArea(parts):
+    return -sum(ringArea(ring) for ring in parts)
+
+def lineLength(parts):
+    return sum(float(np.hypot(*np.diff(path, axis = 0).T).sum()) for path in parts)
+
+measures = {'polygons': polygonArea, 'lines': lineLength, 'points': lambda parts: len(parts[0])}
+
+@pytest.mark.parametrize('kind', ['polygons', 'lines', 'points'])
+@pytest.mark.parametrize('oid', [0, 1])
+def test_clipShapefile(tmp_path, clipper, targets, kind, oid):
+    path, features = targets[kind]
+    outFC = str(tmp_path / 'clip_{}_{}.shp'.format(oid, kind))
+    expected = {name: (first, second)[oid] for name, parts, first, second in features if (first, second)[oid] is not None}
+    assert clipShapefile(clipper, path, oid, outFC) == len(expected)
+
+    output = readShapefile(outFC)
+    names = [dbfValues(output.fields, raw, 'ascii')[0].strip() for raw in output.records]
+    assert sorted(names) == sorted(expected)
+    for name, parts in zip(names, output.shapes):
+        assert measures[kind](parts) == pytest.approx(expected[name], abs = 1e-9)
+
+# the small-input path of pointsInPolygon (every edge tested against every point) agrees with the banded one
+def test_pointsInPolygonPaths():
+    rng = np.random.default_rng(3)
+    angles = np.sort(rng.random(40)) * 2 * np.pi
+    radii = 5 + 3 * rng.random(40)
+    ring = np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+    edges = ringEdges(orientRings([np.vstack([ring, ring[:1]])]))
+    points = rng.uniform(-9, 9, (2000, 2))
+    small = pointsInPolygon(points, edges, smallSize = 1 << 30)
+    banded = pointsInPolygon(points, edges, blockSize = 4096, smallSize = 0)
+    assert np.array_equal(small, banded)
+    assert 0 < small.sum() < len(points)
+
+# the merged output of a run replaces the file of an earlier run, also when the run writes no features
+def test_mergedOutputReplaced(tmp_path):
+    path = str(tmp_path / 'merged.gpkg')
+    merger = MergedOutput(path, queue.Queue())
+    merger.queue.put(('clip', 'POINT', [('NAME', 'TEXT')], (4326, None), [(0, 'a', b'\x01\x01\x00\x00\x00' + bytes(16))]))
+    assert merger.close() == 1
+    connection = sqlite3.connect(path)
+    assert connection.execute('SELECT COUNT(*) FROM clip').fetchone() == (1,)
+    connection.close()
+    assert MergedOutput(path, queue.Queue()).close() == 0
+    assert not (tmp_path / 'merged.gpkg').exists()
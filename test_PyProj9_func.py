@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of PyProj9_func: way classification, the node store and the parallel waterbody extraction.
+Run with pytest.
+
+@author: dknight2
+"""
+import signal
+import numpy as np
+from multiprocessing import shared_memory
+import pytest
+import PyProj9_func
+from PyProj9_func import NodeStore, extractParallel, waterbodyRecords, classifyWay, classifyTags, registerWaterbody, Lake, ArealWaterbody
+
+# a rule registered under a key with its own required tag does not change the rules already there
+def test_ruleRequiresPerValue(monkeypatch):
+    class Basin(ArealWaterbody):
+        __slots__ = ()
+    monkeypatch.setitem(PyProj9_func.waterbodyRules, 'water', dict(PyProj9_func.waterbodyRules['water']))
+    registerWaterbody(Basin, 'water', 'basin', requires = 'landuse')
+    assert classifyTags({'water': 'lake', 'natural': 'water'}) == [Lake]
+    assert classifyTags({'water': 'lake', 'landuse': 'basin'}) == []
+    assert classifyTags({'water': 'basin', 'landuse': 'basin'}) == [Basin]
+    assert classifyTags({'water': 'basin', 'natural': 'water'}) == []
+    registerWaterbody(Basin, 'water', 'basin')
+    assert classifyTags({'water': 'basin'}) == [Basin]
+    assert classifyTags({'water': 'lake'}) == []
+
+# nodes added between lookups (with repeated ids, and enough of them to merge the recent block into the
+# main arrays) are found with the coordinates added last
+def test_nodeStoreInterleaved():
+    rng = np.random.default_rng(1)
+    store, expected = NodeStore(), {}
+    for step in range(40):
+        for nid in rng.integers(0, 300000, 5000):
+            lon, lat = rng.random(2)
+            store.add(int(nid), lon, lat)
+            expected[int(nid)] = (lon, lat)
+        asked = rng.integers(0, 300000, 500)
+        assert store.contains(asked).tolist() == [int(nid) in expected for nid in asked]
+        known = [nid for nid in asked if int(nid) in expected]
+        assert np.array_equal(store.lookup(known), np.array([expected[int(nid)] for nid in known]).reshape(-1, 2))
+    with pytest.raises(KeyError):
+        store.lookup([-1])
+    assert len(store) == len(expected)
+    assert store.ids.tolist() == sorted(expected)
+
+# node store with a row of nodes and river ways over pairs of them
+def riverData(wayCount):
+    nodes = NodeStore()
+    for nid in range(1, wayCount + 2):
+        nodes.add(nid, nid * 0.001, 45.0)
+    ways = [{'type': 'way', 'id': i, 'nodes': [i, i + 1], 'tags': {'waterway': 'river', 'name': 'River %d' % i}}
+            for i in range(1, wayCount + 1)]
+    return nodes, ways
+
+# fails the test instead of hanging when extraction does not return
+@pytest.fixture
+def deadline():
+    def expired(signum, frame):
+        raise TimeoutError('extractParallel did not return')
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.alarm(60)
+    yield
+    signal.alarm(0)
+    signal.signal(signal.SIGALRM, previous)
+
+# records the name of every shared memory block made by toSharedMemory
+@pytest.fixture
+def sharedBlocks(monkeypatch):
+    names = []
+    toSharedMemory = NodeStore.toSharedMemory
+    def recorded(self):
+        shm = toSharedMemory(self)
+        names.append(shm.name)
+        return shm
+    monkeypatch.setattr(NodeStore, 'toSharedMemory', recorded)
+    return names
+
+def assertFreed(names):
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name = name)
+
+def test_extractParallelMatchesSerial(deadline, sharedBlocks):
+    nodes, ways = riverData(50)
+    results = list(extractParallel(ways, nodes, processes = 2, shardSize = 7))
+    linear = [record for shardLinear, shardAreal in results for record in shardLinear]
+    expected = waterbodyRecords([(c, way) for way in ways for c in classifyWay(way)], nodes)[0]
+    assert linear and linear == expected
+    assertFreed(sharedBlocks)
+
+def test_extractParallelWorkerError(deadline, sharedBlocks):
+    # the first shard fails while many more are still to be submitted
+    nodes, ways = riverData(2000)
+    ways[2]['tags'] = ['not', 'a', 'dictionary']   # classifyWay raises in the worker
+    with pytest.raises(AttributeError):
+        for result in extractParallel(ways, nodes, processes = 2, shardSize = 5):
+            pass
+    assert sharedBlocks
+    assertFreed(sharedBlocks)